@@ -0,0 +1,477 @@
+"""
+Performance benchmarks for the heat solver and the simulation step of the chain.
+
+Run from anywhere with
+
+    python benchmarks/run_benchmarks.py
+
+This writes the timings and the peak memory of every benchmark to benchmark_results.json, and
+compares them against the committed baseline (benchmarks/baseline.json). Every benchmark is
+repeated, and both the fastest and the median time are stored. A benchmark is reported as a
+regression (and the script exits with a non zero status) if it uses more than --threshold (relative)
+more memory than the baseline, or if both its fastest and its median time are more than --threshold
+slower, by more than the noise floor (the spread of the repetitions, and at least --minimum_seconds).
+
+The baseline is machine dependent, after an intended performance change (or on a new machine)
+it is updated with
+
+    python benchmarks/run_benchmarks.py --update_baseline
+"""
+import json
+import os
+import re
+import os.path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_ROOT)
+# simulate_heat.py imports its neighbours in heat_chain directly
+sys.path.insert(1, os.path.join(REPOSITORY_ROOT, 'heat_chain'))
+
+import heat
+from heat_chain.objective import Objective
+import sample_cache
+import simulate_heat
+
+DEFAULT_BASELINE = os.path.join(REPOSITORY_ROOT, 'benchmarks', 'baseline.json')
+
+
+def measure(function, minimum_time=0.2, setup=None):
+    """
+    Times function (as many repetitions as fit in minimum_time, at least five, after one warm up call),
+    and measures the peak memory allocated during one call (with tracemalloc, which also traces
+    numpy arrays). setup (if given) is called before every call of function, and is not timed.
+
+    :return: dict with 'seconds' (the fastest repetition), 'median_seconds', 'repetitions' and
+             'peak_memory_bytes'
+    """
+    setup = setup or (lambda: None)
+
+    # Warm up (imports, the operator cache and so on)
+    setup()
+    function()
+
+    times = []
+    total_start = time.perf_counter()
+    while len(times) < 5 or time.perf_counter() - total_start < minimum_time:
+        setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    # Measured separately, since tracing slows down the calls
+    setup()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return dict(_timing_statistics(times), peak_memory_bytes=peak_memory)
+
+
+def _timing_statistics(times):
+    return {'seconds': float(np.min(times)),
+            'median_seconds': float(np.median(times)),
+            'repetitions': len(times)}
+
+
+def benchmark_solve_heat_equation(results, resolutions, end_time):
+    coefficients = [0.1, 0.4, 0.8, 0.25, 0.75, 0.45, 0.9, 0.25, 0.85]
+    initial_data = heat.InitialDataControlSine(coefficients)
+
+    for resolution in resolutions:
+        dx = 1.0 / resolution
+        for method in ['time_stepping', 'dst']:
+            name = f'solve_heat_equation/{method}/{resolution}'
+            print(f"Running {name}")
+            results[name] = measure(lambda: heat.solve_heat_equation(initial_data, dx, dx, end_time, method=method))
+
+
+def benchmark_solve_heat_equation_batch(results, number_of_samples, resolution, end_time):
+    x = np.arange(0, 1, 1.0 / resolution)
+    initial_states = heat.InitialDataControlSine(np.random.rand(number_of_samples, 9))(x)
+
+    for dtype in heat.DTYPES:
+        name = f'solve_heat_equation_batch/{dtype}/{number_of_samples}x{resolution}'
+        print(f"Running {name}")
+        results[name] = measure(lambda: heat.solve_heat_equation_batch(initial_states, 1.0 / resolution,
+                                                                       1.0 / resolution, end_time, dtype=dtype))
+
+
+def benchmark_solve_heat_equation_batch_per_sample_q(results, batch_sizes, resolution, end_time):
+    """
+    One diffusion coefficient per sample (the batched tridiagonal solver), against solving the samples
+    one at a time
+    """
+    x = np.arange(0, 1, 1.0 / resolution)
+    dx = 1.0 / resolution
+
+    for number_of_samples in batch_sizes:
+        initial_states = heat.InitialDataControlSine(np.random.rand(number_of_samples, 9))(x)
+        q = 0.5 + np.random.rand(number_of_samples)
+
+        name = f'solve_heat_equation_batch/per_sample_q/{number_of_samples}x{resolution}'
+        print(f"Running {name}")
+        results[name] = measure(lambda: heat.solve_heat_equation_batch(initial_states, dx, dx, end_time, q=q))
+
+        name = f'solve_heat_equation_batch/per_sample_q_one_at_a_time/{number_of_samples}x{resolution}'
+        print(f"Running {name}")
+        results[name] = measure(lambda: [heat.solve_heat_equation_batch(initial_states[sample], dx, dx, end_time,
+                                                                        q=q[sample])
+                                         for sample in range(number_of_samples)])
+
+
+def benchmark_initial_data(results):
+    coefficients = np.random.rand(9)
+    x = np.arange(0, 1, 1.0 / 2048)
+
+    print("Running initial_data")
+    results['initial_data/grid_2048'] = measure(lambda: heat.InitialDataControlSine(coefficients)(x))
+
+    # Many samples at the control points, which is what the chain does
+    batch_coefficients = np.random.rand(4096, 9)
+    control_points = np.array([0.125, 0.25, 0.5, 0.75, 0.825])
+    results['initial_data/batch_4096'] = measure(
+        lambda: heat.InitialDataControlSine(batch_coefficients)(control_points))
+
+
+def benchmark_objective(results):
+    with open(os.path.join(REPOSITORY_ROOT, 'heat_chain', 'objective_parameters.json')) as f:
+        objective = Objective(**json.load(f))
+
+    solutions = np.random.rand(100000, len(objective.control_points))
+
+    print("Running objective")
+    results['objective/call_100000'] = measure(lambda: objective(solutions))
+    results['objective/grad_100000'] = measure(lambda: objective.grad(solutions))
+
+
+def benchmark_sample_cache(results, number_of_samples):
+    """
+    simulate_heat.simulate without the cache (recompute), against looking all the samples up in a
+    cache that has them: in memory (warm), and read from disk first (cold, once per run)
+    """
+    with open(os.path.join(REPOSITORY_ROOT, 'heat_chain', 'objective_parameters.json')) as f:
+        objective_parameters = json.load(f)
+    settings = {'control_points': objective_parameters['control_points'],
+                'end_time': objective_parameters['end_time'],
+                'dx': 1.0 / 2048,
+                'dt': 1.0 / 2048,
+                'richardson_levels': None,
+                'time_integrator': 'crank_nicolson',
+                'dtype': 'float64'}
+    parameters = np.random.rand(number_of_samples, len(objective_parameters['coefficients']) + 1)
+    batch_size = 4096
+
+    cache_directory = tempfile.mkdtemp()
+    try:
+        cache = sample_cache.SampleCache(cache_directory)
+        simulate_heat.simulate(parameters, settings, batch_size, cache)
+
+        print("Running sample_cache")
+        results[f'sample_cache/recompute/{number_of_samples}'] = measure(
+            lambda: simulate_heat.simulate(parameters, settings, batch_size))
+        results[f'sample_cache/warm/{number_of_samples}'] = measure(
+            lambda: simulate_heat.simulate(parameters, settings, batch_size, cache))
+
+        def merge_and_forget():
+            # Every lookup writes its hits, merge them so every cold run reads the same
+            cache.evict()
+            sample_cache._loaded_entries.clear()
+
+        results[f'sample_cache/cold/{number_of_samples}'] = measure(
+            lambda: simulate_heat.simulate(parameters, settings, batch_size, cache), setup=merge_and_forget)
+    finally:
+        sample_cache._loaded_entries.clear()
+        shutil.rmtree(cache_directory)
+
+
+def _process_tree(pid):
+    """
+    pid and all its descendants (mpirun and the process pool start children), found through
+    /proc/<pid>/task/<tid>/children, which is cheap enough to read while the benchmark runs
+    """
+    tree = [pid]
+    for process in tree:
+        try:
+            for thread in os.listdir(f'/proc/{process}/task'):
+                with open(f'/proc/{process}/task/{thread}/children') as f:
+                    tree.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            # Exited meanwhile (or a kernel without the children file, then we only see pid)
+            pass
+
+    return tree
+
+
+def _peak_resident_memory(pid):
+    """
+    The peak resident memory (VmHWM) of the running process in bytes, None if it has exited
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            match = re.search(r'^VmHWM:\s+(\d+) kB', f.read(), re.MULTILINE)
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+    # Zombies no longer have any memory
+    return int(match.group(1)) * 1024 if match is not None else None
+
+
+def _run_and_measure(command, working_directory, environment, poll_interval=0.002):
+    """
+    Runs the command, and returns the wall time and the peak resident memory of the process tree
+    (the sum of the peaks of the process and all its children).
+
+    The peaks are read from /proc/<pid>/status while the processes run (after they are reaped the
+    kernel only reports the peak of the largest child, which for a fork of this script is at least
+    the memory of this script). A process that grows during its last poll_interval is undercounted.
+    """
+    peaks = {}
+
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=working_directory, env=environment,
+                                   stdout=subprocess.DEVNULL, stderr=stderr)
+        while True:
+            for pid in _process_tree(process.pid) if sys.platform.startswith('linux') else []:
+                peak = _peak_resident_memory(pid)
+                if peak is not None:
+                    peaks[pid] = max(peak, peaks.get(pid, 0))
+
+            if process.poll() is not None:
+                break
+            time.sleep(poll_interval)
+        seconds = time.perf_counter() - start
+
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise Exception(f"{' '.join(command)} failed with exit code {process.returncode}:\n"
+                            f"{stderr.read().decode()}")
+
+    return seconds, sum(peaks.values())
+
+
+def _run_repeatedly(command, working_directory, environment, repetitions):
+    measurements = [_run_and_measure(command, working_directory, environment) for _ in range(repetitions)]
+
+    return dict(_timing_statistics([seconds for seconds, _ in measurements]),
+                peak_memory_bytes=max(peak_memory for _, peak_memory in measurements))
+
+
+def benchmark_import_time(results):
+    """
+    Time to start python and import the packages (in a fresh interpreter, ten repetitions). simulate_heat.py
+    does this on every MPI rank in every iteration.
+    """
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join([REPOSITORY_ROOT, os.path.join(REPOSITORY_ROOT, 'heat_chain'),
+                                                 environment.get('PYTHONPATH', '')])
+
+    statements = {'import/python': 'pass',
+                  'import/heat': 'import heat',
+                  'import/plot_info': 'import plot_info',
+                  'import/simulate_heat': 'import simulate_heat'}
+
+    for name, statement in statements.items():
+        print(f"Running {name}")
+        results[name] = _run_repeatedly([sys.executable, '-c', statement], REPOSITORY_ROOT, environment, 10)
+
+
+def benchmark_simulate_heat(results, number_of_samples, number_of_processes):
+    with open(os.path.join(REPOSITORY_ROOT, 'heat_chain', 'objective_parameters.json')) as f:
+        objective_parameters = json.load(f)
+    dimension = len(objective_parameters['coefficients']) + 1
+    number_of_control_points = len(objective_parameters['control_points'])
+
+    simulate_heat = os.path.join(REPOSITORY_ROOT, 'heat_chain', 'simulate_heat.py')
+
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join([REPOSITORY_ROOT, environment.get('PYTHONPATH', '')])
+
+    working_directory = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(REPOSITORY_ROOT, 'heat_chain', 'objective_parameters.json'), working_directory)
+        np.save(os.path.join(working_directory, 'parameters.npy'), np.random.rand(number_of_samples, dimension))
+
+        arguments = ['--input_parameters_file', 'parameters.npy',
+                     '--output_values_files'] + [f'values_{k}.npy' for k in range(number_of_control_points)] + \
+                    ['--starting_sample', '0', '--iteration_number', '0']
+
+        commands = {}
+        for processes in sorted({1, number_of_processes}):
+            commands[f'simulate_heat/process_pool/{processes}'] = [sys.executable, simulate_heat, '--backend',
+                                                                   'process_pool', '--number_of_processes',
+                                                                   str(processes)] + arguments
+            if shutil.which('mpirun') is not None:
+                commands[f'simulate_heat/mpi/{processes}'] = ['mpirun', '-np', str(processes), sys.executable,
+                                                              simulate_heat, '--backend', 'mpi'] + arguments
+
+        for name, command in commands.items():
+            print(f"Running {name}")
+            # The startup of the processes is noisy
+            results[name] = _run_repeatedly(command, working_directory, environment, 5)
+            results[name]['samples_per_second'] = number_of_samples / results[name]['seconds']
+    finally:
+        shutil.rmtree(working_directory)
+
+
+def compare(results, baseline, threshold, minimum_seconds):
+    """
+    Compares the results against the baseline (only the benchmarks found in both)
+
+    A timing is only a regression if both the fastest and the median repetition are more than threshold
+    slower, and the fastest is slower by more than the noise floor: the spread (median - fastest) of
+    the repetitions of either run, and at least minimum_seconds.
+
+    :param threshold: relative increase that counts as a regression
+    :param minimum_seconds: timing differences below this are never regressions (timer noise)
+    :return: list of (name, quantity, baseline value, current value) for every regression
+    """
+    regressions = []
+    for name in results.keys():
+        if name not in baseline:
+            continue
+        result = results[name]
+        baseline_result = baseline[name]
+
+        # Baselines from before the median was stored only have the fastest time
+        median = result.get('median_seconds', result['seconds'])
+        baseline_median = baseline_result.get('median_seconds', baseline_result['seconds'])
+        noise_floor = max(minimum_seconds, median - result['seconds'], baseline_median - baseline_result['seconds'])
+
+        if result['seconds'] - baseline_result['seconds'] > noise_floor and \
+                result['seconds'] > (1 + threshold) * baseline_result['seconds'] and \
+                median > (1 + threshold) * baseline_median:
+            regressions.append((name, 'seconds', baseline_result['seconds'], result['seconds']))
+
+        if result['peak_memory_bytes'] > (1 + threshold) * baseline_result['peak_memory_bytes']:
+            regressions.append((name, 'peak_memory_bytes', baseline_result['peak_memory_bytes'],
+                                result['peak_memory_bytes']))
+
+    return regressions
+
+
+def print_results(results, baseline):
+    print(f"{'benchmark':45} {'seconds':>12} {'median':>12} {'baseline':>12} {'ratio':>7} {'peak memory (MB)':>17}")
+    for name in results.keys():
+        seconds = results[name]['seconds']
+        median = results[name].get('median_seconds', seconds)
+        if name in baseline:
+            baseline_seconds = f"{baseline[name]['seconds']:12.3e}"
+            ratio = f"{seconds / baseline[name]['seconds']:7.2f}"
+        else:
+            baseline_seconds = f"{'-':>12}"
+            ratio = f"{'-':>7}"
+
+        print(f"{name:45} {seconds:12.3e} {median:12.3e} {baseline_seconds} {ratio} "
+              f"{results[name]['peak_memory_bytes'] / 1e6:17.2f}")
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY_ROOT, capture_output=True,
+                                text=True).stdout.strip()
+    except FileNotFoundError:
+        commit = None
+
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'commit': commit}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="""
+Runs the performance benchmarks, and compares them against a stored baseline
+    """)
+
+    parser.add_argument('--output', type=str, default='benchmark_results.json',
+                        help='Output JSON file with the timings and peak memory')
+
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE,
+                        help='Baseline JSON file to compare against')
+
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help='Relative slowdown (or memory increase) that counts as a regression')
+
+    parser.add_argument('--minimum_seconds', type=float, default=1e-4,
+                        help='Slowdowns of less than this many seconds are never regressions (the noise floor '
+                             'is this or the spread of the repetitions, whichever is larger)')
+
+    parser.add_argument('--update_baseline', action='store_true',
+                        help='Store the results as the new baseline instead of comparing')
+
+    parser.add_argument('--max_resolution_exponent', type=int, default=14,
+                        help='solve_heat_equation is run with dx = 2^-k for k = 5, ..., max_resolution_exponent')
+
+    parser.add_argument('--end_time', type=float, default=1.0 / 32,
+                        help='End time for the solve_heat_equation benchmarks')
+
+    parser.add_argument('--number_of_samples', type=int, default=200000,
+                        help='Number of samples for the simulate_heat.py benchmarks')
+
+    parser.add_argument('--number_of_processes', type=int, default=max(2, min(4, os.cpu_count())),
+                        help='Number of processes (N) for the simulate_heat.py benchmarks, which are run '
+                             'with 1 and N processes/ranks')
+
+    parser.add_argument('--skip_simulate_heat', action='store_true',
+                        help='Do not run the end to end simulate_heat.py benchmarks')
+
+    args = parser.parse_args()
+
+    np.random.seed(0)
+
+    results = {}
+    benchmark_solve_heat_equation(results, [2 ** k for k in range(5, args.max_resolution_exponent + 1)],
+                                  args.end_time)
+    benchmark_solve_heat_equation_batch(results, 1024, 512, args.end_time)
+    benchmark_solve_heat_equation_batch_per_sample_q(results, [16, 128, 1024], 512, 0.05)
+    benchmark_initial_data(results)
+    benchmark_objective(results)
+    benchmark_sample_cache(results, 20000)
+    benchmark_import_time(results)
+    if not args.skip_simulate_heat:
+        benchmark_simulate_heat(results, args.number_of_samples, args.number_of_processes)
+
+    output = {'metadata': metadata(), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=4)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(output, f, indent=4)
+        print_results(results, {})
+        print(f"Stored the results as the new baseline in {args.baseline}")
+        sys.exit(0)
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    else:
+        print(f"No baseline found at {args.baseline}, run with --update_baseline to create one")
+        baseline = {}
+
+    print_results(results, baseline)
+
+    regressions = compare(results, baseline, args.threshold, args.minimum_seconds)
+    for name, quantity, baseline_value, value in regressions:
+        print(f"REGRESSION: {name} {quantity}: {value:.3e} (baseline {baseline_value:.3e}, "
+              f"{value / baseline_value:.2f}x)")
+
+    if len(regressions) > 0:
+        sys.exit(1)
@@ -1,2 +1,9 @@
-from .solve_heat_equation import solve_heat_equation
-from .initial_data import InitialDataControlSine
\ No newline at end of file
+from .solve_heat_equation import solve_heat_equation, solve_heat_equation_batch, solve_heat_equation_sine_series, \
+    solve_heat_equation_richardson, iterate_heat_equation, operator_cache_info, clear_operator_cache
+from .adjoint import solve_heat_equation_adjoint
+from .solve_heat_equation_2d import solve_heat_equation_2d
+from .initial_data import InitialDataControlSine, InitialDataControlSine2D
+from .time_grids import time_steps
+from .time_integrators import TIME_INTEGRATORS
+from .instrumentation import instrument, Timings
+from .precision import DTYPES
@@ -0,0 +1,75 @@
+import numpy
+
+from .initial_data import sine_basis
+from .time_grids import scaled_time_steps, richardson_grids, richardson_tableau
+from .time_integrators import mode_amplification_and_derivative
+
+
+def solve_heat_equation_adjoint(coefficients, dt: float, dx: float, end_time: float, evaluation_points,
+                                objective_gradient: callable(numpy.ndarray), q: float = 1.0,
+                                time_integrator: str = 'crank_nicolson', richardson_levels: int = None):
+    """
+    Computes the exact gradient of an objective J(u(evaluation_points, end_time)) with respect to the
+    diffusion coefficient and the sine coefficients of the initial data (see InitialDataControlSine),
+    where u is the discrete solution the chain uses: solve_heat_equation_sine_series, or
+    solve_heat_equation_richardson if richardson_levels is given (see simulate_heat.py).
+
+    In sine mode space the solver is diagonal: every mode is multiplied by a factor G_k(q) through all the
+    time steps (see mode_amplification_and_derivative), so
+
+        u(p_j) = sum_k a_k G_k(q) sin(k pi p_j)
+
+    and with the adjoint w_k = sum_j sin(k pi p_j) dJ/du_j
+
+        dJ/da_k = G_k(q) w_k,    dJ/dq = sum_k a_k G_k'(q) w_k
+
+    The cost is O(number of modes * number of points) (plus the time steps for bdf2), and no
+    trajectory is stored.
+
+    :param coefficients: the coefficients a_k of the initial data
+    :param dt: time step size
+    :param dx: spatial step size
+    :param end_time: final time
+    :param evaluation_points: the points the objective depends on
+    :param objective_gradient: function that computes dJ/du given the values u at the evaluation points
+    :param q: diffusion coefficient
+    :param time_integrator: see solve_heat_equation
+    :param richardson_levels: if given (2 or 3), the values are Richardson extrapolated, see
+                              solve_heat_equation_richardson (requires time_integrator='crank_nicolson')
+    :return: a tuple (values at the evaluation points, dJ/dq, dJ/da (one entry per coefficient))
+    """
+    coefficients = numpy.asarray(coefficients, dtype=numpy.float64)
+    k = numpy.arange(coefficients.shape[0])
+
+    if richardson_levels is None:
+        grids = [(dx, scaled_time_steps(dt, dx, end_time))]
+    else:
+        if time_integrator != 'crank_nicolson':
+            raise Exception("Richardson extrapolation is only supported with time_integrator='crank_nicolson'")
+        grids = richardson_grids(dt, dx, end_time, richardson_levels)
+
+    amplifications = []
+    derivatives = []
+    for level_dx, time_steps in grids:
+        eigenvalues = 4 * numpy.sin(k * numpy.pi * level_dx / 2) ** 2
+        amplification, derivative = mode_amplification_and_derivative(eigenvalues, time_steps, q,
+                                                                       time_integrator)
+        amplifications.append(amplification)
+        derivatives.append(derivative)
+
+    # The extrapolation is linear, so it can be applied to the factors directly
+    if richardson_levels is None:
+        amplification, derivative = amplifications[0], derivatives[0]
+    else:
+        amplification, _ = richardson_tableau(amplifications)
+        derivative, _ = richardson_tableau(derivatives)
+
+    basis = sine_basis(evaluation_points, coefficients.shape[0])
+    values = (coefficients * amplification) @ basis
+
+    adjoint = basis @ numpy.asarray(objective_gradient(values), dtype=numpy.float64)
+
+    gradient_q = numpy.sum(coefficients * derivative * adjoint)
+    gradient_coefficients = amplification * adjoint
+
+    return values, gradient_q, gradient_coefficients
@@ -1,18 +1,142 @@
+import functools
+
 import numpy
 
+# Bases for more points than this are not cached (the key and the basis would both be large)
+MAX_CACHED_POINTS = 16384
+
+
+def _compute_sine_basis(x, number_of_modes: int) -> numpy.ndarray:
+    return numpy.sin(numpy.pi * numpy.outer(numpy.arange(number_of_modes), x))
+
+
+@functools.lru_cache(maxsize=16)
+def _cached_sine_basis(x_bytes: bytes, number_of_points: int, number_of_modes: int) -> numpy.ndarray:
+    x = numpy.frombuffer(x_bytes, dtype=numpy.float64, count=number_of_points)
+
+    basis = _compute_sine_basis(x, number_of_modes)
+
+    # The same array is handed out to every caller
+    basis.setflags(write=False)
+    return basis
+
+
+def sine_basis(x, number_of_modes: int) -> numpy.ndarray:
+    """
+    Computes the matrix with entries sin(k pi x_j) for k = 0, ..., number_of_modes - 1.
+
+    The result is cached per (points, number of modes) for at most MAX_CACHED_POINTS points,
+    so evaluating sine series repeatedly on the same grid only costs a matrix product.
+
+    :param x: the points (any shape, they are flattened)
+    :param number_of_modes: number of modes
+    :return: read only (number_of_modes, x.size) array
+    """
+    x = numpy.ascontiguousarray(x, dtype=numpy.float64)
+    if x.size > MAX_CACHED_POINTS:
+        return _compute_sine_basis(x.ravel(), number_of_modes)
+    return _cached_sine_basis(x.tobytes(), x.size, number_of_modes)
+
 
 class InitialDataControlSine:
+    """
+    Initial data given by the sine series
+
+        u_0(x) = sum_k a_k sin(k pi x)
+
+    The coefficients can either be a vector (a_0, a_1, ...), or a 2D array with
+    one set of coefficients per row, in which case every evaluation gets an extra
+    leading axis (one entry per set of coefficients).
+    """
+
     def __init__(self, coefficients):
         self.coefficients = coefficients
 
     def __call__(self, x):
-        u = numpy.zeros_like(x)
+        return self._evaluate(self.coefficients, x)
 
-        for k, coefficient in enumerate(self.coefficients):
-            u += coefficient  * numpy.sin(k * numpy.pi * x)
+    def exact_solution(self, x, t, q=1):
+        """
+        :param x: the points to evaluate in
+        :param t: the time
+        :param q: diffusion coefficient, either a number or one per set of coefficients
+        """
+        coefficients = numpy.asarray(self.coefficients, dtype=numpy.float64)
+        k = numpy.arange(coefficients.shape[-1])
 
-        return u
+        decay = numpy.exp(-numpy.asarray(q, dtype=numpy.float64)[..., numpy.newaxis] * (k * numpy.pi) ** 2 * t)
 
-    def exact_solution(self, x, t, q=1):
-        return sum(coefficient * numpy.exp(-q * (k * numpy.pi) ** 2 * t) * numpy.sin(
-            k * numpy.pi * x) for k, coefficient in enumerate(self.coefficients))
+        return self._evaluate(coefficients * decay, x)
+
+    @staticmethod
+    def _evaluate(coefficients, x):
+        coefficients = numpy.asarray(coefficients, dtype=numpy.float64)
+        x_shape = numpy.shape(x)
+
+        u = coefficients @ sine_basis(x, coefficients.shape[-1])
+
+        return u.reshape(coefficients.shape[:-1] + x_shape)[()]
+
+
+class InitialDataControlSine2D:
+    """
+    Initial data on the unit square given by the sine product series
+
+        u_0(x, y) = sum_{k, l} a_{k l} sin(k pi x) sin(l pi y)
+
+    The coefficients can either be a (K, L) array, or a 3D array with one (K, L)
+    set of coefficients per entry of the leading axis, in which case every evaluation
+    gets an extra leading axis (one entry per set of coefficients).
+
+    On a tensor grid (x and y from numpy.meshgrid(..., indexing='ij')) the series is
+    evaluated as B_x^T A B_y with the 1D bases of the grid lines, so it only needs
+    O(K N) memory besides the result. Other points are evaluated in blocks.
+    """
+
+    def __init__(self, coefficients):
+        self.coefficients = coefficients
+
+    def __call__(self, x, y):
+        return self._evaluate(self.coefficients, x, y)
+
+    def exact_solution(self, x, y, t, q=1):
+        """
+        :param x: the x coordinates of the points to evaluate in
+        :param y: the y coordinates of the points to evaluate in (same shape as x)
+        :param t: the time
+        :param q: diffusion coefficient, either a number or one per set of coefficients
+        """
+        coefficients = numpy.asarray(self.coefficients, dtype=numpy.float64)
+        k = numpy.arange(coefficients.shape[-2])[:, numpy.newaxis]
+        l = numpy.arange(coefficients.shape[-1])[numpy.newaxis, :]
+
+        q = numpy.asarray(q, dtype=numpy.float64)[..., numpy.newaxis, numpy.newaxis]
+        decay = numpy.exp(-q * ((k * numpy.pi) ** 2 + (l * numpy.pi) ** 2) * t)
+
+        return self._evaluate(coefficients * decay, x, y)
+
+    @staticmethod
+    def _evaluate(coefficients, x, y):
+        coefficients = numpy.asarray(coefficients, dtype=numpy.float64)
+        x, y = numpy.broadcast_arrays(numpy.asarray(x, dtype=numpy.float64), numpy.asarray(y, dtype=numpy.float64))
+        points_shape = x.shape
+
+        if x.ndim == 2 and numpy.all(x == x[:, :1]) and numpy.all(y == y[:1, :]):
+            # sum_{k, l} a_{k l} sin(k pi x_i) sin(l pi y_j) = (B_x^T A B_y)_{i j}
+            basis_x = sine_basis(x[:, 0], coefficients.shape[-2])
+            basis_y = sine_basis(y[0, :], coefficients.shape[-1])
+
+            return (basis_x.T @ coefficients @ basis_y)[()]
+
+        x = x.ravel()
+        y = y.ravel()
+        u = numpy.zeros(coefficients.shape[:-2] + (x.shape[0],))
+        for start in range(0, x.shape[0], MAX_CACHED_POINTS):
+            end = min(x.shape[0], start + MAX_CACHED_POINTS)
+            basis_x = _compute_sine_basis(x[start:end], coefficients.shape[-2])
+            basis_y = _compute_sine_basis(y[start:end], coefficients.shape[-1])
+
+            # sum_{k, l} a_{k l} sin(k pi x_j) sin(l pi y_j) for every point j
+            u[..., start:end] = numpy.einsum('...kl,kj,lj->...j', coefficients, basis_x, basis_y, optimize=True)
+
+        return u.reshape(coefficients.shape[:-2] + points_shape)[()]
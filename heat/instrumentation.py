@@ -0,0 +1,153 @@
+"""
+Optional instrumentation of the solvers.
+
+    with heat.instrument() as timings:
+        heat.solve_heat_equation(...)
+
+    print(timings.as_dict())
+
+records the time spent in the different parts of the solvers (assembly and factorization of the
+matrices, linear solves, building the right hand side, mode evolution, ...) together with the
+number of time steps and linear solves. When no instrumentation is active, the solvers only do
+a check per call (or per batch of equally sized time steps, never per step), so it costs nothing
+in practice.
+"""
+import collections
+import contextlib
+import time
+
+# The Timings currently recording, or None when disabled
+_active_timings = None
+
+
+class _NullSection(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+
+
+class Timings(object):
+    """
+    Accumulated time (in seconds) and counts per named part of the solvers.
+    """
+
+    def __init__(self):
+        self.seconds = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+
+    @contextlib.contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+    def merge(self, other):
+        """
+        Adds the times and counts of other (either Timings or the output of as_dict)
+        """
+        if isinstance(other, Timings):
+            other = other.as_dict()
+
+        for name, seconds in other['seconds'].items():
+            # rhs is derived, see as_dict
+            if name != 'rhs':
+                self.seconds[name] += seconds
+        for name, count in other['counts'].items():
+            self.counts[name] += count
+
+    def as_dict(self):
+        """
+        :return: {'seconds': {...}, 'counts': {...}}. If there was time stepping on the grid, seconds also
+                 has 'rhs', the time stepping time not spent in assembly or linear solves (that is
+                 building the right hand side and updating the state).
+        """
+        seconds = dict(self.seconds)
+        if 'time_stepping' in seconds:
+            seconds['rhs'] = max(0.0, seconds['time_stepping'] - seconds.get('assembly', 0.0)
+                                 - seconds.get('linear_solve', 0.0))
+
+        return {'seconds': seconds, 'counts': dict(self.counts)}
+
+
+class _TimedSolver(object):
+    """
+    Forwards to a factorized solver, and records the time spent in solve
+    """
+
+    def __init__(self, solver, timings):
+        self.solver = solver
+        self.timings = timings
+
+    def solve(self, rhs):
+        start = time.perf_counter()
+        x = self.solver.solve(rhs)
+        self.timings.seconds['linear_solve'] += time.perf_counter() - start
+        self.timings.counts['linear_solves'] += 1
+        return x
+
+
+@contextlib.contextmanager
+def instrument(timings=None):
+    """
+    Records timings of the solvers while active. Can be nested, the innermost one records.
+
+    :param timings: a Timings to add to (a new one by default)
+    :return: the Timings (as the value of the with statement)
+    """
+    global _active_timings
+
+    if timings is None:
+        timings = Timings()
+
+    previous_timings = _active_timings
+    _active_timings = timings
+    try:
+        yield timings
+    finally:
+        _active_timings = previous_timings
+
+
+def active_timings():
+    """
+    :return: the Timings currently recording, or None if the instrumentation is disabled
+    """
+    return _active_timings
+
+
+def section(name):
+    """
+    Times the with block as name if instrumentation is active (and does nothing otherwise)
+    """
+    if _active_timings is None:
+        return _NULL_SECTION
+    return _active_timings.section(name)
+
+
+def count(name, number=1):
+    if _active_timings is not None:
+        _active_timings.counts[name] += number
+
+
+def timed_implicit_solver(implicit_solver):
+    """
+    Wraps a factory of factorized solvers (see iterate_on_grid), so that the assembly and factorization,
+    and every solve with the returned solvers, are timed. Returns implicit_solver unchanged if the
+    instrumentation is disabled.
+    """
+    timings = _active_timings
+    if timings is None:
+        return implicit_solver
+
+    def timed(c):
+        with timings.section('assembly'):
+            solver = implicit_solver(c)
+        return _TimedSolver(solver, timings)
+
+    return timed
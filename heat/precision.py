@@ -0,0 +1,52 @@
+"""
+Floating point precision of the solvers (the dtype argument of solve_heat_equation and friends):
+
+    'float64'   everything in double precision (the default)
+    'float32'   storage and arithmetic in single precision
+    'mixed'     single precision storage (the state on the grid, the inputs and the outputs), while
+                the arithmetic (right hand sides, linear solves, mode evolution and sums over the modes)
+                is done in double precision
+
+Single precision storage halves the memory (and memory bandwidth) of the large batches, at the cost
+of a relative error of about 1e-7 (the rounding of float32) for 'mixed', and somewhat more for 'float32'
+where the round off also accumulates over the time steps (see the accuracy check in the README).
+"""
+import numpy
+
+DTYPES = ['float64', 'float32', 'mixed']
+
+
+def _dtype_name(dtype) -> str:
+    if isinstance(dtype, str) and dtype == 'mixed':
+        return dtype
+    try:
+        return numpy.dtype(dtype).name
+    except TypeError:
+        return str(dtype)
+
+
+def check_dtype(dtype):
+    if _dtype_name(dtype) not in DTYPES:
+        raise Exception(f"Unknown dtype {dtype}, should be one of {DTYPES}")
+
+
+def storage_dtype(dtype) -> numpy.dtype:
+    """
+    :param dtype: see DTYPES
+    :return: the dtype of the arrays (state, inputs and outputs)
+    """
+    check_dtype(dtype)
+    if _dtype_name(dtype) == 'float64':
+        return numpy.dtype(numpy.float64)
+    return numpy.dtype(numpy.float32)
+
+
+def compute_dtype(dtype) -> numpy.dtype:
+    """
+    :param dtype: see DTYPES
+    :return: the dtype the arithmetic is done in
+    """
+    check_dtype(dtype)
+    if _dtype_name(dtype) == 'float32':
+        return numpy.dtype(numpy.float32)
+    return numpy.dtype(numpy.float64)
@@ -1,10 +1,164 @@
+import functools
+
 import numpy
-import scipy.sparse
-import scipy.sparse.linalg
+
+from . import instrumentation, precision
+from .initial_data import InitialDataControlSine
+from .spectral import solve_dst, solve_sine_series
+from .time_grids import scaled_time_steps, richardson_grids, richardson_tableau
+from .time_integrators import check_time_integrator, evolve_on_grid, iterate_on_grid
+from .tridiagonal import SymmetricTridiagonalSolver, BatchedSymmetricTridiagonalSolver
+
+# Maximum number of factorized operators kept alive per process
+OPERATOR_CACHE_SIZE = 64
+
+
+def implicit_operator(number_of_spatial_points: int, c: float,
+                      boundary: str = 'dirichlet', dtype: str = 'float64') -> SymmetricTridiagonalSolver:
+    """
+    Factorizes the matrix of the implicit part of the time integrators, that is
+
+        A = I + c tridiag(-1, 2, -1) = tridiag(-c, 1 + 2 c, -c)
+
+    (for Crank-Nicolson c = h q / 2).
+
+    The result is cached (least recently used) on all the arguments, so repeated
+    solves with the same grid and c skip both the assembly and the factorization.
+    The arguments are normalized first, so implicit_operator(N, c) and
+    implicit_operator(N, c, 'dirichlet', dtype='float64') share one entry.
+    The returned solver is shared between callers and must not be modified.
+
+    :param number_of_spatial_points: number of unknowns (excluding the boundary)
+    :param c: the scaling of the discrete Laplacian, a multiple of h q with h = dt / dx^2
+    :param boundary: boundary conditions, only homogeneous 'dirichlet' is supported
+    :param dtype: the precision of the factorization and the solves ('float64' or 'float32')
+    :return: a factorized solver for A
+    """
+    return _cached_implicit_operator(int(number_of_spatial_points), float(c), str(boundary),
+                                     numpy.dtype(dtype).name)
+
+
+@functools.lru_cache(maxsize=OPERATOR_CACHE_SIZE)
+def _cached_implicit_operator(number_of_spatial_points: int, c: float, boundary: str,
+                              dtype: str) -> SymmetricTridiagonalSolver:
+    # Only called through implicit_operator, which always passes every argument positionally
+    if boundary != 'dirichlet':
+        raise Exception(f"Unsupported boundary conditions {boundary}, only 'dirichlet' is supported.")
+
+    diagonal = (1 + 2 * c) * numpy.ones(number_of_spatial_points)
+    off_diagonal = -c * numpy.ones(number_of_spatial_points - 1)
+
+    return SymmetricTridiagonalSolver(diagonal, off_diagonal, dtype=dtype)
+
+
+def crank_nicolson_operator(number_of_spatial_points: int, h: float, q: float,
+                            boundary: str = 'dirichlet') -> SymmetricTridiagonalSolver:
+    """
+    Factorizes the implicit part of the Crank-Nicolson scheme, that is the matrix
+
+        A = tridiag(-h q / 2, 1 + h q, -h q / 2)
+
+    (cached, see implicit_operator)
+
+    :param number_of_spatial_points: number of unknowns (excluding the boundary)
+    :param h: dt / dx^2
+    :param q: diffusion coefficient
+    :param boundary: boundary conditions, only homogeneous 'dirichlet' is supported
+    :return: a factorized solver for A
+    """
+    return implicit_operator(number_of_spatial_points, h * q / 2, boundary)
+
+
+def _batched_implicit_operator(number_of_spatial_points: int, c: numpy.ndarray,
+                               dtype: str = 'float64') -> BatchedSymmetricTridiagonalSolver:
+    """
+    The same as implicit_operator, but with one c per sample (not cached)
+    """
+    diagonal = numpy.ones((number_of_spatial_points, 1)) * (1 + 2 * c)
+    off_diagonal = numpy.ones((number_of_spatial_points - 1, 1)) * (-c)
+
+    return BatchedSymmetricTridiagonalSolver(diagonal, off_diagonal, dtype=dtype)
+
+
+def operator_cache_info():
+    """
+    :return: hits, misses, maxsize and currsize of the operator cache (see functools.lru_cache)
+    """
+    return _cached_implicit_operator.cache_info()
+
+
+def clear_operator_cache():
+    """
+    Removes all cached operators and resets the hit/miss counters.
+    """
+    _cached_implicit_operator.cache_clear()
+
+
+def _crank_nicolson_step(u: numpy.ndarray, h: float, q: float, implicit_solver) -> numpy.ndarray:
+    """
+    Takes one Crank-Nicolson step (u includes the zero boundary values), and returns the new state
+    """
+    A = implicit_solver(h * q / 2)
+
+    u_next = numpy.zeros_like(u)
+    u_next[1:-1] = A.solve(h * q / 2 * u[:-2] + h * q / 2 * u[2:] + (1 - h * q) * u[1:-1])
+
+    return u_next
+
+
+def _solve_adaptive(u: numpy.ndarray, dt: float, dx: float, end_time: float, q: float, tolerance: float):
+    """
+    Crank-Nicolson with adaptive time steps, see solve_heat_equation.
+
+    The local error is estimated with step doubling (one step against two half steps, which
+    for a second order method differ by three times the error of the two half steps). The step
+    is only ever halved or doubled, so the factorized operators are reused from the cache and
+    we only refactorize when the step actually changes.
+    """
+    number_of_spatial_points = u.shape[0] - 2
+    implicit_solver = instrumentation.timed_implicit_solver(lambda c: implicit_operator(number_of_spatial_points, c))
+
+    t = 0
+    step_size = dt
+    number_of_steps = 0
+    number_of_rejected_steps = 0
+
+    while end_time - t > 1e-12 * end_time:
+        # Land exactly on end_time
+        current_step_size = min(step_size, end_time - t)
+
+        one_step = _crank_nicolson_step(u, current_step_size / dx ** 2, q, implicit_solver)
+
+        half_step = _crank_nicolson_step(u, current_step_size / 2 / dx ** 2, q, implicit_solver)
+        two_half_steps = _crank_nicolson_step(half_step, current_step_size / 2 / dx ** 2, q, implicit_solver)
+
+        error = numpy.max(numpy.abs(two_half_steps - one_step)) / 3
+
+        if error <= tolerance:
+            t += current_step_size
+            u = two_half_steps
+            number_of_steps += 1
+
+            # The local error scales as step^3, so doubling the step should keep us below the tolerance
+            if error <= tolerance / 8 and current_step_size == step_size:
+                step_size *= 2
+        else:
+            step_size /= 2
+            number_of_rejected_steps += 1
+            if step_size < 1e-12 * end_time:
+                raise Exception(f"Adaptive time stepping could not reach the tolerance {tolerance} at t={t}")
+
+    instrumentation.count('steps', number_of_steps)
+    instrumentation.count('rejected_steps', number_of_rejected_steps)
+
+    return u
 
 
 def solve_heat_equation(initial_data: callable(numpy.ndarray), dt: float, dx: float, end_time: float, a: float = 0.0,
-                        b: float = 1, q: float = 1.0):
+                        b: float = 1, q: float = 1.0, method: str = 'time_stepping', evaluation_points=None,
+                        evaluation_indices=None, adaptive: bool = False, tolerance: float = 1e-6,
+                        richardson_levels: int = None, time_integrator: str = 'crank_nicolson',
+                        dtype: str = 'float64'):
     """
     Solves the heat equation on the domain [a, b]
 
@@ -20,50 +174,313 @@ def solve_heat_equation(initial_data: callable(numpy.ndarray), dt: float, dx: fl
     :param dt: time step size
     :param dx: spatial step size
     :param end_time: final time
-    :return: solution to the heat equation at end_time
+    :param method: 'time_stepping' (tridiagonal solve every time step), 'dst' (every step at once in sine
+                   mode space, the cost is independent of end_time) or 'sine_series' (only for sine series
+                   initial data, InitialDataControlSine, on [0, 1] with evaluation_points, never builds the
+                   grid, see solve_heat_equation_sine_series). 'sine_series' is a different discretization
+                   (the boundary values are at exactly 0 and 1, and the modes are evaluated in the points
+                   instead of interpolated from the grid), so it is much more accurate in the points than
+                   the other two.
+    :param evaluation_points: if given, the solution is only returned at these points. Except for
+                              method='sine_series', the grid solution is linearly interpolated.
+    :param evaluation_indices: if given, the solution is only returned at these grid indices
+    :param adaptive: if True (only for method='time_stepping'), dt is only the initial step size, and the
+                     step size is adapted (halved or doubled) to keep the estimated local error below tolerance
+    :param tolerance: the tolerance for the local error (in the maximum norm) for the adaptive time stepping
+    :param richardson_levels: if given (2 or 3), the solution at the evaluation points is Richardson
+                              extrapolated from this many grids, starting from dx and dt and halving
+                              them, see solve_heat_equation_richardson. Only supported with
+                              method='sine_series'.
+    :param time_integrator: 'crank_nicolson' (second order), 'bdf2' (second order, L-stable, started with two
+                            implicit Euler half steps), 'sdirk' (two stage, second order, L-stable) or
+                            'exponential' (exact in time, always evaluated in sine mode space). Adaptive time
+                            stepping and Richardson extrapolation require 'crank_nicolson'.
+    :param dtype: 'float64', 'float32' (single precision storage and arithmetic) or 'mixed' (single
+                  precision storage, double precision arithmetic), see heat.precision. Adaptive time
+                  stepping requires 'float64'.
+    :return: solution to the heat equation at end_time (at every grid point, or at the evaluation
+             points/indices if given). With richardson_levels, a tuple (values, error estimate).
     """
+    if method not in ['time_stepping', 'dst', 'sine_series']:
+        raise Exception(f"Unknown method {method}, should be either 'time_stepping', 'dst' or 'sine_series'")
+
+    check_time_integrator(time_integrator)
+    storage_dtype = precision.storage_dtype(dtype)
+    compute_dtype = precision.compute_dtype(dtype)
+
+    if adaptive and method != 'time_stepping':
+        raise Exception("Adaptive time stepping is only supported with method='time_stepping'")
+
+    if adaptive and storage_dtype != numpy.float64:
+        raise Exception("Adaptive time stepping is only supported with dtype='float64'")
+
+    if (adaptive or richardson_levels is not None) and time_integrator != 'crank_nicolson':
+        raise Exception("Adaptive time stepping and Richardson extrapolation are only supported "
+                        "with time_integrator='crank_nicolson'")
+
+    if evaluation_points is not None and evaluation_indices is not None:
+        raise Exception("Only one of evaluation_points and evaluation_indices can be given")
+
+    if richardson_levels is not None and method != 'sine_series':
+        raise Exception("Richardson extrapolation is only supported with method='sine_series'")
+
+    if method == 'sine_series':
+        if not isinstance(initial_data, InitialDataControlSine) or a != 0 or b != 1:
+            raise Exception("method='sine_series' is only supported for sine series initial data "
+                            "(InitialDataControlSine) on [0, 1]")
+        if evaluation_points is None:
+            raise Exception("method='sine_series' requires evaluation_points")
+
+        if richardson_levels is not None:
+            return solve_heat_equation_richardson(initial_data.coefficients, dt, dx, end_time, evaluation_points,
+                                                  q=q, levels=richardson_levels, dtype=dtype)
+
+        return solve_heat_equation_sine_series(initial_data.coefficients, dt, dx, end_time, evaluation_points, q=q,
+                                               time_integrator=time_integrator, dtype=dtype)
+
+    x = numpy.arange(a, b, dx)
+    number_of_spatial_points = x.shape[0]
+
+    # for boundary conditions
+    u = numpy.zeros(number_of_spatial_points + 2, dtype=storage_dtype)
+    u[1:-1] = initial_data(x)
+
+    if method == 'dst' or time_integrator == 'exponential':
+        u[1:-1] = solve_dst(u[1:-1], scaled_time_steps(dt, dx, end_time), q, time_integrator, compute_dtype)
+        return _evaluate_solution(u, x, a, b, dx, evaluation_points, evaluation_indices)
+
+    if adaptive:
+        with instrumentation.section('time_stepping'):
+            u = _solve_adaptive(u, dt, dx, end_time, q, tolerance)
+        return _evaluate_solution(u, x, a, b, dx, evaluation_points, evaluation_indices)
+
+    # Time loop (the last step is adjusted to match end_time exactly). The factorized matrices
+    # are reused from the cache if we have seen this grid, step size and q before
+    u = evolve_on_grid(u, scaled_time_steps(dt, dx, end_time), q, time_integrator,
+                       lambda c: implicit_operator(number_of_spatial_points, c, dtype=compute_dtype.name),
+                       compute_dtype)
+
+    return _evaluate_solution(u, x, a, b, dx, evaluation_points, evaluation_indices)
+
+
+def iterate_heat_equation(initial_data: callable(numpy.ndarray), dt: float, dx: float, end_time: float,
+                          a: float = 0.0, b: float = 1, q: float = 1.0, output_times=None, output_every: int = None,
+                          time_integrator: str = 'crank_nicolson'):
+    """
+    Solves the heat equation (see solve_heat_equation), and yields the solution at intermediate times
+    as (t, u).
+
+    u is a read only view of the grid solution (without the boundary values) in a buffer that is reused
+    for the whole solve, so only the current state is kept in memory, and u is overwritten by the next
+    iteration. Copy it if it is needed later.
+
+    The time steps are shortened where needed to land exactly on the output times.
+
+    :param initial_data: a function that can compute the initial data
+    :param dt: time step size
+    :param dx: spatial step size
+    :param end_time: final time
+    :param a: start point of domain
+    :param b: end point of domain
+    :param q: diffusion coefficient
+    :param output_times: the times (between 0 and end_time) to yield the solution at
+    :param output_every: yield the solution after every output_every time steps (and at end_time).
+                         If neither output_times nor output_every is given, the solution is yielded
+                         after every time step.
+    :param time_integrator: see solve_heat_equation
+    """
+    check_time_integrator(time_integrator)
+
+    if output_times is not None and output_every is not None:
+        raise Exception("Only one of output_times and output_every can be given")
+
+    if output_times is None:
+        if output_every is None:
+            output_every = 1
+        if output_every < 1:
+            raise Exception(f"output_every should be at least 1, got {output_every}")
+
+        number_of_outputs = int(numpy.ceil(end_time / (output_every * dt) * (1 - 1e-12)))
+        output_times = [min(output * output_every * dt, end_time) for output in range(1, number_of_outputs + 1)]
+    else:
+        output_times = sorted(output_times)
+        if len(output_times) > 0 and (output_times[0] < 0 or output_times[-1] > end_time * (1 + 1e-12)):
+            raise Exception(f"The output times should be between 0 and end_time ({end_time}), got {output_times}")
+
     x = numpy.arange(a, b, dx)
     number_of_spatial_points = x.shape[0]
 
     # for boundary conditions
     u = numpy.zeros(number_of_spatial_points + 2)
     u[1:-1] = initial_data(x)
-    h = dt / dx ** 2
 
-    # Create sparse matrix
-    A = scipy.sparse.lil_matrix((number_of_spatial_points, number_of_spatial_points))
+    snapshot = u[1:-1].view()
+    snapshot.flags.writeable = False
 
-    # Loop over matrix entries
-    for j in range(1, number_of_spatial_points + 1):  # j = 1,..., N
-        A[j - 1, j - 1] = 1 + h * q
+    # The time steps between two consecutive output times
+    segments = []
+    previous_time = 0
+    for output_time in output_times:
+        segments.append((output_time, scaled_time_steps(dt, dx, output_time - previous_time)))
+        previous_time = output_time
 
-        if j > 1:
-            A[j - 1, j - 2] = -h * q / 2
-        if j < number_of_spatial_points:
-            A[j - 1, j] = -h * q / 2
+    if time_integrator == 'exponential':
+        for output_time, steps in segments:
+            u[1:-1] = solve_dst(u[1:-1], steps, q, time_integrator)
+            yield output_time, snapshot
+        return
 
-    # Our sparse solver likes the CSR format better
-    A = A.tocsr()
+    # One pass through all the steps, so multistep methods (BDF2) keep their history between the outputs
+    steps_taken = iterate_on_grid(u, [step for _, steps in segments for step in steps], q, time_integrator,
+                                  lambda c: implicit_operator(number_of_spatial_points, c))
+    for output_time, steps in segments:
+        for _ in range(sum(number_of_steps for _, number_of_steps in steps)):
+            next(steps_taken)
 
-    # Time loop
-    t = 0
+        yield output_time, snapshot
+
+
+def _evaluate_solution(u, x, a, b, dx, evaluation_points, evaluation_indices):
+    """
+    Picks out the requested values of the solution u (including the boundary values) on the grid x.
+    """
+    if evaluation_indices is not None:
+        return u[1:-1][evaluation_indices]
+    elif evaluation_points is not None:
+        # The boundary values are (implicitly) at a - dx and b
+        x_with_boundary = numpy.concatenate([[a - dx], x, [b]])
+        return numpy.interp(evaluation_points, x_with_boundary, u).astype(u.dtype, copy=False)
+    else:
+        return u[1:-1]
+
+
+def solve_heat_equation_sine_series(coefficients, dt: float, dx: float, end_time: float, evaluation_points,
+                                    q=1.0, time_integrator: str = 'crank_nicolson', dtype: str = 'float64'):
+    """
+    Evaluates the discrete solution of the heat equation on [0, 1] (see solve_heat_equation)
+    at the given points, for initial data given as the sine series (see InitialDataControlSine)
+
+        u_0(x) = sum_k a_k sin(k pi x)
+
+    Each mode is evolved on its own (in closed form) on the grid x_j = j dx, so the grid is never
+    built and the cost is O(number of modes * number of points), independent of dx and end_time.
+    Many samples can be evaluated at once by giving a 2D array of coefficients.
+
+    :param coefficients: the coefficients a_k, either (K,) or (n_samples, K)
+    :param dt: time step size
+    :param dx: spatial step size
+    :param end_time: final time
+    :param evaluation_points: points to evaluate the solution in
+    :param q: diffusion coefficient, either a number or one per sample
+    :param time_integrator: see solve_heat_equation
+    :param dtype: see solve_heat_equation
+    :return: the solution at the evaluation points, (len(evaluation_points),) or
+             (n_samples, len(evaluation_points))
+    """
+    values = solve_sine_series(coefficients, scaled_time_steps(dt, dx, end_time), q, dx, evaluation_points,
+                               time_integrator, precision.compute_dtype(dtype))
+
+    return values.astype(precision.storage_dtype(dtype), copy=False)
+
+
+def solve_heat_equation_richardson(coefficients, dt: float, dx: float, end_time: float, evaluation_points,
+                                   q=1.0, levels: int = 2, dtype: str = 'float64'):
+    """
+    Richardson extrapolation of the sine series solution (see solve_heat_equation_sine_series).
+
+    The solution is computed on levels grids, where dx and dt are halved from one level to the next
+    (dx and dt are the coarsest level). Crank-Nicolson with central differences has an error expansion
+    in even powers of dx (for a fixed ratio dt / dx), so the levels are combined with the factors 4
+    and then 16, eliminating the second and then the fourth order error term.
+
+    Every level uses equally sized time steps (dt is decreased slightly if end_time is not a multiple
+    of it), since a shorter last step would break the error expansion.
+
+    :param coefficients: the coefficients a_k, either (K,) or (n_samples, K)
+    :param dt: time step size on the coarsest level
+    :param dx: spatial step size on the coarsest level
+    :param end_time: final time
+    :param evaluation_points: points to evaluate the solution in
+    :param q: diffusion coefficient, either a number or one per sample
+    :param levels: number of levels (2 or 3)
+    :param dtype: see solve_heat_equation
+    :return: a tuple (values, error estimate), both with the same shape as the output of
+             solve_heat_equation_sine_series. The error estimate is the difference between the
+             extrapolated values and the best values of one order lower.
+    """
+    storage_dtype = precision.storage_dtype(dtype)
+    compute_dtype = precision.compute_dtype(dtype)
+
+    solutions = [solve_sine_series(coefficients, time_steps, q, level_dx, evaluation_points,
+                                   compute_dtype=compute_dtype)
+                 for level_dx, time_steps in richardson_grids(dt, dx, end_time, levels)]
+
+    values, lower_order_values = richardson_tableau(solutions)
+    error_estimate = numpy.abs(values - lower_order_values)
+
+    return values.astype(storage_dtype, copy=False), error_estimate.astype(storage_dtype, copy=False)
+
+
+def solve_heat_equation_batch(initial_states: numpy.ndarray, dt: float, dx: float, end_time: float,
+                              q=1.0, output_indices=None, method: str = 'time_stepping',
+                              time_integrator: str = 'crank_nicolson', dtype: str = 'float64'):
+    """
+    Solves the heat equation (see solve_heat_equation) for many samples at once.
+
+    All the samples are advanced together, so the right hand side and the
+    tridiagonal solves in every time step are vectorized over the samples.
+    The samples can have different diffusion coefficients, in which case the
+    (batched) matrix is factorized once per call.
+
+    :param initial_states: (n_samples, N) array with the initial data of each sample evaluated
+                           on the same grid as solve_heat_equation uses (numpy.arange(a, b, dx))
+    :param dt: time step size
+    :param dx: spatial step size
+    :param end_time: final time
+    :param q: diffusion coefficient, either a single number or one per sample
+    :param output_indices: if given, only these grid indices are returned
+    :param method: either 'time_stepping' or 'dst', see solve_heat_equation
+    :param time_integrator: see solve_heat_equation
+    :param dtype: see solve_heat_equation. With 'float32' or 'mixed' the state of all the samples is stored in
+                  single precision, which halves the memory (and memory traffic) of large batches.
+    :return: (n_samples, N) array with the solutions at end_time, or (n_samples, len(output_indices))
+             if output_indices is given
+    """
+    if method not in ['time_stepping', 'dst']:
+        raise Exception(f"Unknown method {method}, should be either 'time_stepping' or 'dst'")
+
+    check_time_integrator(time_integrator)
+    storage_dtype = precision.storage_dtype(dtype)
+    compute_dtype = precision.compute_dtype(dtype)
 
-    while t < end_time:
-        # adjust dt at the end to match exactly:
-        dt = min(dt, end_time - t)
+    initial_states = numpy.atleast_2d(initial_states)
+    number_of_samples, number_of_spatial_points = initial_states.shape
 
-        # Bulid RHS
-        F = h * q / 2 * u[:-2] + h * q / 2 * u[2:] + (1 - h * q) * u[1:-1]
+    if method == 'dst' or time_integrator == 'exponential':
+        solutions = solve_dst(initial_states, scaled_time_steps(dt, dx, end_time), q, time_integrator,
+                              compute_dtype)
+        if output_indices is not None:
+            solutions = solutions[:, output_indices]
+        return solutions.astype(storage_dtype, copy=False)
 
-        # Solve matrix system
+    # We store the samples as columns, so that every grid row is contiguous in memory
+    u = numpy.zeros((number_of_spatial_points + 2, number_of_samples), dtype=storage_dtype)
+    u[1:-1, :] = initial_states.T
 
-        u[1:-1] = scipy.sparse.linalg.spsolve(A, F)
+    if numpy.ndim(q) != 0:
+        q = numpy.asarray(q, dtype=numpy.float64)
+        if q.shape != (number_of_samples,):
+            raise Exception(f"Expected one diffusion coefficient per sample ({number_of_samples}), got {q.shape}")
 
-        # Boundary conditions are handled automatically since
-        # U is zero everywhere in the beginning
+    # Time loop (the same as in solve_heat_equation)
+    if numpy.ndim(q) == 0:
+        implicit_solver = lambda c: implicit_operator(number_of_spatial_points, c, dtype=compute_dtype.name)
+    else:
+        implicit_solver = lambda c: _batched_implicit_operator(number_of_spatial_points, c, dtype=compute_dtype)
 
+    u = evolve_on_grid(u, scaled_time_steps(dt, dx, end_time), q, time_integrator, implicit_solver, compute_dtype)
 
-        # update time
-        t += dt
+    if output_indices is not None:
+        return u[1:-1][output_indices].T.copy()
 
-    return u[1:-1]
+    return u[1:-1].T.copy()
@@ -0,0 +1,80 @@
+import numpy
+
+from . import instrumentation
+from .initial_data import sine_basis
+from .time_integrators import evolve_modes
+
+
+def laplacian_eigenvalues(number_of_spatial_points: int) -> numpy.ndarray:
+    """
+    The matrix tridiag(-1, 2, -1) (homogeneous Dirichlet boundary) has the
+    eigenvectors sin(k pi j / (N + 1)) with eigenvalues 4 sin^2(k pi / (2 (N + 1))).
+
+    :param number_of_spatial_points: number of unknowns (excluding the boundary)
+    :return: the eigenvalues for the modes k = 1, ..., N
+    """
+    k = numpy.arange(1, number_of_spatial_points + 1)
+    return 4 * numpy.sin(k * numpy.pi / (2 * (number_of_spatial_points + 1))) ** 2
+
+
+def solve_dst(initial_states: numpy.ndarray, time_steps, q, time_integrator: str = 'crank_nicolson',
+              compute_dtype=numpy.float64) -> numpy.ndarray:
+    """
+    Computes the result of all the time steps directly in mode space
+    (discrete sine transform of type I), where every mode evolves independently.
+    For the one step methods the cost is O(N log N) independent of the number of steps.
+
+    This gives the same discrete solution as stepping with the tridiagonal system.
+
+    :param initial_states: initial data on the grid, the last axis is the spatial axis
+    :param time_steps: list of (h, number of steps) pairs, where h = dt / dx^2 (see scaled_time_steps)
+    :param q: diffusion coefficient, either a number or one per sample (leading axis of initial_states)
+    :param time_integrator: see TIME_INTEGRATORS
+    :param compute_dtype: the precision of the transforms and the mode evolution (float64 or float32)
+    :return: the solution after all the steps (in compute_dtype), with the same shape as initial_states
+    """
+    # Imported here, since the other solvers (and importing heat) do not need it
+    import scipy.fft
+
+    eigenvalues = laplacian_eigenvalues(initial_states.shape[-1])
+
+    with instrumentation.section('transform'):
+        modes = scipy.fft.dst(numpy.asarray(initial_states, dtype=compute_dtype), type=1, axis=-1)
+
+    modes = evolve_modes(modes, eigenvalues, time_steps, q, time_integrator)
+
+    with instrumentation.section('transform'):
+        return scipy.fft.idst(modes, type=1, axis=-1)
+
+
+def solve_sine_series(coefficients: numpy.ndarray, time_steps, q, dx: float, points: numpy.ndarray,
+                      time_integrator: str = 'crank_nicolson', compute_dtype=numpy.float64) -> numpy.ndarray:
+    """
+    Evaluates the discrete solution for sine series initial data
+
+        u_0(x) = sum_k a_k sin(k pi x)
+
+    on [0, 1] directly at the given points, without building the grid.
+
+    On the grid x_j = j dx (with the boundary at x = 0 and x = 1), sin(k pi x_j) is an
+    eigenvector of the discrete Laplacian with eigenvalue 4 sin^2(k pi dx / 2) / dx^2, so
+    every mode evolves on its own. The cost is O(number of modes * number of points).
+
+    :param coefficients: the coefficients a_k (k = 0, 1, ...), either (K,) or (n_samples, K)
+    :param time_steps: list of (h, number of steps) pairs, where h = dt / dx^2 (see scaled_time_steps)
+    :param q: diffusion coefficient, either a number or one per sample
+    :param dx: spatial step size
+    :param points: the points to evaluate the solution in
+    :param time_integrator: see TIME_INTEGRATORS
+    :param compute_dtype: the precision of the mode evolution and the evaluation (float64 or float32)
+    :return: the solution at the points (in compute_dtype), (len(points),) or (n_samples, len(points))
+    """
+    coefficients = numpy.asarray(coefficients, dtype=compute_dtype)
+    points = numpy.asarray(points, dtype=numpy.float64)
+    k = numpy.arange(coefficients.shape[-1])
+    eigenvalues = 4 * numpy.sin(k * numpy.pi * dx / 2) ** 2
+
+    modes = evolve_modes(coefficients, eigenvalues, time_steps, q, time_integrator)
+
+    with instrumentation.section('evaluation'):
+        return modes @ sine_basis(points, coefficients.shape[-1]).astype(compute_dtype, copy=False)
@@ -0,0 +1,70 @@
+import numpy
+
+
+def time_steps(dt: float, end_time: float) -> list:
+    """
+    The time steps needed to reach end_time exactly: as many steps of size dt as fit,
+    followed by one shorter step for the remainder (if any).
+
+    :param dt: time step size
+    :param end_time: final time
+    :return: list of (step size, number of steps) pairs
+    """
+    # The tolerance makes sure we do not take an extra (tiny) step due to round off
+    number_of_full_steps = max(int(numpy.floor(end_time / dt * (1 + 1e-12))), 0)
+    remainder = end_time - number_of_full_steps * dt
+
+    steps = []
+    if number_of_full_steps > 0:
+        steps.append((dt, number_of_full_steps))
+    if remainder > 1e-12 * dt:
+        steps.append((remainder, 1))
+
+    return steps
+
+
+def scaled_time_steps(dt: float, dx: float, end_time: float) -> list:
+    """
+    Same as time_steps, but with every step size given as h = step size / dx^2
+    """
+    return [(step_size / dx ** 2, number_of_steps) for step_size, number_of_steps in time_steps(dt, end_time)]
+
+
+def richardson_grids(dt: float, dx: float, end_time: float, levels: int):
+    """
+    The grids of Richardson extrapolation (see solve_heat_equation_richardson)
+
+    :return: list of (dx, time steps) per level, from the coarsest to the finest
+    """
+    if levels not in [2, 3]:
+        raise Exception(f"Richardson extrapolation supports 2 or 3 levels, got {levels}")
+
+    number_of_steps = max(int(numpy.ceil(end_time / dt * (1 - 1e-12))), 1)
+
+    grids = []
+    for level in range(levels):
+        level_number_of_steps = number_of_steps * 2 ** level
+        level_dx = dx / 2 ** level
+        h = end_time / level_number_of_steps / level_dx ** 2
+        grids.append((level_dx, [(h, level_number_of_steps)]))
+
+    return grids
+
+
+def richardson_tableau(solutions):
+    """
+    Combines the solutions of every level (from the coarsest to the finest) with the factors 4 and then 16
+
+    :return: a tuple (extrapolated values, the best values of one order lower)
+    """
+    # tableau[level][order] (order 0 is the plain solution on the grid of level)
+    tableau = []
+    for level, solution in enumerate(solutions):
+        row = [solution]
+
+        for order in range(1, level + 1):
+            factor = 4 ** order
+            row.append((factor * row[order - 1] - tableau[level - 1][order - 1]) / (factor - 1))
+        tableau.append(row)
+
+    return tableau[-1][-1], tableau[-1][-2]
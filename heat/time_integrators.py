@@ -0,0 +1,274 @@
+import numpy
+
+from . import instrumentation
+
+# The time integrators supported by the solvers (see solve_heat_equation)
+TIME_INTEGRATORS = ['crank_nicolson', 'bdf2', 'sdirk', 'exponential']
+
+# Diagonal coefficient of the two stage, second order, L-stable SDIRK method
+#
+#     gamma     | gamma      0
+#     1         | 1 - gamma  gamma
+#     ----------+------------------
+#               | 1 - gamma  gamma
+SDIRK_GAMMA = float(1 - 1 / numpy.sqrt(2))
+
+
+def check_time_integrator(time_integrator: str):
+    if time_integrator not in TIME_INTEGRATORS:
+        raise Exception(f"Unknown time integrator {time_integrator}, should be one of {TIME_INTEGRATORS}")
+
+
+def amplification_factors(z: numpy.ndarray, time_integrator: str) -> numpy.ndarray:
+    """
+    Computes the factor a mode is multiplied by in one step of a one step method, applied to
+
+        u' = -lambda q / dx^2 u
+
+    :param z: dt lambda q / dx^2 (that is h q lambda with h = dt / dx^2)
+    :param time_integrator: one of 'crank_nicolson', 'sdirk' or 'exponential'
+    :return: the amplification factors (same shape as z)
+    """
+    if time_integrator == 'crank_nicolson':
+        return (1 - z / 2) / (1 + z / 2)
+    elif time_integrator == 'sdirk':
+        first_stage = 1 / (1 + SDIRK_GAMMA * z)
+        return (1 - (1 - SDIRK_GAMMA) / SDIRK_GAMMA * (1 - first_stage)) / (1 + SDIRK_GAMMA * z)
+    elif time_integrator == 'exponential':
+        return numpy.exp(-z)
+    else:
+        raise Exception(f"{time_integrator} is not a one step method")
+
+
+def amplification_factor_derivatives(z: numpy.ndarray, time_integrator: str) -> numpy.ndarray:
+    """
+    The derivatives of amplification_factors with respect to z
+
+    :param z: dt lambda q / dx^2 (that is h q lambda with h = dt / dx^2)
+    :param time_integrator: one of 'crank_nicolson', 'sdirk' or 'exponential'
+    :return: the derivatives (same shape as z)
+    """
+    if time_integrator == 'crank_nicolson':
+        return -1 / (1 + z / 2) ** 2
+    elif time_integrator == 'sdirk':
+        first_stage = 1 / (1 + SDIRK_GAMMA * z)
+        return -SDIRK_GAMMA * first_stage ** 2 * (1 - (1 - SDIRK_GAMMA) / SDIRK_GAMMA * (1 - 2 * first_stage))
+    elif time_integrator == 'exponential':
+        return -numpy.exp(-z)
+    else:
+        raise Exception(f"{time_integrator} is not a one step method")
+
+
+def _bdf2_coefficients(step_size_ratio: float):
+    """
+    Coefficients of the variable step BDF2 method
+
+        alpha u^{n+1} - beta u^n + gamma u^{n-1} = dt_n f(u^{n+1})
+
+    where step_size_ratio = dt_n / dt_{n-1}.
+    """
+    alpha = (1 + 2 * step_size_ratio) / (1 + step_size_ratio)
+    beta = 1 + step_size_ratio
+    gamma = step_size_ratio ** 2 / (1 + step_size_ratio)
+
+    return alpha, beta, gamma
+
+
+def evolve_modes(modes: numpy.ndarray, eigenvalues: numpy.ndarray, time_steps, q,
+                 time_integrator: str) -> numpy.ndarray:
+    """
+    Evolves the (independent) modes of the heat equation through all the time steps.
+
+    The arithmetic is done in the precision of modes (float64 or float32).
+
+    :param modes: (..., K) array of modes
+    :param eigenvalues: the K eigenvalues of tridiag(-1, 2, -1) belonging to the modes
+    :param time_steps: list of (h, number of steps) pairs, where h = dt / dx^2 (see scaled_time_steps)
+    :param q: diffusion coefficient, either a number or an array matching the leading axes of modes
+    :param time_integrator: see TIME_INTEGRATORS
+    :return: the modes after all the steps
+    """
+    check_time_integrator(time_integrator)
+    instrumentation.count('steps', sum(number_of_steps for _, number_of_steps in time_steps))
+
+    with instrumentation.section('mode_evolution'):
+        return _evolve_modes(modes, eigenvalues, time_steps, q, time_integrator)
+
+
+def _evolve_modes(modes, eigenvalues, time_steps, q, time_integrator):
+    q = numpy.asarray(q, dtype=modes.dtype)[..., numpy.newaxis]
+    eigenvalues = numpy.asarray(eigenvalues, dtype=modes.dtype)
+
+    if time_integrator != 'bdf2':
+        for h, number_of_steps in time_steps:
+            modes = modes * amplification_factors(h * q * eigenvalues, time_integrator) ** number_of_steps
+
+        return modes
+
+    # BDF2 needs the previous step as well, so we go step by step
+    previous_modes = None
+    previous_h = None
+    for h, number_of_steps in time_steps:
+        z = h * q * eigenvalues
+        for step in range(number_of_steps):
+            if previous_modes is None:
+                # Rannacher start: two implicit Euler half steps
+                new_modes = modes / (1 + z / 2) ** 2
+            else:
+                alpha, beta, gamma = _bdf2_coefficients(h / previous_h)
+                new_modes = (beta * modes - gamma * previous_modes) / (alpha + z)
+
+            previous_modes, modes, previous_h = modes, new_modes, h
+
+    return modes
+
+
+def iterate_on_grid(u: numpy.ndarray, time_steps, q, time_integrator: str, implicit_solver,
+                    compute_dtype=numpy.float64):
+    """
+    Evolves the grid solution through all the time steps, with one tridiagonal solve per step
+    (two for SDIRK, and for the first BDF2 step). This is a generator that yields the size (h)
+    of every step once u has been updated, so the caller can look at u between the steps.
+
+    u can be stored in a lower precision than compute_dtype (the right hand sides are computed
+    in compute_dtype, and the solutions are rounded when they are stored back in u).
+
+    :param u: the solution including the (zero) boundary values, the first axis is the spatial axis
+              (several samples can be given as columns)
+    :param time_steps: list of (h, number of steps) pairs, where h = dt / dx^2 (see scaled_time_steps)
+    :param q: diffusion coefficient, either a number or one per column of u
+    :param time_integrator: one of 'crank_nicolson', 'bdf2' or 'sdirk'
+    :param implicit_solver: implicit_solver(c) should return a factorized solver for I + c tridiag(-1, 2, -1)
+    :param compute_dtype: the precision of the arithmetic (float64 or float32)
+    """
+    check_time_integrator(time_integrator)
+    if time_integrator == 'exponential':
+        raise Exception("The exponential integrator has to be evaluated in mode space (method='dst')")
+
+    # Times the assembly and the linear solves if instrumentation is active
+    implicit_solver = instrumentation.timed_implicit_solver(implicit_solver)
+
+    previous_u = None
+    previous_h = None
+    # BDF2 solvers for every (h, previous h), so we only factorize when the step size changes
+    bdf2_solvers = {}
+    for h, number_of_steps in time_steps:
+        instrumentation.count('steps', number_of_steps)
+
+        if time_integrator == 'crank_nicolson':
+            c = h * q / 2
+            # The matrix is the same for every time step (of this size), so we only factorize it once
+            A = implicit_solver(c)
+
+            for step in range(number_of_steps):
+                # Bulid RHS (in place, so we only keep one temporary of the size of the state alive)
+                F = numpy.multiply(c, u[:-2], dtype=compute_dtype)
+                F += numpy.multiply(c, u[2:], dtype=compute_dtype)
+                F += numpy.multiply(1 - 2 * c, u[1:-1], dtype=compute_dtype)
+
+                # Solve matrix system (only forward and back substitution)
+                u[1:-1] = A.solve(F)
+
+                # Boundary conditions are handled automatically since
+                # U is zero everywhere in the beginning
+
+                yield h
+
+        elif time_integrator == 'sdirk':
+            # Both stages use the same matrix
+            A = implicit_solver(SDIRK_GAMMA * h * q)
+
+            for step in range(number_of_steps):
+                first_stage = A.solve(u[1:-1])
+                # dt f(first stage) = (u - first stage) / gamma
+                u[1:-1] = A.solve(u[1:-1] - (1 - SDIRK_GAMMA) / SDIRK_GAMMA * (u[1:-1] - first_stage))
+
+                yield h
+
+        elif time_integrator == 'bdf2':
+            for step in range(number_of_steps):
+                if previous_u is None:
+                    # Rannacher start: two implicit Euler half steps, which damp the stiff modes
+                    previous_u = u[1:-1].astype(compute_dtype)
+                    A = implicit_solver(h * q / 2)
+                    u[1:-1] = A.solve(A.solve(u[1:-1]))
+                else:
+                    alpha, beta, gamma = _bdf2_coefficients(h / previous_h)
+                    if (h, previous_h) not in bdf2_solvers:
+                        bdf2_solvers[(h, previous_h)] = implicit_solver(h * q / alpha)
+                    new_u = bdf2_solvers[(h, previous_h)].solve(
+                        (numpy.multiply(beta, u[1:-1], dtype=compute_dtype) - gamma * previous_u) / alpha)
+                    previous_u = u[1:-1].astype(compute_dtype)
+                    u[1:-1] = new_u
+
+                previous_h = h
+
+                yield h
+
+
+def evolve_on_grid(u: numpy.ndarray, time_steps, q, time_integrator: str, implicit_solver,
+                   compute_dtype=numpy.float64) -> numpy.ndarray:
+    """
+    Evolves the grid solution through all the time steps, see iterate_on_grid
+
+    :return: u at the end time (u is updated in place)
+    """
+    with instrumentation.section('time_stepping'):
+        for _ in iterate_on_grid(u, time_steps, q, time_integrator, implicit_solver, compute_dtype):
+            pass
+
+    return u
+
+
+def mode_amplification_and_derivative(eigenvalues: numpy.ndarray, time_steps, q, time_integrator: str):
+    """
+    The factor G every mode is multiplied by through all the time steps (evolve_modes is multiplication
+    by G), together with its derivative with respect to the diffusion coefficient q.
+
+    :param eigenvalues: the K eigenvalues of tridiag(-1, 2, -1) belonging to the modes
+    :param time_steps: list of (h, number of steps) pairs, where h = dt / dx^2 (see scaled_time_steps)
+    :param q: diffusion coefficient
+    :param time_integrator: see TIME_INTEGRATORS
+    :return: a tuple (G, dG/dq), both with the shape of eigenvalues
+    """
+    check_time_integrator(time_integrator)
+    eigenvalues = numpy.asarray(eigenvalues, dtype=numpy.float64)
+
+    amplification = numpy.ones_like(eigenvalues)
+    derivative = numpy.zeros_like(eigenvalues)
+
+    if time_integrator != 'bdf2':
+        for h, number_of_steps in time_steps:
+            z = h * q * eigenvalues
+            factors = amplification_factors(z, time_integrator)
+
+            step_amplification = factors ** number_of_steps
+            step_derivative = number_of_steps * factors ** (number_of_steps - 1) * \
+                amplification_factor_derivatives(z, time_integrator) * h * eigenvalues
+
+            derivative = derivative * step_amplification + amplification * step_derivative
+            amplification = amplification * step_amplification
+
+        return amplification, derivative
+
+    # BDF2 (see _evolve_modes), differentiated step by step
+    previous_amplification, previous_derivative = None, None
+    previous_h = None
+    for h, number_of_steps in time_steps:
+        z = h * q * eigenvalues
+        dz = h * eigenvalues
+        for step in range(number_of_steps):
+            if previous_amplification is None:
+                new_amplification = amplification / (1 + z / 2) ** 2
+                new_derivative = derivative / (1 + z / 2) ** 2 - amplification * dz / (1 + z / 2) ** 3
+            else:
+                alpha, beta, gamma = _bdf2_coefficients(h / previous_h)
+                new_amplification = (beta * amplification - gamma * previous_amplification) / (alpha + z)
+                new_derivative = (beta * derivative - gamma * previous_derivative) / (alpha + z) \
+                    - new_amplification * dz / (alpha + z)
+
+            previous_amplification, previous_derivative = amplification, derivative
+            amplification, derivative = new_amplification, new_derivative
+            previous_h = h
+
+    return amplification, derivative
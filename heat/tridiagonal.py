@@ -0,0 +1,177 @@
+import numpy
+
+# From this many systems on, the batched solver sweeps over the rows with every operation acting on all the
+# systems (the Python overhead per row is then small compared to the work), for fewer systems it makes one
+# LAPACK call on the block diagonal system (which needs a transpose of the right hand sides)
+BATCHED_SWEEP_MINIMUM_SYSTEMS = 512
+
+
+class SymmetricTridiagonalSolver:
+    """
+    Factorizes a symmetric tridiagonal matrix once, so that every subsequent
+    solve only costs the O(N) forward and back substitution.
+
+    The matrix is given by its diagonal and its (sub/super) off diagonal.
+    Positive definite matrices (which is what the heat equation gives us for q >= 0)
+    are factorized as L D L^T with LAPACK (?pttrf/?pttrs), anything else falls
+    back to a sparse LU factorization.
+    """
+
+    def __init__(self, diagonal: numpy.ndarray, off_diagonal: numpy.ndarray, dtype=numpy.float64):
+        """
+        :param diagonal: the N entries on the diagonal
+        :param off_diagonal: the N-1 entries on the sub and super diagonal
+        :param dtype: the factorization and the solves are done in this precision (float64 or float32)
+        """
+        # scipy is only imported once a solver is needed, so importing heat stays cheap
+        import scipy.linalg.lapack
+
+        self.dtype = numpy.dtype(dtype)
+        diagonal = numpy.asarray(diagonal, dtype=self.dtype)
+        off_diagonal = numpy.asarray(off_diagonal, dtype=self.dtype)
+        self.size = diagonal.shape[0]
+        pttrf, self.pttrs = scipy.linalg.lapack.get_lapack_funcs(('pttrf', 'pttrs'), dtype=self.dtype)
+
+        self.lu = None
+        if self.size == 1:
+            self.d = diagonal.copy()
+            self.e = off_diagonal.copy()
+            info = 0 if self.d[0] != 0 else 1
+        else:
+            self.d, self.e, info = pttrf(diagonal, off_diagonal)
+
+        if info != 0:
+            # Not positive definite, use a general (pivoting) LU factorization instead
+            import scipy.sparse
+            import scipy.sparse.linalg
+
+            matrix = scipy.sparse.diags([off_diagonal, diagonal, off_diagonal], [-1, 0, 1], format='csc')
+            self.lu = scipy.sparse.linalg.splu(matrix)
+
+    def solve(self, rhs: numpy.ndarray) -> numpy.ndarray:
+        """
+        Solves the system for the given right hand side.
+
+        :param rhs: either a vector of length N, or an (N, M) array of M right hand sides
+        :return: the solution (in the dtype of the solver), with the same shape as rhs
+        """
+        rhs = numpy.asarray(rhs, dtype=self.dtype)
+
+        if self.lu is not None:
+            return self.lu.solve(rhs)
+
+        if self.size == 1:
+            return rhs / self.d[0]
+
+        x, info = self.pttrs(self.d, self.e, rhs)
+        if info != 0:
+            raise Exception(f"Tridiagonal solve failed (LAPACK info={info})")
+        return x
+
+
+class BatchedSymmetricTridiagonalSolver:
+    """
+    Factorizes a batch of M symmetric positive definite tridiagonal systems
+    (each of size N) at once, and solves them together.
+
+    With fewer than BATCHED_SWEEP_MINIMUM_SYSTEMS systems, the M systems are
+    factorized and solved as one block diagonal tridiagonal system of size N M
+    (the off diagonal is zero between the blocks), so every solve is a single
+    LAPACK call (?pttrs). With more systems, the L D L^T factorization and the
+    substitutions are vectorized Thomas sweeps: the loop runs over the N rows,
+    and every operation acts on all M systems (contiguous in memory) at once.
+
+    The coefficients are stored with the row index first, that is diagonal has
+    shape (N, M) and off_diagonal has shape (N-1, M). Passing a single column
+    (shape (N, 1)) shares the factorization between all right hand sides.
+    """
+
+    def __init__(self, diagonal: numpy.ndarray, off_diagonal: numpy.ndarray, dtype=numpy.float64):
+        """
+        :param diagonal: (N, M) entries on the diagonals
+        :param off_diagonal: (N-1, M) entries on the sub and super diagonals
+        :param dtype: the factorization and the solves are done in this precision (float64 or float32)
+        """
+        # scipy is only imported once a solver is needed, so importing heat stays cheap
+        import scipy.linalg.lapack
+
+        self.dtype = numpy.dtype(dtype)
+        diagonal = numpy.asarray(diagonal, dtype=self.dtype)
+        off_diagonal = numpy.asarray(off_diagonal, dtype=self.dtype)
+        self.size, self.number_of_systems = diagonal.shape
+        pttrf, self.pttrs = scipy.linalg.lapack.get_lapack_funcs(('pttrf', 'pttrs'), dtype=self.dtype)
+
+        self.sweep = self.number_of_systems >= BATCHED_SWEEP_MINIMUM_SYSTEMS
+        if self.sweep:
+            self._factorize_sweep(diagonal, off_diagonal)
+            return
+
+        # One system after the other (sample major), with zeros on the off diagonal between the systems
+        block_off_diagonal = numpy.zeros((self.number_of_systems, self.size), dtype=self.dtype)
+        block_off_diagonal[:, :-1] = off_diagonal.T
+        block_diagonal = numpy.ascontiguousarray(diagonal.T).ravel()
+        block_off_diagonal = block_off_diagonal.ravel()[:-1]
+
+        if block_diagonal.shape[0] == 1:
+            self.d, self.e = block_diagonal, block_off_diagonal
+            info = 0 if self.d[0] > 0 else 1
+        else:
+            self.d, self.e, info = pttrf(block_diagonal, block_off_diagonal)
+
+        if info != 0:
+            raise Exception("The batched tridiagonal solver requires positive definite matrices "
+                            "(is the diffusion coefficient negative?)")
+
+    def _factorize_sweep(self, diagonal, off_diagonal):
+        # L D L^T factorization, l holds the subdiagonal of L (l[0] is unused)
+        self.d = numpy.zeros_like(diagonal)
+        self.l = numpy.zeros_like(diagonal)
+
+        self.d[0] = diagonal[0]
+        for i in range(1, self.size):
+            self.l[i] = off_diagonal[i - 1] / self.d[i - 1]
+            self.d[i] = diagonal[i] - self.l[i] * off_diagonal[i - 1]
+
+        if not numpy.all(self.d > 0):
+            raise Exception("The batched tridiagonal solver requires positive definite matrices "
+                            "(is the diffusion coefficient negative?)")
+
+    def _solve_sweep(self, rhs):
+        x = numpy.array(rhs, dtype=self.dtype)
+
+        # Forward substitution (L y = rhs)
+        for i in range(1, self.size):
+            x[i] -= self.l[i] * x[i - 1]
+
+        # Back substitution (D L^T x = y)
+        x[-1] /= self.d[-1]
+        for i in range(self.size - 2, -1, -1):
+            x[i] = x[i] / self.d[i] - self.l[i + 1] * x[i + 1]
+
+        return x
+
+    def solve(self, rhs: numpy.ndarray) -> numpy.ndarray:
+        """
+        Solves all the systems.
+
+        :param rhs: (N, M) array of right hand sides, one column per system
+        :return: (N, M) array of solutions (in the dtype of the solver)
+        """
+        if self.sweep:
+            return self._solve_sweep(rhs)
+
+        rhs = numpy.asarray(rhs, dtype=self.dtype)
+
+        if self.d.shape[0] == 1:
+            return rhs / self.d[0]
+
+        if self.number_of_systems == 1:
+            # The same matrix for every column
+            x, info = self.pttrs(self.d, self.e, rhs)
+        else:
+            x, info = self.pttrs(self.d, self.e, numpy.ascontiguousarray(rhs.T).ravel())
+            x = x.reshape(self.number_of_systems, self.size).T
+
+        if info != 0:
+            raise Exception(f"Tridiagonal solve failed (LAPACK info={info})")
+        return x
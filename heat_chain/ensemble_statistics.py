@@ -0,0 +1,260 @@
+"""
+Aggregates the result files of the ensemble runs (see run_ensemble.sh and results_files.py) into
+running statistics, without keeping the results of the members in memory:
+
+    python ensemble_statistics.py ../ensemble_output
+
+For every kind of result file (and every configuration with --per_configuration) this keeps the count,
+mean, variance, minimum, maximum and (estimated) quantiles per iteration of the objective of the exact
+solution and of the parameters (see running_statistics.py).
+
+The statistics are checkpointed (--checkpoint_file) every --checkpoint_every members or every
+--checkpoint_interval seconds, and when the script is done. The checkpoint only holds the statistics
+and the number of members. The names of the added result files are appended to a log next to it
+(<checkpoint_file>.members), so a checkpoint does not rewrite the list of all the members.
+
+Running the script again resumes from the checkpoint, and only adds the result files that were not
+added before, so it can be rerun (or left running with --poll_interval) while the ensemble is still
+running. Members added after the last checkpoint of an interrupted run are added again. The result
+files are written when a run finishes, so every file found is a finished member.
+"""
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+import objective
+import results_files
+from running_statistics import RunningStatistics
+
+STATISTICS = ['objective', 'parameters']
+
+
+class EnsembleStatistics(object):
+    def __init__(self, quantiles=(0.1, 0.5, 0.9), per_configuration=False):
+        self.quantiles = list(quantiles)
+        self.per_configuration = per_configuration
+        self.number_of_members = 0
+        # Digests of the (absolute) filenames of the members, see member_digest
+        self.member_digests = set()
+        # The members added since the last save, they are appended to the members log by save
+        self.unsaved_members = []
+        # group name -> {statistic name: RunningStatistics}
+        self.groups = {}
+
+    def group_name(self, result_file):
+        if self.per_configuration:
+            return f'{result_file.kind}_{result_file.configuration_name}'
+        return result_file.kind
+
+    def add(self, result_file, parameters, objective_values):
+        """
+        Adds one member
+
+        :param parameters: the parameters of every iteration
+        :param objective_values: the objective of every iteration
+        """
+        group_name = self.group_name(result_file)
+        if group_name not in self.groups:
+            self.groups[group_name] = {name: RunningStatistics(self.quantiles) for name in STATISTICS}
+
+        self.groups[group_name]['objective'].update(objective_values)
+        self.groups[group_name]['parameters'].update(parameters)
+
+        filename = os.path.abspath(result_file.filename)
+        self.number_of_members += 1
+        self.member_digests.add(member_digest(filename))
+        self.unsaved_members.append(filename)
+
+    def has_member(self, result_file):
+        return member_digest(os.path.abspath(result_file.filename)) in self.member_digests
+
+    def summary(self):
+        return {'number_of_members': self.number_of_members,
+                'groups': {group_name: {name: statistics.as_dict() for name, statistics in group.items()}
+                           for group_name, group in self.groups.items()}}
+
+    def save(self, filename):
+        """
+        Writes the checkpoint, and appends the members added since the last save to the members log
+        (filename + '.members'). The checkpoint stores the size of the log, so a log that was appended to
+        by an interrupted save is cut back by load.
+        """
+        with open(members_log_filename(filename), 'a') as members_log:
+            for member in self.unsaved_members:
+                members_log.write(f'{member}\n')
+            members_log.flush()
+            members_log_size = members_log.tell()
+
+        metadata = {'quantiles': self.quantiles,
+                    'per_configuration': self.per_configuration,
+                    'number_of_members': self.number_of_members,
+                    'members_log_size': members_log_size,
+                    'groups': sorted(self.groups.keys())}
+
+        arrays = {'metadata': np.array(json.dumps(metadata))}
+        for group_name, group in self.groups.items():
+            for name, statistics in group.items():
+                for array_name, array in statistics.state().items():
+                    arrays[f'{group_name}/{name}/{array_name}'] = array
+
+        # Written to a temporary file first, so an interrupted run leaves the previous checkpoint
+        temporary_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(temporary_filename, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temporary_filename, filename)
+
+        self.unsaved_members = []
+
+    @staticmethod
+    def load(filename):
+        with np.load(filename) as checkpoint:
+            metadata = json.loads(str(checkpoint['metadata']))
+
+            ensemble_statistics = EnsembleStatistics(metadata['quantiles'], metadata['per_configuration'])
+            ensemble_statistics.number_of_members = metadata['number_of_members']
+
+            for group_name in metadata['groups']:
+                ensemble_statistics.groups[group_name] = {}
+                for name in STATISTICS:
+                    prefix = f'{group_name}/{name}/'
+                    state = {key[len(prefix):]: checkpoint[key] for key in checkpoint.files if key.startswith(prefix)}
+                    ensemble_statistics.groups[group_name][name] = RunningStatistics.from_state(state)
+
+        # Members logged after the checkpoint was written are not in the statistics
+        with open(members_log_filename(filename), 'r+') as members_log:
+            members_log.truncate(metadata['members_log_size'])
+            for member in members_log:
+                ensemble_statistics.member_digests.add(member_digest(member.rstrip('\n')))
+
+        if len(ensemble_statistics.member_digests) != ensemble_statistics.number_of_members:
+            raise Exception(f"The members log {members_log_filename(filename)} does not match the checkpoint "
+                            f"{filename} ({len(ensemble_statistics.member_digests)} members logged, "
+                            f"{ensemble_statistics.number_of_members} in the checkpoint)")
+
+        return ensemble_statistics
+
+
+def members_log_filename(checkpoint_filename):
+    return f'{checkpoint_filename}.members'
+
+
+def member_digest(filename):
+    """
+    64 bit digest of the filename, so we do not keep all the filenames in memory
+    """
+    return hashlib.blake2b(filename.encode('utf-8'), digest_size=8).digest()
+
+
+def find_members(directories):
+    """
+    :return: the result files in the directories (and all their subdirectories)
+    """
+    members = []
+    for directory in directories:
+        for path, _, _ in sorted(os.walk(directory)):
+            members.extend(results_files.find_result_files(path))
+    return members
+
+
+def add_new_members(ensemble_statistics, objective_function, directories, checkpoint_file, checkpoint_every=100,
+                    checkpoint_interval=60.0):
+    """
+    Adds the result files that are not in ensemble_statistics yet. Checkpoints after every checkpoint_every
+    members or checkpoint_interval seconds (whichever comes first), and at the end if anything was added.
+
+    :return: the number of members added
+    """
+    number_of_members_added = 0
+    members_since_checkpoint = 0
+    last_checkpoint_time = time.monotonic()
+
+    for result_file in find_members(directories):
+        if ensemble_statistics.has_member(result_file):
+            continue
+
+        parameters = result_file.load()
+        ensemble_statistics.add(result_file, parameters, objective_function.exact_value(parameters))
+
+        number_of_members_added += 1
+        members_since_checkpoint += 1
+
+        if members_since_checkpoint >= checkpoint_every or \
+                time.monotonic() - last_checkpoint_time >= checkpoint_interval:
+            ensemble_statistics.save(checkpoint_file)
+            members_since_checkpoint = 0
+            last_checkpoint_time = time.monotonic()
+
+    if members_since_checkpoint > 0:
+        ensemble_statistics.save(checkpoint_file)
+
+    return number_of_members_added
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="""
+Aggregates the result files of the ensemble runs into running statistics (mean, variance, minimum,
+maximum and quantiles per iteration of the objective and the parameters)
+        """)
+
+    parser.add_argument('directories', type=str, nargs='+',
+                        help='Directories to search (recursively) for result files')
+
+    parser.add_argument('--objective_parameters_file', type=str, default='objective_parameters.json',
+                        help='The objective parameters used for the runs')
+
+    parser.add_argument('--checkpoint_file', type=str, default='ensemble_statistics.npz',
+                        help='Checkpoint of the statistics, resumed from if it exists')
+
+    parser.add_argument('--checkpoint_every', type=int, default=100,
+                        help='Checkpoint after this many new members')
+
+    parser.add_argument('--checkpoint_interval', type=float, default=60.0,
+                        help='Checkpoint at least every this many seconds while adding members')
+
+    parser.add_argument('--summary_file', type=str, default='ensemble_statistics.json',
+                        help='Where to write the statistics (as JSON)')
+
+    parser.add_argument('--quantiles', type=float, nargs='+', default=[0.1, 0.5, 0.9],
+                        help='Quantiles to estimate (only used when starting without a checkpoint)')
+
+    parser.add_argument('--per_configuration', action='store_true',
+                        help='Keep separate statistics for every configuration (generator, number of starting '
+                             'samples and batch size), not only per kind of result file')
+
+    parser.add_argument('--poll_interval', type=float, default=None,
+                        help='If given, keep looking for new result files every this many seconds')
+
+    args = parser.parse_args()
+
+    with open(args.objective_parameters_file) as f:
+        objective_function = objective.Objective(**json.load(f))
+
+    if os.path.exists(args.checkpoint_file):
+        ensemble_statistics = EnsembleStatistics.load(args.checkpoint_file)
+
+        if ensemble_statistics.per_configuration != args.per_configuration:
+            raise Exception(f"The checkpoint {args.checkpoint_file} was made with per_configuration="
+                            f"{ensemble_statistics.per_configuration}")
+        print(f"Resuming from {args.checkpoint_file} ({ensemble_statistics.number_of_members} members)")
+    else:
+        ensemble_statistics = EnsembleStatistics(args.quantiles, args.per_configuration)
+
+    while True:
+        number_of_members_added = add_new_members(ensemble_statistics, objective_function, args.directories,
+                                                  args.checkpoint_file, args.checkpoint_every,
+                                                  args.checkpoint_interval)
+
+        if number_of_members_added > 0 or not os.path.exists(args.summary_file):
+            with open(args.summary_file, 'w') as f:
+                json.dump(ensemble_statistics.summary(), f)
+
+            print(f"Added {number_of_members_added} members ({ensemble_statistics.number_of_members} in total)")
+
+        if args.poll_interval is None:
+            break
+        time.sleep(args.poll_interval)
@@ -1,5 +1,5 @@
 import numpy as np
-from heat import InitialDataControlSine
+from heat import InitialDataControlSine, solve_heat_equation_adjoint
 
 class Objective(object):
     def __init__(self, coefficients=[1, 2, 3, 4, 5], q=1.0, end_time=1.0,
@@ -10,28 +10,80 @@ class Objective(object):
         self.control_points = control_points
         self.initial_data = InitialDataControlSine(coefficients)
 
+        # The target values never change, so we only compute them once
+        self.target_values = self.exact_solution(np.array(control_points, dtype=np.float64))
+
     def exact_solution(self, x):
         exact_solution = self.initial_data.exact_solution(x, self.end_time, self.q)
 
         return exact_solution
 
     def __call__(self, solution):
+        """
+        :param solution: the solution at the control points, either a vector with one value per control point,
+                         or an (n_samples, n_control_points) array
+        :return: the objective value (one per sample if given a 2D array)
+        """
+        solution = np.asarray(solution)
+        assert (solution.shape[-1] == len(self.control_points))
+
+        return 0.5 * np.sum((self.target_values - solution) ** 2, axis=-1)
 
-        assert (len(solution) == len(self.control_points))
+    def grad(self, solution):
+        """
+        :param solution: the solution at the control points, either a vector with one value per control point,
+                         or an (n_samples, n_control_points) array
+        :return: the gradient with respect to the solution (same shape as solution)
+        """
+        solution = np.asarray(solution, dtype=np.float64)
+        assert (solution.shape[-1] == len(self.control_points))
 
-        error = 0
-        for control_point_index, control_point in enumerate(self.control_points):
-            exact_solution = self.exact_solution(control_point)
+        return solution - self.target_values
 
-            error += (exact_solution - solution[control_point_index]) ** 2
+    def exact_solution_for_parameters(self, parameters, x):
+        """
+        The exact solution at end_time for many parameters at once
 
-        return 0.5 * error
+        :param parameters: q followed by the coefficients of the initial data, either a vector or an
+                           (n_samples, 1 + n_coefficients) array
+        :param x: the points to evaluate in
+        :return: the exact solution, with shape (n_samples, len(x)) (or (len(x),) for a single vector)
+        """
+        parameters = np.asarray(parameters, dtype=np.float64)
+        initial_data = InitialDataControlSine(parameters[..., 1:])
 
-    def grad(self, solution):
-        gradient = np.zeros(len(self.control_points))
-        for control_point_index, control_point in enumerate(self.control_points):
-            exact_solution = self.exact_solution(control_point)
+        return initial_data.exact_solution(np.asarray(x, dtype=np.float64), self.end_time, parameters[..., 0])
+
+    def exact_value(self, parameters):
+        """
+        The objective of the exact solution for the given parameters (no discretization error)
+
+        :param parameters: q followed by the coefficients of the initial data, either a vector or an
+                           (n_samples, 1 + n_coefficients) array
+        :return: the objective value (one per sample if given a 2D array)
+        """
+        return self(self.exact_solution_for_parameters(parameters, self.control_points))
+
+    def value_and_parameter_gradient(self, parameters, dt, dx, time_integrator='crank_nicolson',
+                                     richardson_levels=None):
+        """
+        Computes the objective of the values simulate_heat.py computes for the given parameters (the
+        sine series solution, see solve_heat_equation_sine_series), and its exact gradient with respect
+        to the parameters through the adjoint in sine mode space.
 
-            gradient[control_point_index] = (solution[control_point_index] - exact_solution)
+        :param parameters: q followed by the coefficients of the initial data (the same layout as
+                           the parameters given to simulate_heat.py)
+        :param dt: time step size
+        :param dx: spatial step size
+        :param time_integrator: see solve_heat_equation
+        :param richardson_levels: see solve_heat_equation_richardson
+        :return: a tuple (objective value, gradient with respect to the parameters)
+        """
+        values, gradient_q, gradient_coefficients = solve_heat_equation_adjoint(parameters[1:], dt, dx,
+                                                                                self.end_time,
+                                                                                self.control_points,
+                                                                                self.grad, q=parameters[0],
+                                                                                time_integrator=time_integrator,
+                                                                                richardson_levels=richardson_levels)
 
-        return gradient
+        return self(values), np.concatenate([[gradient_q], gradient_coefficients])
@@ -0,0 +1,77 @@
+import json
+
+import numpy as np
+import sys
+import scipy.optimize
+
+import objective
+from heat import TIME_INTEGRATORS
+from simulate_heat import load_simulation_settings
+
+if __name__ == '__main__':
+    print(f"Command line: {' '.join(sys.argv)}")
+    import argparse
+
+    parser = argparse.ArgumentParser(description="""
+Minimizes the objective directly with a gradient based optimizer, where the
+gradient with respect to (q, coefficients) is computed with the adjoint of the
+discretization simulate_heat.py uses (in sine mode space, so it is exact for the
+values the ISMO chain trains on).
+
+Can be used as a baseline for ISMO, or to refine the ISMO result
+(by giving the last row of a min_shapes file as the starting point).
+    """)
+
+    parser.add_argument('--output_parameters_file', type=str, required=True,
+                        help='Output filename for the optimized parameters (written with np.savetxt)')
+
+    parser.add_argument('--starting_parameters_file', type=str, default=None,
+                        help='File with the starting parameters (q followed by the coefficients). '
+                             'If it has several rows, the last row is used. By default a random point is used.')
+
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the random starting point')
+
+    parser.add_argument('--optimizer', type=str, default='L-BFGS-B',
+                        help='Name of optimizer (passed to scipy.optimize.minimize)')
+
+    parser.add_argument('--number_of_iterations', type=int, default=1000,
+                        help='Maximum number of optimizer iterations')
+
+    parser.add_argument('--richardson_levels', type=int, default=None, choices=[2, 3],
+                        help='Richardson extrapolate the values from this many coarse grids (see simulate_heat.py)')
+
+    parser.add_argument('--time_integrator', type=str, default='crank_nicolson', choices=TIME_INTEGRATORS,
+                        help='Time integrator (see simulate_heat.py)')
+
+    args = parser.parse_args()
+
+    with open("objective_parameters.json") as objective_parameters_file:
+        objective_parameters = json.load(objective_parameters_file)
+
+    objective_function = objective.Objective(**objective_parameters)
+
+    dimension = len(objective_parameters['coefficients']) + 1
+
+    # The same resolution as the simulations of the chain
+    settings = load_simulation_settings(richardson_levels=args.richardson_levels,
+                                        time_integrator=args.time_integrator)
+
+    if args.starting_parameters_file is not None:
+        starting_parameters = np.atleast_2d(np.loadtxt(args.starting_parameters_file))[-1, :dimension]
+    else:
+        starting_parameters = np.random.RandomState(args.seed).uniform(0, 1, dimension)
+
+    # Same parameter domain as the ISMO samples
+    bounds = [(0, 1) for _ in range(dimension)]
+
+    result = scipy.optimize.minimize(objective_function.value_and_parameter_gradient, starting_parameters,
+                                     args=(settings['dt'], settings['dx'], settings['time_integrator'],
+                                           settings['richardson_levels']), jac=True, method=args.optimizer, bounds=bounds,
+                                     options={'maxiter': args.number_of_iterations})
+
+    print(f"Optimizer finished: {result.message}")
+    print(f"Objective value: {result.fun} after {result.nit} iterations ({result.nfev} function evaluations)")
+    print(f"Parameters: {result.x}")
+
+    np.savetxt(args.output_parameters_file, result.x)
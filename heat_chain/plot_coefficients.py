@@ -5,57 +5,78 @@ import sys
 import objective
 import heat
 import plot_info
-with open('objective_parameters.json') as f:
-    objective_parameters = json.load(f)
 
-coefficients_filename = sys.argv[1]
-coefficients_per_iteration = np.loadtxt(coefficients_filename)
 
-coefficients_true = objective_parameters['coefficients']
+def plot_coefficients(coefficients_per_iteration, objective_parameters, name="coefficients", per_plot=3):
+    """
+    Plots the parameters (q followed by the coefficients) of every iteration against the true parameters
 
-per_plot = 3
-
-number_of_coefficients = len(coefficients_true)
-number_of_plots = (number_of_coefficients + per_plot - 1) // per_plot
-fig, axes = plt.subplots(1, number_of_plots + 1, sharey = True, figsize=(16, 8))
-for coefficient_index in range(len(coefficients_true)):
-    plot_index = coefficient_index // per_plot
+    :param coefficients_per_iteration: (iterations, 1 + number of coefficients) array
+    :param objective_parameters: the content of objective_parameters.json
+    :param name: name of the saved plot
+    :param per_plot: number of coefficients per subplot
+    """
+    coefficients_true = objective_parameters['coefficients']
 
+    number_of_coefficients = len(coefficients_true)
+    number_of_plots = (number_of_coefficients + per_plot - 1) // per_plot
     iterations = np.arange(0, coefficients_per_iteration.shape[0])
-    plot_ref = axes[plot_index].plot(iterations, coefficients_per_iteration[:, coefficient_index + 1], '-o',
-        label=f'$a_{{{coefficient_index}}}$')
-    axes[plot_index].plot(iterations, coefficients_true[coefficient_index]*np.ones_like(coefficients_per_iteration[:, coefficient_index]),
-        '--', color=plot_ref[0].get_color())
-    axes[plot_index].grid(True)
-    axes[plot_index].legend()
-
-    axes[plot_index].set_xlabel("Iteration")
-plot_ref = axes[number_of_plots].plot(iterations, coefficients_per_iteration[:,0], '-o', label='q')
-axes[number_of_plots].plot(iterations, np.zeros_like(coefficients_per_iteration[:,0])*objective_parameters['q'], '--', label='q',
-    color=plot_ref[0].get_color())
-axes[number_of_plots].grid(True)
-axes[number_of_plots].legend()
-
-axes[number_of_plots].set_xlabel("Iteration")
-plot_info.showAndSave("coefficients")
-
-dx = 1.0/2048
-x = np.arange(0,1, dx)
-
-objective_function = objective.Objective(**objective_parameters)
-initial_data = objective_function.initial_data
-
-
-end_time = objective_parameters['end_time']
-#plt.plot(x, initial_data.exact_solution(x, end_time), label='exact true')
-
-objective_function_approximated = objective.Objective(end_time=end_time, coefficients=coefficients_per_iteration[-1,1:],
-    q=coefficients_per_iteration[-1,0], control_points=objective_parameters['control_points'])
-
-plt.plot(x, objective_function_approximated.initial_data(x), '--', label='Initial data')
-plt.plot(x, objective_function_approximated.initial_data.exact_solution(x, end_time), label='Evolved data')
-plt.plot(objective_parameters['control_points'],
-    initial_data.exact_solution(np.array(objective_parameters['control_points']), end_time),
-     '*', label='Control points', markersize=15)
-plt.legend()
-plot_info.showAndSave("exact_with_coefficients_from_ismo")
+
+    fig, axes = plt.subplots(1, number_of_plots + 1, sharey=True, figsize=(16, 8))
+    for coefficient_index in range(number_of_coefficients):
+        plot_index = coefficient_index // per_plot
+
+        plot_ref = axes[plot_index].plot(iterations, coefficients_per_iteration[:, coefficient_index + 1], '-o',
+                                         label=f'$a_{{{coefficient_index}}}$')
+        axes[plot_index].plot(iterations, coefficients_true[coefficient_index] * np.ones_like(iterations),
+                              '--', color=plot_ref[0].get_color())
+        axes[plot_index].grid(True)
+        axes[plot_index].legend()
+
+        axes[plot_index].set_xlabel("Iteration")
+    plot_ref = axes[number_of_plots].plot(iterations, coefficients_per_iteration[:, 0], '-o', label='q')
+    axes[number_of_plots].plot(iterations, objective_parameters['q'] * np.ones_like(iterations), '--', label='q',
+                               color=plot_ref[0].get_color())
+    axes[number_of_plots].grid(True)
+    axes[number_of_plots].legend()
+
+    axes[number_of_plots].set_xlabel("Iteration")
+    plot_info.showAndSave(name)
+
+
+def plot_exact_with_coefficients(coefficients, objective_function, name="exact_with_coefficients_from_ismo",
+                                 dx=1.0 / 2048):
+    """
+    Plots the initial data and the exact solution for the given parameters, together with the target
+    values at the control points
+
+    :param coefficients: q followed by the coefficients of the initial data
+    :param objective_function: the Objective (with the true parameters)
+    :param name: name of the saved plot
+    :param dx: resolution of the plot
+    """
+    x = np.arange(0, 1, dx)
+
+    plt.plot(x, heat.InitialDataControlSine(coefficients[1:])(x), '--', label='Initial data')
+    plt.plot(x, objective_function.exact_solution_for_parameters(coefficients, x), label='Evolved data')
+    plt.plot(objective_function.control_points, objective_function.target_values,
+             '*', label='Control points', markersize=15)
+    plt.legend()
+    plot_info.showAndSave(name)
+
+
+if __name__ == '__main__':
+    # The figures are written by background processes while we go on plotting
+    plot_info.setAsynchronousSaving()
+
+    with open('objective_parameters.json') as f:
+        objective_parameters = json.load(f)
+
+    coefficients_filename = sys.argv[1]
+    coefficients_per_iteration = np.loadtxt(coefficients_filename, ndmin=2)
+
+    plot_coefficients(coefficients_per_iteration, objective_parameters)
+
+    plot_exact_with_coefficients(coefficients_per_iteration[-1], objective.Objective(**objective_parameters))
+
+    plot_info.waitForPlots()
@@ -0,0 +1,137 @@
+"""
+Makes all the figures and convergence tables for the result files of the ensemble runs in one go
+(instead of running plot_coefficients.py once per file). Run from the folder with objective_parameters.json
+
+    python plot_report.py --results_directory ../results
+
+Every result file is only read once, and the objective (of the exact solution) is evaluated for every
+iteration of every file in one vectorized call. The figures are rendered by a pool of processes
+(see plot_info.setAsynchronousSaving).
+"""
+import json
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+import objective
+import plot_info
+import results_files
+from plot_coefficients import plot_coefficients, plot_exact_with_coefficients
+
+
+def evaluate_objective(objective_function, results):
+    """
+    :param results: list of tuples (ResultFile, parameters per iteration), see results_files.load_results
+    :return: list with the objective value of every iteration, one array per result file
+    """
+    if len(results) == 0:
+        return []
+
+    all_parameters = np.concatenate([parameters for _, parameters in results])
+    objective_values = objective_function.exact_value(all_parameters)
+
+    number_of_iterations = [parameters.shape[0] for _, parameters in results]
+
+    return np.split(objective_values, np.cumsum(number_of_iterations)[:-1])
+
+
+def convergence_table(results, objective_values, objective_parameters):
+    """
+    One markdown table row per result file, with the objective and the errors in the parameters after
+    the last iteration
+
+    :return: the table as a string
+    """
+    coefficients_true = np.array(objective_parameters['coefficients'])
+    q_true = objective_parameters['q']
+
+    lines = ['| generator | starting samples | batch size | iterations | final objective | best objective '
+             '| error q | relative error coefficients |',
+             '|---|---|---|---|---|---|---|---|']
+
+    for (result_file, parameters), values in zip(results, objective_values):
+        error_q = abs(parameters[-1, 0] - q_true)
+        error_coefficients = np.linalg.norm(parameters[-1, 1:] - coefficients_true) / np.linalg.norm(coefficients_true)
+
+        lines.append(f'| {result_file.generator} | {result_file.number_of_starting_samples} '
+                     f'| {result_file.batch_size} | {parameters.shape[0]} | {values[-1]:.3e} | {np.min(values):.3e} '
+                     f'| {error_q:.3e} | {error_coefficients:.3e} |')
+
+    return '\n'.join(lines) + '\n'
+
+
+def plot_objective_per_iteration(results, objective_values, kind):
+    for (result_file, _), values in zip(results, objective_values):
+        plt.semilogy(np.arange(values.shape[0]), values, '-o', markersize=3,
+                     label=f'{result_file.number_of_starting_samples} starting, batch {result_file.batch_size}')
+
+    plt.xlabel("Iteration")
+    plt.ylabel("Objective")
+    plt.grid(True)
+    plt.legend()
+    plt.title(kind.replace('_', ' '))
+    plot_info.showAndSave(f'objective_{kind}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="""
+Makes the figures and convergence tables for all the result files of the ensemble runs
+        """)
+
+    parser.add_argument('--results_directory', type=str, default='results',
+                        help='Directory with the result files (min_shapes_per_iteration_... and so on)')
+
+    parser.add_argument('--objective_parameters_file', type=str, default='objective_parameters.json',
+                        help='The objective parameters used for the runs')
+
+    parser.add_argument('--output_directory', type=str, default='report',
+                        help='Directory to write the convergence tables to (the figures go to img/ and img_tikz/)')
+
+    parser.add_argument('--number_of_processes', type=int, default=None,
+                        help='Number of processes rendering the figures (the number of CPUs by default)')
+
+    args = parser.parse_args()
+
+    with open(args.objective_parameters_file) as f:
+        objective_parameters = json.load(f)
+
+    objective_function = objective.Objective(**objective_parameters)
+
+    results = results_files.load_results(args.results_directory)
+    if len(results) == 0:
+        raise Exception(f"No result files found in {args.results_directory}")
+
+    objective_values = evaluate_objective(objective_function, results)
+
+    plot_info.showAndSave.silent = True
+    plot_info.setAsynchronousSaving(max_workers=args.number_of_processes)
+
+    os.makedirs(args.output_directory, exist_ok=True)
+
+    for kind in results_files.KINDS:
+        indices = [index for index, (result_file, _) in enumerate(results) if result_file.kind == kind]
+        if len(indices) == 0:
+            continue
+
+        results_of_kind = [results[index] for index in indices]
+        objective_values_of_kind = [objective_values[index] for index in indices]
+
+        for result_file, parameters in results_of_kind:
+            name = f'{kind}_{result_file.configuration_name}'
+            plot_coefficients(parameters, objective_parameters, name=f'coefficients_{name}')
+            plot_exact_with_coefficients(parameters[-1], objective_function,
+                                         name=f'exact_with_coefficients_{name}')
+
+        plot_objective_per_iteration(results_of_kind, objective_values_of_kind, kind)
+
+        table = convergence_table(results_of_kind, objective_values_of_kind, objective_parameters)
+        with open(os.path.join(args.output_directory, f'convergence_{kind}.md'), 'w') as f:
+            f.write(table)
+
+        print(kind)
+        print(table)
+
+    plot_info.waitForPlots()
@@ -16,8 +16,20 @@ initial_data = objective_function.initial_data
 dt = 1.0/2048
 dx = 1.0/2048
 end_time = objective_parameters['end_time']
-solution = heat.solve_heat_equation(initial_data, dt, dx, end_time)
 x = numpy.arange(0,1, dx)
+
+# One solve gives both the intermediate snapshots and the final solution
+output_times = [end_time / 4, end_time / 2, 3 * end_time / 4, end_time]
+plt.plot(x, initial_data(x), label='initial')
+for t, snapshot in heat.iterate_heat_equation(initial_data, dt, dx, end_time, output_times=output_times):
+    plt.plot(x, snapshot, label=f't={t:g}')
+
+    if t == end_time:
+        # the snapshot is overwritten when stepping further
+        solution = snapshot.copy()
+plt.legend()
+plot_info.showAndSave("heat_solution_snapshots")
+
 plt.plot(x, initial_data(x), label='initial')
 
 plt.plot(x, solution, '*', label='numerical')
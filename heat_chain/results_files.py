@@ -0,0 +1,80 @@
+"""
+The result files of the ensemble runs (see run_ensemble.sh), named
+
+    <kind>_<script name>_<generator>_<number of starting samples>_<batch size>.txt
+
+where kind is one of KINDS. Every row is one iteration of the optimization, with q followed by
+the coefficients of the initial data (the same layout as the parameters of simulate_heat.py).
+"""
+import os
+import re
+
+import numpy as np
+
+KINDS = ['min_shapes_per_iteration', 'closest_to_mean_shapes_per_iteration']
+
+_FILENAME_PATTERN = re.compile(r'^({})_(.+)_([^_]+)_(\d+)_(\d+)\.txt$'.format('|'.join(KINDS)))
+
+
+class ResultFile(object):
+    """
+    One result file, with the configuration parsed from its name
+    """
+
+    def __init__(self, filename, kind, script_name, generator, number_of_starting_samples, batch_size):
+        self.filename = filename
+        self.kind = kind
+        self.script_name = script_name
+        self.generator = generator
+        self.number_of_starting_samples = number_of_starting_samples
+        self.batch_size = batch_size
+
+    @property
+    def configuration_name(self):
+        """
+        Name of the configuration, without the kind (so the files of one run share it)
+        """
+        return f'{self.generator}_{self.number_of_starting_samples}_{self.batch_size}'
+
+    def load(self):
+        """
+        :return: the parameters of every iteration as an (iterations, 1 + number of coefficients) array
+        """
+        return np.loadtxt(self.filename, ndmin=2)
+
+
+def parse_result_filename(filename):
+    """
+    :return: the ResultFile, or None if filename is not named like a result file
+    """
+    match = _FILENAME_PATTERN.match(os.path.basename(filename))
+    if match is None:
+        return None
+
+    kind, script_name, generator, number_of_starting_samples, batch_size = match.groups()
+
+    return ResultFile(filename, kind, script_name, generator, int(number_of_starting_samples), int(batch_size))
+
+
+def find_result_files(directory):
+    """
+    :return: the result files in directory, sorted by kind, generator, number of starting samples
+             and batch size
+    """
+    result_files = [parse_result_filename(os.path.join(directory, filename))
+                    for filename in os.listdir(directory)]
+    result_files = [result_file for result_file in result_files if result_file is not None]
+
+    return sorted(result_files, key=lambda result_file: (KINDS.index(result_file.kind),
+                                                         result_file.generator,
+                                                         result_file.number_of_starting_samples,
+                                                         result_file.batch_size))
+
+
+def load_results(directory):
+    """
+    Reads every result file in directory (once)
+
+    :return: list of tuples (ResultFile, parameters per iteration), see find_result_files for the order
+    """
+    return [(result_file, result_file.load()) for result_file in find_result_files(directory)]
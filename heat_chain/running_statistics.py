@@ -0,0 +1,235 @@
+"""
+Statistics that are updated one sample at a time, in memory independent of the number of samples:
+the mean and variance (Welford's algorithm), the minimum and maximum, and estimates of quantiles
+(the P^2 algorithm of Jain and Chlamtac, which keeps five markers per quantile).
+
+Every statistic is kept elementwise for arrays whose first axis (the iterations) can grow, so samples
+with fewer iterations than seen so far only update the first rows.
+"""
+import numpy as np
+
+
+def _grow(array, number_of_rows, fill_value):
+    """
+    :return: array with rows of fill_value appended, so that it has (at least) number_of_rows rows
+    """
+    if array.shape[0] >= number_of_rows:
+        return array
+    padding = np.full((number_of_rows - array.shape[0],) + array.shape[1:], fill_value, dtype=array.dtype)
+    return np.concatenate([array, padding])
+
+
+class P2Quantile(object):
+    """
+    Elementwise P^2 estimate of one quantile. The state of every element is five marker heights
+    (estimates of the minimum, the p/2, p, (1+p)/2 quantiles and the maximum) with their positions.
+    The first five values of every element are stored exactly.
+    """
+
+    def __init__(self, p, shape=(0,)):
+        """
+        :param p: the quantile (between 0 and 1)
+        :param shape: initial shape of the statistics
+        """
+        if not 0 < p < 1:
+            raise Exception(f"The quantile should be between 0 and 1, got {p}")
+
+        self.p = p
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.heights = np.zeros(tuple(shape) + (5,))
+        self.positions = np.zeros(tuple(shape) + (5,))
+        self.desired_positions = np.zeros(tuple(shape) + (5,))
+
+    def _increments(self):
+        return np.array([0, self.p / 2, self.p, (1 + self.p) / 2, 1])
+
+    def update(self, values):
+        """
+        Adds one sample. values can have fewer rows than the statistics (and more, then the statistics grow)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        number_of_rows = values.shape[0]
+
+        self.count = _grow(self.count, number_of_rows, 0)
+        self.heights = _grow(self.heights, number_of_rows, 0)
+        self.positions = _grow(self.positions, number_of_rows, 0)
+        self.desired_positions = _grow(self.desired_positions, number_of_rows, 0)
+
+        # Flat views of the rows this sample updates
+        count = self.count[:number_of_rows].reshape(-1)
+        heights = self.heights[:number_of_rows].reshape(-1, 5)
+        positions = self.positions[:number_of_rows].reshape(-1, 5)
+        desired_positions = self.desired_positions[:number_of_rows].reshape(-1, 5)
+        values = values.reshape(-1)
+
+        initializing = count < 5
+        if np.any(initializing):
+            indices = np.nonzero(initializing)[0]
+            heights[indices, count[indices]] = values[indices]
+
+            initialized = indices[count[indices] == 4]
+            heights[initialized] = np.sort(heights[initialized], axis=1)
+            positions[initialized] = np.arange(1, 6)
+            desired_positions[initialized] = 1 + 4 * self._increments()
+
+        updating = np.nonzero(~initializing)[0]
+        if updating.shape[0] > 0:
+            q = heights[updating]
+            n = positions[updating]
+            x = values[updating]
+
+            # The cell x falls in, the extreme markers follow x
+            k = np.sum(x[:, np.newaxis] >= q[:, 1:4], axis=1)
+            q[:, 0] = np.minimum(q[:, 0], x)
+            q[:, 4] = np.maximum(q[:, 4], x)
+
+            n += np.arange(5)[np.newaxis, :] > k[:, np.newaxis]
+            desired = desired_positions[updating] + self._increments()
+
+            for i in range(1, 4):
+                d = desired[:, i] - n[:, i]
+                adjust = ((d >= 1) & (n[:, i + 1] - n[:, i] > 1)) | ((d <= -1) & (n[:, i - 1] - n[:, i] < -1))
+                d = np.where(adjust, np.sign(d), 0)
+
+                parabolic = q[:, i] + d / (n[:, i + 1] - n[:, i - 1]) * (
+                        (n[:, i] - n[:, i - 1] + d) * (q[:, i + 1] - q[:, i]) / (n[:, i + 1] - n[:, i])
+                        + (n[:, i + 1] - n[:, i] - d) * (q[:, i] - q[:, i - 1]) / (n[:, i] - n[:, i - 1]))
+
+                # Linear interpolation towards the neighbour when the parabola leaves the cell
+                neighbour = np.where(d > 0, i + 1, i - 1)
+                rows = np.arange(q.shape[0])
+                linear = q[:, i] + d * (q[rows, neighbour] - q[:, i]) / (n[rows, neighbour] - n[:, i])
+
+                in_cell = (q[:, i - 1] < parabolic) & (parabolic < q[:, i + 1])
+                q[:, i] = np.where(adjust, np.where(in_cell, parabolic, linear), q[:, i])
+                n[:, i] += d
+
+            heights[updating] = q
+            positions[updating] = n
+            desired_positions[updating] = desired
+
+        count += 1
+
+    def value(self):
+        """
+        :return: the estimated quantile per element (nan where there are no samples)
+        """
+        # Exact quantile of the stored values where there are fewer than five
+        stored = np.where(np.arange(5) < self.count[..., np.newaxis], self.heights, np.nan)
+        with np.errstate(all='ignore'):
+            exact = np.nanquantile(np.where(self.count[..., np.newaxis] > 0, stored, 0), self.p, axis=-1)
+
+        return np.where(self.count >= 5, self.heights[..., 2], np.where(self.count > 0, exact, np.nan))
+
+    def state(self):
+        return {'count': self.count, 'heights': self.heights, 'positions': self.positions,
+                'desired_positions': self.desired_positions}
+
+    @staticmethod
+    def from_state(p, state):
+        quantile = P2Quantile(p)
+        quantile.count = np.array(state['count'], dtype=np.int64)
+        quantile.heights = np.array(state['heights'], dtype=np.float64)
+        quantile.positions = np.array(state['positions'], dtype=np.float64)
+        quantile.desired_positions = np.array(state['desired_positions'], dtype=np.float64)
+        return quantile
+
+
+class RunningStatistics(object):
+    """
+    Elementwise count, mean, variance, minimum, maximum and quantiles of arrays, updated one sample
+    (an array with one row per iteration) at a time.
+    """
+
+    def __init__(self, quantiles=(0.1, 0.5, 0.9), shape=(0,)):
+        """
+        :param quantiles: the quantiles to estimate
+        :param shape: initial shape of the statistics (the first axis grows with the samples)
+        """
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self.sum_of_squares = np.zeros(shape)
+        self.minimum = np.full(shape, np.inf)
+        self.maximum = np.full(shape, -np.inf)
+        self.quantiles = [P2Quantile(p, shape) for p in quantiles]
+
+    def update(self, values):
+        """
+        Adds one sample, with one row per iteration. The sample can have fewer rows than seen so far.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        number_of_rows = values.shape[0]
+
+        if values.shape[1:] != self.count.shape[1:]:
+            if self.count.shape[0] > 0:
+                raise Exception(f"Expected samples of shape (iterations,) + {self.count.shape[1:]}, "
+                                f"got {values.shape}")
+            self.__init__([quantile.p for quantile in self.quantiles], (0,) + values.shape[1:])
+
+        self.count = _grow(self.count, number_of_rows, 0)
+        self.mean = _grow(self.mean, number_of_rows, 0)
+        self.sum_of_squares = _grow(self.sum_of_squares, number_of_rows, 0)
+        self.minimum = _grow(self.minimum, number_of_rows, np.inf)
+        self.maximum = _grow(self.maximum, number_of_rows, -np.inf)
+
+        # Welford's update, on views of the rows of this sample
+        count = self.count[:number_of_rows]
+        mean = self.mean[:number_of_rows]
+        count += 1
+        delta = values - mean
+        mean += delta / count
+        self.sum_of_squares[:number_of_rows] += delta * (values - mean)
+
+        np.minimum(self.minimum[:number_of_rows], values, out=self.minimum[:number_of_rows])
+        np.maximum(self.maximum[:number_of_rows], values, out=self.maximum[:number_of_rows])
+
+        for quantile in self.quantiles:
+            quantile.update(values)
+
+    def variance(self):
+        """
+        :return: the (unbiased) sample variance per element (nan where there are fewer than two samples)
+        """
+        with np.errstate(all='ignore'):
+            return np.where(self.count > 1, self.sum_of_squares / (self.count - 1), np.nan)
+
+    def as_dict(self):
+        """
+        :return: the statistics per element as (nested) lists, with one entry per iteration
+        """
+        with np.errstate(all='ignore'):
+            mean = np.where(self.count > 0, self.mean, np.nan)
+
+        return {'count': self.count.tolist(),
+                'mean': mean.tolist(),
+                'variance': self.variance().tolist(),
+                'minimum': np.where(self.count > 0, self.minimum, np.nan).tolist(),
+                'maximum': np.where(self.count > 0, self.maximum, np.nan).tolist(),
+                'quantiles': {str(quantile.p): quantile.value().tolist() for quantile in self.quantiles}}
+
+    def state(self):
+        """
+        :return: dict of arrays with the complete state (see from_state)
+        """
+        state = {'count': self.count, 'mean': self.mean, 'sum_of_squares': self.sum_of_squares,
+                 'minimum': self.minimum, 'maximum': self.maximum,
+                 'quantiles': np.array([quantile.p for quantile in self.quantiles])}
+        for index, quantile in enumerate(self.quantiles):
+            for name, array in quantile.state().items():
+                state[f'quantile_{index}_{name}'] = array
+        return state
+
+    @staticmethod
+    def from_state(state):
+        quantiles = [float(p) for p in state['quantiles']]
+        statistics = RunningStatistics(quantiles)
+        statistics.count = np.array(state['count'], dtype=np.int64)
+        statistics.mean = np.array(state['mean'], dtype=np.float64)
+        statistics.sum_of_squares = np.array(state['sum_of_squares'], dtype=np.float64)
+        statistics.minimum = np.array(state['minimum'], dtype=np.float64)
+        statistics.maximum = np.array(state['maximum'], dtype=np.float64)
+        statistics.quantiles = [P2Quantile.from_state(p, {name: state[f'quantile_{index}_{name}']
+                                                          for name in ['count', 'heights', 'positions',
+                                                                       'desired_positions']})
+                                for index, p in enumerate(quantiles)]
+        return statistics
@@ -0,0 +1,268 @@
+import glob
+import hashlib
+import json
+import os
+import os.path
+import time
+import uuid
+
+import numpy as np
+
+# Bump this whenever the solver changes in a way that changes the computed values,
+# so that old cache entries are no longer found
+CACHE_VERSION = 4
+
+# settings directory -> (_Entries, modification time of the directory when they were read). The shards are
+# only read once per process (the process pool workers get a new copy of the SampleCache with every chunk),
+# and read again if another process (or another SampleCache) changed the directory since.
+_loaded_entries = {}
+
+
+def _row_hashes(parameters):
+    """
+    64 bit hash of every row (of float64 values), computed for all the rows at once
+    """
+    words = np.ascontiguousarray(parameters, dtype=np.float64).view(np.uint64)
+
+    hashes = np.full(words.shape[0], 0xcbf29ce484222325, dtype=np.uint64)
+    for column in words.T:
+        # splitmix64 finalizer of the running hash combined with the next value
+        hashes = (hashes ^ column) * np.uint64(0xbf58476d1ce4e5b9)
+        hashes ^= hashes >> np.uint64(31)
+        hashes *= np.uint64(0x94d049bb133111eb)
+        hashes ^= hashes >> np.uint64(29)
+
+    return hashes
+
+
+class _Entries(object):
+    """
+    All the cached samples for one set of settings, sorted by the hashes of the parameters, with the time
+    every sample was last stored or found (last_used)
+    """
+
+    def __init__(self, parameters, values, last_used):
+        hashes = _row_hashes(parameters)
+
+        # Samples with the same hash (the same sample stored twice, or a hash collision) are kept once
+        order = np.argsort(hashes, kind='stable')
+        sorted_hashes = hashes[order]
+        first = np.flatnonzero(np.concatenate([[True], sorted_hashes[1:] != sorted_hashes[:-1]])) \
+            if sorted_hashes.shape[0] > 0 else np.zeros(0, dtype=np.int64)
+
+        self.sorted_hashes = sorted_hashes[first]
+        self.parameters = parameters[order[first]]
+        self.values = values[order[first]]
+        self.last_used = np.maximum.reduceat(last_used[order], first) if first.shape[0] > 0 else last_used[:0]
+
+    def positions(self, hashes):
+        """
+        :return: a tuple (positions in the entries, whether the hash is there)
+        """
+        if self.sorted_hashes.shape[0] == 0:
+            return np.zeros(hashes.shape[0], dtype=np.int64), np.zeros(hashes.shape[0], dtype=bool)
+
+        positions = np.minimum(np.searchsorted(self.sorted_hashes, hashes), self.sorted_hashes.shape[0] - 1)
+        return positions, self.sorted_hashes[positions] == hashes
+
+    def find(self, parameters):
+        """
+        :return: a tuple (indices into self.values, found)
+        """
+        indices, found = self.positions(_row_hashes(parameters))
+
+        # A hash collision is just a miss
+        if self.sorted_hashes.shape[0] > 0:
+            found &= np.all(self.parameters[indices] == parameters, axis=1)
+
+        return indices, found
+
+    def touch(self, hashes, last_used):
+        positions, found = self.positions(hashes)
+        np.maximum.at(self.last_used, positions[found], last_used)
+
+    def append(self, parameters, values, last_used):
+        return _Entries(np.concatenate([self.parameters, parameters]), np.concatenate([self.values, values]),
+                        np.concatenate([self.last_used, last_used]))
+
+
+class SampleCache(object):
+    """
+    Persistent on disk cache of simulated samples.
+
+    The samples are stored per simulation settings (dx, dt, end_time, the control points, the number of
+    Richardson levels, the time integrator and the dtype, and the number of parameters), in a directory
+    named by the hash of the settings. Every store writes one .npz file (a shard) with the parameters and
+    values of all the samples it got, and every lookup that finds samples writes the hashes of the samples
+    it found (so they count as recently used), so several processes can share one cache without locking
+    (files are written atomically). The shards are read once per run, and samples are looked up in memory,
+    all the rows at once.
+
+    evict merges the files into one shard, keeping the max_entries most recently used samples.
+    """
+
+    def __init__(self, directory, max_entries=100000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _settings_directory(self, settings, dimension):
+        relevant_settings = {'dx': settings['dx'],
+                             'dt': settings['dt'],
+                             'end_time': settings['end_time'],
+                             'control_points': list(settings['control_points']),
+                             'richardson_levels': settings.get('richardson_levels'),
+                             'time_integrator': settings.get('time_integrator', 'crank_nicolson'),
+                             'dtype': settings.get('dtype', 'float64'),
+                             'dimension': int(dimension),
+                             'version': CACHE_VERSION}
+        key = hashlib.sha256(json.dumps(relevant_settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+        return os.path.abspath(os.path.join(self.directory, key[:32]))
+
+    @staticmethod
+    def _read_shards(settings_directory, dimension, number_of_values):
+        """
+        :return: a tuple (_Entries, the files that were read)
+        """
+        parameters = [np.zeros((0, dimension))]
+        values = [np.zeros((0, number_of_values))]
+        last_used = [np.zeros(0)]
+        hits = []
+        read_filenames = []
+        for filename in sorted(glob.glob(os.path.join(settings_directory, '*.npz'))):
+            try:
+                with np.load(filename) as shard:
+                    if os.path.basename(filename).startswith('hits_'):
+                        hits.append((shard['hashes'], shard['last_used']))
+                    else:
+                        parameters.append(shard['parameters'])
+                        values.append(shard['values'])
+                        last_used.append(shard['last_used'])
+                read_filenames.append(filename)
+            except (FileNotFoundError, ValueError, OSError, KeyError):
+                # Removed by evict in another process
+                pass
+
+        entries = _Entries(np.concatenate(parameters), np.concatenate(values), np.concatenate(last_used))
+        for hashes, hit_time in hits:
+            entries.touch(hashes, hit_time)
+
+        return entries, read_filenames
+
+    def _entries(self, settings_directory, dimension, number_of_values):
+        modification_time = _modification_time(settings_directory)
+        if settings_directory not in _loaded_entries or \
+                _loaded_entries[settings_directory][1] != modification_time:
+            entries, _ = self._read_shards(settings_directory, dimension, number_of_values)
+            _loaded_entries[settings_directory] = (entries, modification_time)
+
+        return _loaded_entries[settings_directory][0]
+
+    def lookup(self, parameters, settings, number_of_values):
+        """
+        Looks up every sample in the cache, the samples found count as used now
+
+        :param parameters: (number of samples, dimension) array
+        :param settings: the simulation settings
+        :param number_of_values: the number of values per sample (number of control points)
+        :return: a tuple (values, found), where values is (number of samples, number_of_values) and
+                 found tells which rows were found in the cache (the other rows of values are zero)
+        """
+        parameters = np.asarray(parameters, dtype=np.float64)
+        settings_directory = self._settings_directory(settings, parameters.shape[1])
+        entries = self._entries(settings_directory, parameters.shape[1], number_of_values)
+
+        indices, found = entries.find(parameters)
+
+        values = np.zeros((parameters.shape[0], number_of_values))
+        values[found] = entries.values[indices[found]]
+
+        if np.any(found):
+            now = time.time()
+            hashes = entries.sorted_hashes[indices[found]]
+            entries.touch(hashes, now)
+            _write_shard(settings_directory, 'hits', hashes=hashes, last_used=np.array(now))
+            _loaded_entries[settings_directory] = (entries, _modification_time(settings_directory))
+
+        self.hits += int(np.sum(found))
+        self.misses += int(np.sum(~found))
+
+        return values, found
+
+    def store(self, parameters, values, settings):
+        """
+        Stores the values of every sample (as one new shard)
+        """
+        parameters = np.asarray(parameters, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if parameters.shape[0] == 0:
+            return
+
+        last_used = np.full(parameters.shape[0], time.time())
+        settings_directory = self._settings_directory(settings, parameters.shape[1])
+        _write_shard(settings_directory, 'samples', parameters=parameters, values=values, last_used=last_used)
+
+        if settings_directory in _loaded_entries:
+            entries = _loaded_entries[settings_directory][0].append(parameters, values, last_used)
+            _loaded_entries[settings_directory] = (entries, _modification_time(settings_directory))
+
+    def evict(self):
+        """
+        Merges the files of every settings into one shard, and removes the least recently used samples
+        until there are at most max_entries left (per settings)
+
+        :return: the number of removed samples
+        """
+        if not os.path.exists(self.directory):
+            return 0
+
+        number_removed = 0
+        for settings_directory in glob.glob(os.path.join(os.path.abspath(self.directory), '*')):
+            shard_filenames = glob.glob(os.path.join(settings_directory, 'samples_*.npz'))
+            if len(shard_filenames) == 0:
+                continue
+
+            with np.load(shard_filenames[0]) as shard:
+                dimension = shard['parameters'].shape[1]
+                number_of_values = shard['values'].shape[1]
+
+            entries, read_filenames = self._read_shards(settings_directory, dimension, number_of_values)
+            number_to_remove = max(0, entries.parameters.shape[0] - self.max_entries)
+            if len(read_filenames) <= 1 and number_to_remove == 0:
+                continue
+
+            keep = np.sort(np.argsort(entries.last_used, kind='stable')[number_to_remove:])
+            _write_shard(settings_directory, 'samples', parameters=entries.parameters[keep],
+                         values=entries.values[keep], last_used=entries.last_used[keep])
+
+            # Only the files we merged, other processes may have written new ones meanwhile
+            for filename in read_filenames:
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+
+            _loaded_entries.pop(settings_directory, None)
+            number_removed += number_to_remove
+
+        return number_removed
+
+
+def _modification_time(directory):
+    try:
+        return os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _write_shard(settings_directory, prefix, **arrays):
+    os.makedirs(settings_directory, exist_ok=True)
+
+    # Write to a temporary file first, so readers never see a half written shard
+    filename = os.path.join(settings_directory, f'{prefix}_{uuid.uuid4().hex}.npz')
+    temporary_filename = f'{filename}.tmp'
+    with open(temporary_filename, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(temporary_filename, filename)
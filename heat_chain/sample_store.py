@@ -0,0 +1,176 @@
+"""
+Storage for parameters and values of the samples.
+
+Files ending in .npy are binary, and can be appended to in O(batch) and sliced
+(memory mapped) without reading the rest of the file. Every other file is treated
+as a text file written with np.savetxt (the format the rest of the chain uses).
+
+Existing text files can be converted with
+
+    python sample_store.py parameters.txt parameters.npy
+
+The binary store is opt in: simulate_heat.py uses it for files ending in .npy, but the chain
+(submit_heat.py) still names its files values_<k>.txt, since the other ismo steps read them as
+text. Appending to a text file only writes the new rows, it is the parsing that stays linear
+in the size of the file.
+"""
+import itertools
+import struct
+
+import numpy as np
+import numpy.lib.format
+
+# Total size of the .npy header we write. The shape in the header is rewritten in place on every
+# append, so we leave plenty of room for the number of rows to grow.
+_HEADER_SIZE = 128
+
+
+def is_binary(filename):
+    return filename.endswith('.npy')
+
+
+def _data_lines(filename):
+    with open(filename) as f:
+        for line in f:
+            if line.strip() != '' and not line.lstrip().startswith('#'):
+                yield line
+
+
+def _read_header(f):
+    version = numpy.lib.format.read_magic(f)
+    if version != (1, 0):
+        raise Exception(f"Unsupported .npy version {version} in {f.name}")
+    shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(f)
+    if fortran_order:
+        raise Exception(f"{f.name} is stored in Fortran order, which is not supported")
+    return shape, dtype, f.tell()
+
+
+def _write_header(f, shape, dtype):
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+        numpy.lib.format.dtype_to_descr(dtype), tuple(shape))
+    magic = numpy.lib.format.magic(1, 0)
+
+    # magic string, header length (2 bytes), header, padding and a final newline
+    padding = _HEADER_SIZE - len(magic) - 2 - len(header) - 1
+    if padding < 0:
+        raise Exception(f"Shape {shape} does not fit in the .npy header")
+
+    f.seek(0)
+    f.write(magic + struct.pack('<H', len(header) + padding + 1) + header.encode('latin1') + b' ' * padding + b'\n')
+
+
+def count_rows(filename):
+    """
+    Number of samples (rows) in the file, without reading the samples
+    """
+    if is_binary(filename):
+        with open(filename, 'rb') as f:
+            shape, _, _ = _read_header(f)
+        return shape[0]
+    else:
+        return sum(1 for _ in _data_lines(filename))
+
+
+def load_rows(filename, start=0, end=None):
+    """
+    Reads only the rows start, ..., end - 1 of the file
+
+    :return: (end - start, dimension) array
+    """
+    if is_binary(filename):
+        rows = np.array(np.load(filename, mmap_mode='r')[start:end])
+        return rows if rows.ndim > 1 else rows[:, np.newaxis]
+    else:
+        return np.loadtxt(itertools.islice(_data_lines(filename), start, end), ndmin=2)
+
+
+def _text_format(rows):
+    """
+    The np.savetxt format, single precision rows only get the digits they have
+    """
+    return '%.8e' if rows.dtype == np.float32 else '%.18e'
+
+
+def write_rows(filename, rows):
+    """
+    Writes the rows (overwriting the file), binary files keep the dtype of rows
+    """
+    rows = np.ascontiguousarray(rows)
+    if is_binary(filename):
+        with open(filename, 'wb') as f:
+            _write_header(f, rows.shape, rows.dtype)
+            f.write(rows.tobytes())
+    else:
+        np.savetxt(filename, rows, fmt=_text_format(rows))
+
+
+def append_rows(filename, rows):
+    """
+    Appends the rows to the end of the file (creating it if it does not exist), only the new rows are written
+    """
+    rows = np.ascontiguousarray(rows)
+
+    if not is_binary(filename):
+        with open(filename, 'ab') as f:
+            np.savetxt(f, rows, fmt=_text_format(rows))
+        return
+
+    try:
+        f = open(filename, 'r+b')
+    except FileNotFoundError:
+        write_rows(filename, rows)
+        return
+
+    with f:
+        shape, dtype, data_offset = _read_header(f)
+
+        if shape[1:] != rows.shape[1:]:
+            raise Exception(f"Can not append rows of shape {rows.shape} to {filename} with shape {shape}")
+
+        rows = rows.astype(dtype, copy=False)
+        new_shape = (shape[0] + rows.shape[0],) + tuple(shape[1:])
+
+        if data_offset != _HEADER_SIZE:
+            # Not written by us (eg. by np.save), rewrite it once with room to grow
+            previous_rows = np.fromfile(f, dtype=dtype).reshape(shape)
+            f.seek(0)
+            f.truncate()
+            _write_header(f, new_shape, dtype)
+            f.write(previous_rows.tobytes())
+        else:
+            f.seek(0, 2)
+
+        # Write the data before the header, so an interrupted append leaves a consistent file
+        f.write(rows.tobytes())
+        f.flush()
+        _write_header(f, new_shape, dtype)
+
+
+def convert_text_to_binary(text_filename, binary_filename):
+    """
+    Converts a text file written with np.savetxt to the binary (.npy) store
+    """
+    rows = np.loadtxt(text_filename)
+    write_rows(binary_filename, rows)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="""
+Converts a parameter or values text file (written by np.savetxt) to the binary (.npy) sample store
+    """)
+
+    parser.add_argument('text_filename', type=str,
+                        help='Input text file')
+
+    parser.add_argument('binary_filename', type=str,
+                        help='Output binary file (should end in .npy)')
+
+    args = parser.parse_args()
+
+    if not is_binary(args.binary_filename):
+        raise Exception(f"The binary filename should end in .npy, got {args.binary_filename}")
+
+    convert_text_to_binary(args.text_filename, args.binary_filename)
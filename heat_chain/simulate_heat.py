@@ -1,24 +1,370 @@
+import concurrent.futures
 import json
+import multiprocessing.shared_memory
+import socket
+import time
 
 import numpy as np
+import os
 import os.path
 import sys
-from heat import solve_heat_equation, InitialDataControlSine
+from heat import solve_heat_equation_sine_series, solve_heat_equation_richardson, TIME_INTEGRATORS, DTYPES, \
+    instrument, Timings
+from heat.precision import storage_dtype
+import sample_store
+from sample_cache import SampleCache
+
+
+def samples_for_rank(number_of_samples, number_of_processes, rank):
+    """
+    The samples (start, end) rank should compute, every rank gets a contiguous block of samples
+    """
+    number_of_samples_per_process = (number_of_samples + number_of_processes - 1) // number_of_processes
+    start = min(number_of_samples, rank * number_of_samples_per_process)
+    end = min(number_of_samples, (rank + 1) * number_of_samples_per_process)
+
+    return start, end
+
+
+def gather_counts_and_displacements(number_of_samples, number_of_processes, number_of_values):
+    """
+    The receive counts and displacements (in values, not samples) of every rank for the Gatherv of
+    the values, see samples_for_rank
+
+    :return: a tuple (counts, displacements), lists with one entry per rank
+    """
+    counts = []
+    displacements = []
+    for rank in range(number_of_processes):
+        start, end = samples_for_rank(number_of_samples, number_of_processes, rank)
+        counts.append(number_of_values * (end - start))
+        displacements.append(number_of_values * start)
+
+    return counts, displacements
+
+
+def load_simulation_settings(richardson_levels=None, time_integrator='crank_nicolson', dtype='float64'):
+    """
+    Reads the objective configuration (so we get the control points) and sets up the resolution
+
+    :param richardson_levels: if given, the values are Richardson extrapolated from this many grids
+                              (see solve_heat_equation_richardson), starting from the much coarser dx = 1/256
+    :param time_integrator: see solve_heat_equation (Richardson extrapolation requires 'crank_nicolson')
+    :param dtype: precision of the simulations and of the written values, see solve_heat_equation
+    """
+    if richardson_levels is not None and time_integrator != 'crank_nicolson':
+        raise Exception("Richardson extrapolation is only supported with the crank_nicolson time integrator")
+
+    with open("objective_parameters.json") as objective_parameters_file:
+        objective_parameters = json.load(objective_parameters_file)
+
+    if richardson_levels is None:
+        dx = 1.0 / 2048
+    else:
+        dx = 1.0 / 256
+    return {'control_points': objective_parameters['control_points'],
+            'end_time': objective_parameters['end_time'],
+            'dimension': len(objective_parameters['coefficients']) + 1,
+            'dx': dx,
+            'dt': dx,
+            'richardson_levels': richardson_levels,
+            'time_integrator': time_integrator,
+            'dtype': dtype}
+
+
+def simulate(parameters, settings, batch_size, cache=None):
+    """
+    Computes the values at the control points for every row of parameters (q followed by the coefficients)
+
+    :param cache: if given, samples found in the SampleCache are not recomputed, and new samples are stored
+                  (the sine series is cheap, see the sample_cache benchmarks for when this pays off)
+    :return: (number of samples, number of control points) array (in the storage dtype of settings['dtype'])
+    """
+    dtype = settings.get('dtype', 'float64')
+
+    if cache is not None:
+        values, found = cache.lookup(parameters, settings, len(settings['control_points']))
+
+        if not np.all(found):
+            values[~found] = simulate(parameters[~found], settings, batch_size)
+            cache.store(parameters[~found], values[~found], settings)
+
+        return values.astype(storage_dtype(dtype), copy=False)
+
+    values = np.zeros((parameters.shape[0], len(settings['control_points'])), dtype=storage_dtype(dtype))
+
+    for batch_start in range(0, parameters.shape[0], batch_size):
+        batch_end = min(parameters.shape[0], batch_start + batch_size)
+        q = parameters[batch_start:batch_end, 0]
+        coefficients = parameters[batch_start:batch_end, 1:]
+
+        # We only need the solution at the control points, so we never build the full grid
+        if settings.get('richardson_levels') is None:
+            batch_values = solve_heat_equation_sine_series(coefficients, settings['dt'], settings['dx'],
+                                                           settings['end_time'], settings['control_points'], q=q,
+                                                           time_integrator=settings.get('time_integrator',
+                                                                                        'crank_nicolson'),
+                                                           dtype=dtype)
+        else:
+            batch_values, _ = solve_heat_equation_richardson(coefficients, settings['dt'], settings['dx'],
+                                                             settings['end_time'], settings['control_points'], q=q,
+                                                             levels=settings['richardson_levels'], dtype=dtype)
+        values[batch_start:batch_end, :] = batch_values
+
+    return values
+
+
+def simulate_and_time(parameters, settings, batch_size, cache=None):
+    """
+    Runs simulate with the solver instrumentation enabled
+
+    :return: a tuple (values, report), where report has the number of samples, the time used (seconds),
+             the samples per second, the solver timings (see heat.instrument) and the cache hits and misses
+    """
+    hits_before = cache.hits if cache is not None else 0
+    misses_before = cache.misses if cache is not None else 0
+
+    start = time.perf_counter()
+    with instrument() as timings:
+        values = simulate(parameters, settings, batch_size, cache)
+    seconds = time.perf_counter() - start
+
+    report = {'number_of_samples': parameters.shape[0],
+              'seconds': seconds,
+              'samples_per_second': parameters.shape[0] / seconds if seconds > 0 else 0.0,
+              'timings': timings.as_dict(),
+              'cache_hits': (cache.hits if cache is not None else 0) - hits_before,
+              'cache_misses': (cache.misses if cache is not None else 0) - misses_before}
+
+    return values, report
+
+
+def make_report(rank_reports, wall_seconds, backend, settings):
+    """
+    Aggregates the reports of every rank (or process pool worker) from simulate_and_time
+
+    The load imbalance is the time of the slowest rank relative to the mean time of the ranks, minus one
+    (so 0 is perfectly balanced). Without samples (an empty --start/--end slice), the report has neither
+    the samples per second nor the load imbalance.
+    """
+    timings = Timings()
+    for rank_report in rank_reports:
+        timings.merge(rank_report['timings'])
+
+    number_of_samples = sum(rank_report['number_of_samples'] for rank_report in rank_reports)
+
+    report = {'backend': backend,
+              'number_of_ranks': len(rank_reports),
+              'number_of_samples': number_of_samples,
+              'wall_seconds': wall_seconds,
+              'cache_hits': sum(rank_report['cache_hits'] for rank_report in rank_reports),
+              'cache_misses': sum(rank_report['cache_misses'] for rank_report in rank_reports),
+              'settings': {key: settings[key] for key in ['dx', 'dt', 'end_time', 'richardson_levels',
+                                                          'time_integrator', 'dtype'] if key in settings},
+              'timings': timings.as_dict(),
+              'ranks': rank_reports}
+
+    if number_of_samples > 0:
+        rank_seconds = [rank_report['seconds'] for rank_report in rank_reports]
+        mean_rank_seconds = np.mean(rank_seconds)
+
+        report['samples_per_second'] = number_of_samples / wall_seconds if wall_seconds > 0 else 0.0
+        report['load_imbalance'] = max(rank_seconds) / mean_rank_seconds - 1 if mean_rank_seconds > 0 else 0.0
+
+    return report
+
+
+def report_cache(cache, hits, misses):
+    print(f"Sample cache ({cache.directory}): {hits} hits, {misses} misses")
+
+    removed = cache.evict()
+    if removed > 0:
+        print(f"Sample cache: evicted {removed} least recently used entries")
+
+
+def run_mpi(input_parameters_file, selected_rows, settings, batch_size, cache=None, comm=None):
+    """
+    Every MPI rank computes a contiguous block of the samples, and the values are gathered on rank 0
+
+    :param comm: the communicator of the ranks (MPI.COMM_WORLD by default)
+    :return: a tuple (values, rank reports) on rank 0 (see simulate_and_time), (None, None) on every other rank
+    """
+    from mpi4py import MPI
+
+    if comm is None:
+        comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    number_of_processes = comm.Get_size()
+
+    # Only rank 0 scans the file, every rank then reads its own rows
+    if rank == 0:
+        number_of_rows = sample_store.count_rows(input_parameters_file)
+    else:
+        number_of_rows = None
+    number_of_rows = comm.bcast(number_of_rows, root=0)
+
+    selected_rows = range(number_of_rows)[selected_rows]
+    number_of_samples = len(selected_rows)
+    number_of_control_points = len(settings['control_points'])
+
+    start_parameter, end_parameter = samples_for_rank(number_of_samples, number_of_processes, rank)
+
+    if end_parameter > start_parameter:
+        parameters = sample_store.load_rows(input_parameters_file, selected_rows[start_parameter],
+                                            selected_rows[end_parameter - 1] + 1)
+    else:
+        parameters = np.zeros((0, settings['dimension']))
+
+    # Only the values for the samples of this rank
+    local_values, rank_report = simulate_and_time(parameters, settings, batch_size, cache)
+    rank_report['rank'] = rank
+    rank_report['host'] = socket.gethostname()
+
+    # Collect all the values on rank 0
+    counts_per_rank, displacements = gather_counts_and_displacements(number_of_samples, number_of_processes,
+                                                                     number_of_control_points)
+
+    dtype = storage_dtype(settings.get('dtype', 'float64'))
+    if rank == 0:
+        values = np.zeros((number_of_samples, number_of_control_points), dtype=dtype)
+        receive_buffer = [values, counts_per_rank, displacements, MPI.FLOAT if dtype == np.float32 else MPI.DOUBLE]
+    else:
+        values = None
+        receive_buffer = None
+
+    comm.Gatherv(np.ascontiguousarray(local_values, dtype=dtype), receive_buffer, root=0)
+
+    rank_reports = comm.gather(rank_report, root=0)
+
+    if cache is not None and rank == 0:
+        report_cache(cache, sum(report['cache_hits'] for report in rank_reports),
+                     sum(report['cache_misses'] for report in rank_reports))
+
+    return values, rank_reports
+
+
+def _simulate_chunk_into_shared_memory(shared_memory_name, shape, input_parameters_file, first_row, chunk_start,
+                                       chunk_end, settings, batch_size, cache):
+    """
+    Worker for run_process_pool: reads the rows of its chunk and writes the values straight into the
+    shared result array (so nothing but the chunk bounds is pickled)
+
+    :return: the report of the chunk (see simulate_and_time)
+    """
+    shared_memory = multiprocessing.shared_memory.SharedMemory(name=shared_memory_name)
+    try:
+        values = np.ndarray(shape, dtype=storage_dtype(settings.get('dtype', 'float64')), buffer=shared_memory.buf)
+
+        parameters = sample_store.load_rows(input_parameters_file, first_row + chunk_start, first_row + chunk_end)
+        values[chunk_start:chunk_end, :], report = simulate_and_time(parameters, settings, batch_size, cache)
+
+        # Make sure we do not keep a reference to the buffer when closing
+        del values
+    finally:
+        shared_memory.close()
+
+    report['pid'] = os.getpid()
+    return report
+
+
+def _merge_chunk_reports(chunk_reports):
+    """
+    Combines the chunk reports of each process pool worker into one report per worker
+    """
+    worker_reports = {}
+    for chunk_report in chunk_reports:
+        pid = chunk_report['pid']
+        if pid not in worker_reports:
+            worker_reports[pid] = {'pid': pid, 'number_of_chunks': 0, 'number_of_samples': 0, 'seconds': 0.0,
+                                   'timings': Timings(), 'cache_hits': 0, 'cache_misses': 0}
+
+        worker_report = worker_reports[pid]
+        worker_report['number_of_chunks'] += 1
+        worker_report['timings'].merge(chunk_report['timings'])
+        for key in ['number_of_samples', 'seconds', 'cache_hits', 'cache_misses']:
+            worker_report[key] += chunk_report[key]
+
+    merged_reports = []
+    for rank, pid in enumerate(sorted(worker_reports.keys())):
+        worker_report = worker_reports[pid]
+        worker_report['rank'] = rank
+        worker_report['timings'] = worker_report['timings'].as_dict()
+        worker_report['samples_per_second'] = worker_report['number_of_samples'] / worker_report['seconds'] \
+            if worker_report['seconds'] > 0 else 0.0
+        merged_reports.append(worker_report)
+
+    return merged_reports
+
+
+def run_process_pool(input_parameters_file, selected_rows, settings, batch_size, number_of_processes, chunk_size,
+                     cache=None):
+    """
+    Computes the samples on a local pool of processes (no MPI needed). The samples are handed out in
+    chunks of chunk_size, and every worker writes its values into one shared memory array.
+
+    :return: a tuple (values, worker reports) (see simulate_and_time, one report per worker process)
+    """
+    selected_rows = range(sample_store.count_rows(input_parameters_file))[selected_rows]
+    number_of_samples = len(selected_rows)
+    shape = (number_of_samples, len(settings['control_points']))
+    dtype = storage_dtype(settings.get('dtype', 'float64'))
+
+    if number_of_samples == 0:
+        return np.zeros(shape, dtype=dtype), []
+
+    shared_memory = multiprocessing.shared_memory.SharedMemory(create=True,
+                                                               size=int(np.prod(shape)) * dtype.itemsize)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=number_of_processes) as executor:
+            futures = [executor.submit(_simulate_chunk_into_shared_memory, shared_memory.name, shape,
+                                       input_parameters_file, selected_rows[0], chunk_start,
+                                       min(number_of_samples, chunk_start + chunk_size), settings, batch_size,
+                                       cache)
+                       for chunk_start in range(0, number_of_samples, chunk_size)]
+
+            # Raises if a worker failed
+            chunk_reports = [future.result() for future in concurrent.futures.as_completed(futures)]
+
+        values = np.array(np.ndarray(shape, dtype=dtype, buffer=shared_memory.buf))
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+
+    worker_reports = _merge_chunk_reports(chunk_reports)
+
+    if cache is not None:
+        report_cache(cache, sum(report['cache_hits'] for report in worker_reports),
+                     sum(report['cache_misses'] for report in worker_reports))
+
+    return values, worker_reports
+
+
+def write_values(values, output_values_files, output_append):
+    """
+    Writes the values of every control point to its own file, in the dtype of values (binary files that
+    are appended to keep their dtype)
+    """
+    for k in range(values.shape[1]):
+        if output_append:
+            # Only the new values are written
+            sample_store.append_rows(output_values_files[k], values[:, k])
+        else:
+            sample_store.write_rows(output_values_files[k], values[:, k])
+
 
 if __name__ == '__main__':
     print(f"Command line: {' '.join(sys.argv)}")
     import argparse
-    from mpi4py import MPI
 
     parser = argparse.ArgumentParser(description="""
 Runs some complicated function on the input parameters
     """)
 
     parser.add_argument('--input_parameters_file', type=str, required=True,
-                        help='Input filename for the parameters (readable by np.loadtxt)')
+                        help='Input filename for the parameters (readable by np.loadtxt, or a binary .npy sample store)')
 
     parser.add_argument('--output_values_files', type=str, required=True, nargs="+",
-                        help='Output filename for the values (will be written by np.savetxt)')
+                        help='Output filename for the values (will be written by np.savetxt, or to a binary sample store if it ends in .npy)')
 
     parser.add_argument('--starting_sample', type=int, required=True,
                         help='The starting id of the first sample')
@@ -35,63 +381,80 @@ Runs some complicated function on the input parameters
     parser.add_argument('--output_append', action='store_true',
                         help='Append output to end of file')
 
-    args = parser.parse_args()
+    parser.add_argument('--batch_size', type=int, default=128,
+                        help='Number of samples each process solves together')
 
-    starting_sample_id = args.starting_sample
-    iteration_number = args.iteration_number
+    parser.add_argument('--backend', type=str, default='mpi', choices=['mpi', 'process_pool'],
+                        help='How to distribute the samples: "mpi" (run under mpirun) or "process_pool" '
+                             '(local processes, no MPI needed)')
 
-    comm = MPI.COMM_WORLD
-    rank = comm.Get_rank()
-    number_of_processes = comm.Get_size()
+    parser.add_argument('--number_of_processes', type=int, default=None,
+                        help='Number of local processes for the process_pool backend (default: number of cores)')
 
-    if args.end != -1:
-        parameters = np.loadtxt(args.input_parameters_file)[args.start:args.end]
-    else:
-        parameters = np.loadtxt(args.input_parameters_file)[args.start:]
+    parser.add_argument('--chunk_size', type=int, default=1024,
+                        help='Number of samples handed to a process pool worker at a time')
 
-    assert (parameters.shape[0] >= number_of_processes)
+    parser.add_argument('--cache_directory', type=str, default=None,
+                        help='Directory of the persistent sample cache, samples found there are not recomputed '
+                             '(by default no cache is used, recomputing the sine series is often as fast, see '
+                             'the sample_cache benchmarks)')
 
-    # Load configuration so we can get the control points
-    with open("objective_parameters.json") as objective_parameters_file:
-        objective_parameters = json.load(objective_parameters_file)
+    parser.add_argument('--cache_max_entries', type=int, default=100000,
+                        help='Maximum number of samples kept in the cache per settings (the least recently '
+                             'used are evicted)')
 
-    control_points = objective_parameters['control_points']
-    end_time = objective_parameters['end_time']
-    dx = 1.0 / 2048
-    dt = dx
+    parser.add_argument('--richardson_levels', type=int, default=None, choices=[2, 3],
+                        help='Richardson extrapolate the values from this many coarse grids instead of '
+                             'solving on the fine grid')
 
-    values = np.zeros((parameters.shape[0], len(control_points)))
+    parser.add_argument('--time_integrator', type=str, default='crank_nicolson', choices=TIME_INTEGRATORS,
+                        help='Time integrator used for the simulations')
 
-    number_of_parameters_per_process = (parameters.shape[0] + number_of_processes - 1) // number_of_processes
-    start_parameter = rank * number_of_parameters_per_process
-    end_parameter = min(parameters.shape[0], (rank + 1) * number_of_parameters_per_process)
+    parser.add_argument('--dtype', type=str, default='float64', choices=DTYPES,
+                        help='Precision of the simulations and of the written values: float64, float32, or mixed '
+                             '(float32 values computed in float64)')
 
-    x = np.linspace(0, 1, int(1 / dx))
-    control_point_indices = [abs(control_point - x).argmin() for control_point in control_points]
+    parser.add_argument('--report_file', type=str, default=None,
+                        help='Output JSON file with the timings per rank, samples per second and load imbalance '
+                             '(default: simulate_heat_report_<iteration_number>.json next to the values files)')
 
-    for parameter_index in range(start_parameter, end_parameter):
-        q = parameters[parameter_index, 0]
-        coefficients = parameters[parameter_index, 1:]
+    args = parser.parse_args()
 
-        initial_data = InitialDataControlSine(coefficients)
+    starting_sample_id = args.starting_sample
+    iteration_number = args.iteration_number
+
+    settings = load_simulation_settings(args.richardson_levels, args.time_integrator, args.dtype)
+    selected_rows = slice(args.start, args.end if args.end != -1 else None)
 
-        solution = solve_heat_equation(initial_data, dt, dx, end_time, q=q)
+    if args.cache_directory is not None:
+        cache = SampleCache(args.cache_directory, args.cache_max_entries)
+    else:
+        cache = None
 
-        for output_index, (control_point_index, control_point) in enumerate(zip(control_point_indices, control_points)):
-            values[parameter_index, output_index] = solution[control_point_index]
-    comm.Barrier()
+    start = time.perf_counter()
+    if args.backend == 'mpi':
+        values, rank_reports = run_mpi(args.input_parameters_file, selected_rows, settings, args.batch_size, cache)
+    else:
+        values, rank_reports = run_process_pool(args.input_parameters_file, selected_rows, settings,
+                                                args.batch_size, args.number_of_processes or os.cpu_count(),
+                                                args.chunk_size, cache)
+    wall_seconds = time.perf_counter() - start
 
-    if rank == 0:
-        for k in range(values.shape[1]):
-            values_to_write = values[:, k]
-            if args.output_append:
-                if os.path.exists(args.output_values_files[k]):
-                    previous_values = np.loadtxt(args.output_values_files[k])
+    # Only rank 0 gets the values with MPI
+    if values is not None:
+        write_values(values, args.output_values_files, args.output_append)
 
-                    new_values = np.zeros((values.shape[0] + previous_values.shape[0]))
+        report_file = args.report_file
+        if report_file is None:
+            report_file = os.path.join(os.path.dirname(args.output_values_files[0]),
+                                       f'simulate_heat_report_{iteration_number}.json')
 
-                    new_values[:previous_values.shape[0]] = previous_values
-                    new_values[previous_values.shape[0]:] = values[:,k]
+        report = make_report(rank_reports, wall_seconds, args.backend, settings)
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=4)
 
-                    values_to_write = new_values
-            np.savetxt(args.output_values_files[k], values_to_write)
+        if report['number_of_samples'] > 0:
+            print(f"Simulated {report['number_of_samples']} samples in {wall_seconds:.2f} s "
+                  f"({report['samples_per_second']:.1f} samples/s, load imbalance {report['load_imbalance']:.1%})")
+        else:
+            print("No samples to simulate")
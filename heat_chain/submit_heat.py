@@ -5,31 +5,56 @@ import ismo.submit
 import ismo.submit.defaults
 import os
 
+from heat import TIME_INTEGRATORS, DTYPES
+
 
 class HeatCommands(ismo.submit.defaults.Commands):
-    def __init__(self, number_of_processes=1, **kwargs):
+    def __init__(self, number_of_processes=1, evolve_backend='mpi', richardson_levels=None,
+                 time_integrator='crank_nicolson', dtype='float64', **kwargs):
         super().__init__(**kwargs)
 
         self.current_sample_number = 0
 
         self.number_of_processes = number_of_processes
 
+        self.evolve_backend = evolve_backend
+
+        self.richardson_levels = richardson_levels
+
+        self.time_integrator = time_integrator
+
+        self.dtype = dtype
+
     def do_evolve(self, submitter,
                   *,
                   iteration_number: int,
                   input_parameters_file: str,
                   output_value_files: list):
         # Evolve
-        evolve = ismo.submit.Command(['mpirun', '-np',
-                                      str(self.number_of_processes[iteration_number]),
-                                      self.python_command,
-                                      'simulate_heat.py'])
+        if self.evolve_backend == 'mpi':
+            evolve = ismo.submit.Command(['mpirun', '-np',
+                                          str(self.number_of_processes[iteration_number]),
+                                          self.python_command,
+                                          'simulate_heat.py'])
+        else:
+            evolve = ismo.submit.Command([self.python_command,
+                                          'simulate_heat.py'])
+
+            evolve = evolve.with_long_arguments(backend=self.evolve_backend,
+                                                number_of_processes=self.number_of_processes[iteration_number])
 
         evolve = evolve.with_long_arguments(input_parameters_file=input_parameters_file,
                                             output_values_files=output_value_files,
                                             iteration_number=iteration_number,
                                             starting_sample=self.current_sample_number)
 
+        if self.richardson_levels is not None:
+            evolve = evolve.with_long_arguments(richardson_levels=self.richardson_levels)
+
+        evolve = evolve.with_long_arguments(time_integrator=self.time_integrator)
+
+        evolve = evolve.with_long_arguments(dtype=self.dtype)
+
         evolve = self.add_start_end_values(evolve)
 
         submitter(evolve, wait_time_in_hours=24, number_of_processes=self.number_of_processes[iteration_number])
@@ -58,7 +83,7 @@ Submits all the jobs for the sine experiments
         """)
 
     parser.add_argument('--number_of_processes', type=int, default=[1], nargs='+', required=True,
-                        help='Number of processes to use (for MPI, only applies to simulation step)')
+                        help='Number of processes to use (for MPI or the process pool, only applies to simulation step)')
 
     parser.add_argument('--number_of_samples_per_iteration', type=int, nargs='+', required=True,
                         help='Number of samples per iteration')
@@ -87,6 +112,21 @@ Submits all the jobs for the sine experiments
     parser.add_argument('--optimizer', type=str, default='L-BFGS-B',
                         help='Name of optimizer')
 
+    parser.add_argument('--evolve_backend', type=str, default='mpi', choices=['mpi', 'process_pool'],
+                        help='How to run the simulation step: "mpi" (mpirun) or "process_pool" '
+                             '(local process pool, no MPI needed)')
+
+    parser.add_argument('--richardson_levels', type=int, default=None, choices=[2, 3],
+                        help='Richardson extrapolate the simulated values from this many coarse grids '
+                             '(see simulate_heat.py)')
+
+    parser.add_argument('--time_integrator', type=str, default='crank_nicolson',
+                        choices=TIME_INTEGRATORS,
+                        help='Time integrator used for the simulations')
+
+    parser.add_argument('--dtype', type=str, default='float64', choices=DTYPES,
+                        help='Precision of the simulations and of the written values (see simulate_heat.py)')
+
     args = parser.parse_args()
 
     submitter = ismo.submit.create_submitter(args.submitter, args.chain_name, dry_run=args.dry_run,
@@ -106,6 +146,10 @@ Submits all the jobs for the sine experiments
     commands = HeatCommands(dimension=len(objective_parameters['coefficients']) + 1,
                             starting_sample=args.starting_sample,
                             number_of_processes=number_of_processes,
+                            evolve_backend=args.evolve_backend,
+                            richardson_levels=args.richardson_levels,
+                            time_integrator=args.time_integrator,
+                            dtype=args.dtype,
                             number_of_output_values=len(objective_parameters['control_points']),
                             training_parameter_config_file='training_parameters.json',
                             optimize_target_file='objective.py',
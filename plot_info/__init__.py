@@ -1 +1 @@
-from .plot_info import savePlot, showAndSave, saveData
+from .plot_info import savePlot, showAndSave, saveData, setAsynchronousSaving, waitForPlots
@@ -1,77 +1,82 @@
 AUTHORS="Kjetil Olsen Lye @ ETHZ <kjetil.o.lye@gmail.com> and Deep Ray @ EPFL <deep.ray@epfl.ch>"
-import numpy
-import glob
+# The heavy modules (matplotlib, tikzplotlib, PIL, IPython and GitPython) are only imported by the
+# functions that need them, so scripts that import plot_info but do not plot start quickly.
+import atexit
+import hashlib
+import json
+import pickle
 import sys
-
-import matplotlib
-
-from numpy import *
-import matplotlib.pyplot as plt
-
-import tikzplotlib
-import PIL
 import socket
 import os
 import os.path
 import datetime
-import traceback
 import inspect
 import copy
 import numpy as np
 
-try:
-    from IPython.core.display import display, HTML
-except:
-    def display(x):
-        print(x)
 
+def __getattr__(name):
+    # display and HTML come from IPython, which is only imported when they are first used
+    if name in ['display', 'HTML']:
+        try:
+            from IPython.core.display import display, HTML
+        except:
+            def display(x):
+                print(x)
+
+
+            def HTML(x):
+                return x
 
-    def HTML(x):
-        return x
+        globals()['display'] = display
+        globals()['HTML'] = HTML
+        return globals()[name]
 
-try:
-    import git
+    raise AttributeError(f"module {__name__} has no attribute {name}")
 
 
-    def get_git_metadata():
-        if not get_git_metadata.cached:
+def get_git_metadata():
+    if not get_git_metadata.cached:
+        try:
+            import git
+
             get_git_metadata.repo = git.Repo(search_parent_directories=True)
             get_git_metadata.sha = get_git_metadata.repo.head.object.hexsha
             get_git_metadata.modified = get_git_metadata.repo.is_dirty()
             get_git_metadata.activeBranch = get_git_metadata.repo.active_branch
             get_git_metadata.url = get_git_metadata.repo.remotes.origin.url
-            get_git_metadata.cached = True
             get_git_metadata.short_sha = get_git_metadata.repo.git.rev_parse(get_git_metadata.sha, short=1)
+            get_git_metadata.available = True
+        except:
+            get_git_metadata.available = False
+        get_git_metadata.cached = True
 
-        return {'git_commit': str(get_git_metadata.sha),
-                'git_repo_modified': str(get_git_metadata.modified),
-                'git_branch': str(get_git_metadata.activeBranch),
-                'git_remote_url': str(get_git_metadata.url),
-                'git_short_commit': str(get_git_metadata.short_sha)}
-
-
-    get_git_metadata.cached = False
-
-
-    def add_git_information(filename):
-        writeMetadata(filename, get_git_metadata())
-
-except:
-    def add_git_information(filename):
-        pass
-
-
-    def get_git_metadata():
+    if not get_git_metadata.available:
         return {'git_commit': 'unknown',
                 'git_repo_modified': 'unknown',
                 'git_branch': 'unknown',
                 'git_remote_url': 'unknown',
                 'git_short_commit': "unknown"}
 
+    return {'git_commit': str(get_git_metadata.sha),
+            'git_repo_modified': str(get_git_metadata.modified),
+            'git_branch': str(get_git_metadata.activeBranch),
+            'git_remote_url': str(get_git_metadata.url),
+            'git_short_commit': str(get_git_metadata.short_sha)}
+
+
+get_git_metadata.cached = False
+
+
+def add_git_information(filename):
+    if get_git_metadata()['git_commit'] != 'unknown':
+        writeMetadata(filename, get_git_metadata())
+
 
 def get_stacktrace_str():
     trace = ""
-    for k in inspect.stack()[1:]:
+    # No source context, reading the source files is by far the slowest part
+    for k in inspect.stack(context=0)[1:]:
         trace += "[function: {}, line: {}, file: {}]\n".format(k.function, k.lineno, k.filename)
     return trace
 
@@ -153,6 +158,9 @@ class RedirectStdStreamsToNull(object):
 
 
 def writeMetadata(filename, data):
+    import PIL.Image
+    import PIL.PngImagePlugin
+
     im = PIL.Image.open(filename)
 
     meta = PIL.PngImagePlugin.PngInfo()
@@ -167,6 +175,8 @@ def only_alphanum(s):
 
 
 def get_current_title():
+    import matplotlib.pyplot as plt
+
     try:
         title = plt.gca().get_title()
         if title is not None and title.strip() != "":
@@ -188,20 +198,316 @@ def get_current_title():
         return ''
 
 
+def get_provenance():
+    """
+    Everything about the process that made the plots (git, python, the loaded modules, the accessed
+    environments and the additional plot parameters, ...). This is built once, and only rebuilt when
+    the loaded packages, the working directory, the accessed environments or the additional plot
+    parameters change. Only new top level packages count, submodules are loaded all the time
+    (saving a png loads some of PIL's plugins, say), and do not change any versions.
+
+    :return: a tuple (provenance dictionary, the provenance as JSON, sha256 of the JSON)
+    """
+    key = (frozenset(name for name in sys.modules.keys() if '.' not in name),
+           os.getcwd(),
+           tuple(sorted(get_environment.accessed_environments.items())),
+           tuple(sorted(get_additional_plot_parameters().items())))
+
+    if get_provenance.key != key:
+        provenance = {'Copyright': 'Copyright, {}'.format(AUTHORS),
+                      'working_directory': os.getcwd(),
+                      'hostname': socket.gethostname(),
+                      'created_on_date': str(datetime.datetime.now()),
+                      **get_git_metadata(),
+                      'accessed_environments': dict(get_environment.accessed_environments),
+                      'additional_parameters': dict(get_additional_plot_parameters()),
+                      'python_version': get_python_description(),
+                      'modules_loaded': get_loaded_python_modules(),
+                      'in_file': get_notebook_name()}
+
+        provenance_json = json.dumps(provenance, indent=4, sort_keys=True)
+        get_provenance.snapshot = (provenance, provenance_json,
+                                   hashlib.sha256(provenance_json.encode('utf-8')).hexdigest())
+        get_provenance.key = key
+
+    return get_provenance.snapshot
+
+
+get_provenance.key = None
+get_provenance.snapshot = None
+
+
+def get_provenance_filename(sha256):
+    """
+    The provenance file is named by the hash of its content, so every plot of a run shares one file
+    """
+    return 'provenance_{}.json'.format(sha256[:16])
+
+
+def _write_provenance_file(directory, provenance_json, sha256):
+    path = os.path.join(directory, get_provenance_filename(sha256))
+    if not os.path.exists(path):
+        # Written to a temporary file first, so nobody sees a half written file
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary_path, 'w') as f:
+            f.write(provenance_json)
+        os.replace(temporary_path, path)
+
+
+def write_provenance(directory):
+    """
+    Writes the provenance (see get_provenance) to a JSON file in directory, unless it is already there.
+
+    :return: a tuple (filename relative to directory, sha256 of the provenance)
+    """
+    _, provenance_json, sha256 = get_provenance()
+    _write_provenance_file(directory, provenance_json, sha256)
+
+    return get_provenance_filename(sha256), sha256
+
+
 def get_plot_metadata():
+    """
+    The metadata of one plot (or data file). The provenance of the process is not copied into every
+    plot, instead the metadata refers to the shared provenance file (see write_provenance), which is
+    written next to the plot.
+    """
+    _, _, provenance_sha256 = get_provenance()
+
     return {'Copyright': 'Copyright, {}'.format(AUTHORS),
-            'working_directory': os.getcwd(),
-            'hostname': socket.gethostname(),
             'generated_on_date': str(datetime.datetime.now()),
-            **get_git_metadata(),
-            **get_environment.accessed_environments,
-            **get_additional_plot_parameters(),
-            "modules_loaded": get_loaded_python_modules_formatted(),
-            "python_version": get_python_description(),
+            'git_short_commit': get_git_metadata()['git_short_commit'],
+            'provenance': get_provenance_filename(provenance_sha256),
+            'provenance_sha256': provenance_sha256,
             'stacktrace': get_stacktrace_str(),
             'in_file': get_notebook_name()}
 
 
+def get_tikz_comments(title, gitMetadata):
+    """
+    The comments appended to every tikz file (the provenance is in a shared file, see write_provenance)
+    """
+    _, _, provenance_sha256 = get_provenance()
+
+    lines = ["",
+             "",
+             "%% INCLUDE THE COMMENTS AT THE END WHEN COPYING",
+             "%%%%%%%%%%%%%TITLE%%%%%%%%%%%%%%%%%"]
+    for line in title.splitlines():
+        lines.append("%% {}".format(line))
+    lines.append("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%")
+    lines.append("%% script name: {}".format(get_notebook_name()))
+    lines.append("%% ALWAYS INCLUDE THE COMMENTS WHEN COPYING THIS PLOT")
+    lines.append("%% DO NOT REMOVE THE COMMENTS BELOW!")
+    for k in gitMetadata.keys():
+        lines.append("%% GIT {} : {}".format(k, gitMetadata[k]))
+
+    lines.append("%% generated_on_date : {}".format(str(datetime.datetime.now())))
+    lines.append("%% provenance (environment, python version and modules) : {} (sha256: {})".format(
+        get_provenance_filename(provenance_sha256), provenance_sha256))
+
+    lines.append("%% stacktrace:")
+    for line in get_stacktrace_str().splitlines():
+        lines.append("%%     {}".format(line))
+
+    return "\n".join(lines) + "\n"
+
+
+def _import_plot_writers(save_tikz):
+    """
+    Imports the modules _write_plot needs, so that they are already part of the provenance
+    (otherwise the first plot would change the loaded modules, see get_provenance)
+    """
+    import PIL.Image
+    import PIL.PngImagePlugin
+
+    if save_tikz:
+        try:
+            import tikzplotlib
+        except:
+            pass
+
+
+def _write_plot(fig, savenamepng, savenametikz, metadata, tikz_comments, provenance_json, save_tikz):
+    """
+    Writes the tikz file and the png (with the metadata) of the figure, and the provenance file
+    next to them (if it is not already there)
+    """
+    # We don't want all the output from tikzplotlib
+    with RedirectStdStreamsToNull():
+        if save_tikz:
+            try:
+                import tikzplotlib
+
+                tikzplotlib.save(savenametikz,
+                                 figure=fig,
+                                 figureheight='\\figureheight',
+                                 figurewidth='\\figurewidth',
+                                 show_info=False)
+
+                with open(savenametikz, 'a') as f:
+                    f.write(tikz_comments)
+
+                _write_provenance_file(os.path.dirname(savenametikz), provenance_json,
+                                       metadata['provenance_sha256'])
+            except:
+                console_log(
+                    "Failed to save tikz file {} (probably just a 3d plot, they do not work in tikz)".format(savenametikz))
+
+    fig.savefig(savenamepng, bbox_inches='tight')
+
+    writeMetadata(savenamepng, metadata)
+    _write_provenance_file(os.path.dirname(savenamepng), provenance_json, metadata['provenance_sha256'])
+
+
+def _initialize_plot_worker():
+    # The workers never show anything
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+def _write_plot_snapshot(figure_snapshot, savenamepng, savenametikz, metadata, tikz_comments, provenance_json,
+                         save_tikz):
+    """
+    Runs in the worker processes, figure_snapshot is the pickled figure
+    """
+    import matplotlib.pyplot as plt
+
+    fig = pickle.loads(figure_snapshot)
+    try:
+        _write_plot(fig, savenamepng, savenametikz, metadata, tikz_comments, provenance_json, save_tikz)
+    finally:
+        plt.close(fig)
+
+
+def _submit_plot(fig, name, savenamepng, savenametikz, metadata, tikz_comments, provenance_json, callback_title):
+    """
+    Snapshots (pickles) the figure, and hands it to the plot workers. The script can change or close
+    the figure as soon as this returns.
+    """
+    import concurrent.futures
+
+    if _asynchronous_saving.executor is None:
+        _asynchronous_saving.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=_asynchronous_saving.max_workers, initializer=_initialize_plot_worker)
+
+    # Bound the number of snapshots kept in memory
+    while len(_asynchronous_saving.pending) >= _asynchronous_saving.max_pending:
+        concurrent.futures.wait([future for future, _, _, _ in _asynchronous_saving.pending],
+                                return_when=concurrent.futures.FIRST_COMPLETED)
+        _collect_finished_plots()
+
+    # The workers do not follow changes of the working directory
+    future = _asynchronous_saving.executor.submit(_write_plot_snapshot, pickle.dumps(fig),
+                                                  os.path.abspath(savenamepng), os.path.abspath(savenametikz),
+                                                  metadata, tikz_comments, provenance_json, savePlot.saveTikz)
+    _asynchronous_saving.pending.append((future, name, savenamepng, callback_title))
+
+
+def _collect_finished_plots():
+    """
+    Runs the callbacks of the finished plots, and records the ones that failed
+    """
+    still_pending = []
+    for future, name, savenamepng, callback_title in _asynchronous_saving.pending:
+        if not future.done():
+            still_pending.append((future, name, savenamepng, callback_title))
+            continue
+
+        exception = future.exception()
+        if exception is not None:
+            console_log("Failed to save plot {}: {}".format(name, exception))
+            _asynchronous_saving.failed.append((name, exception))
+        elif savePlot.callback is not None:
+            savePlot.callback(savenamepng, name, callback_title)
+
+    _asynchronous_saving.pending = still_pending
+
+
+def waitForPlots():
+    """
+    Waits until all the plots that are being saved asynchronously are written (see setAsynchronousSaving).
+    The callback (savePlot.callback) of every plot is called from here.
+
+    Raises an exception listing the plots that could not be saved (since the last call).
+    """
+    import concurrent.futures
+
+    concurrent.futures.wait([future for future, _, _, _ in _asynchronous_saving.pending])
+    _collect_finished_plots()
+
+    failed = _asynchronous_saving.failed
+    _asynchronous_saving.failed = []
+    if len(failed) > 0:
+        raise Exception("Failed to save {} plot(s):\n{}".format(
+            len(failed), "\n".join("{}: {}".format(name, exception) for name, exception in failed)))
+
+
+def _shutdown_plot_workers():
+    if _asynchronous_saving.executor is not None:
+        _asynchronous_saving.executor.shutdown()
+        _asynchronous_saving.executor = None
+
+
+def _wait_for_plots_at_exit():
+    try:
+        waitForPlots()
+    except Exception as e:
+        sys.stderr.write("ERROR (plot_info): {}\n".format(e))
+    finally:
+        _shutdown_plot_workers()
+
+
+def setAsynchronousSaving(enabled=True, max_workers=None, max_pending=None):
+    """
+    With asynchronous saving, savePlot (and showAndSave) only snapshot the figure, and the tikz file,
+    the png and the metadata are written by a pool of worker processes, so the script can go on
+    plotting. Call waitForPlots to wait for them (and to get the errors), it is also called at exit.
+
+    :param enabled: turns asynchronous saving on or off (turning it off waits for the pending plots, and
+                    stops the workers)
+    :param max_workers: number of worker processes (default: number of cores)
+    :param max_pending: maximum number of figures waiting to be written, savePlot blocks when there are
+                        more (default: twice the number of workers)
+    """
+    if not enabled:
+        savePlot.asynchronous = False
+        try:
+            waitForPlots()
+        finally:
+            _shutdown_plot_workers()
+        return
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if _asynchronous_saving.executor is not None and max_workers != _asynchronous_saving.max_workers:
+        waitForPlots()
+        _shutdown_plot_workers()
+
+    _asynchronous_saving.max_workers = max_workers
+    _asynchronous_saving.max_pending = max_pending or 2 * max_workers
+
+    if not _asynchronous_saving.exit_handler_registered:
+        atexit.register(_wait_for_plots_at_exit)
+        _asynchronous_saving.exit_handler_registered = True
+
+    savePlot.asynchronous = True
+
+
+class _AsynchronousSavingState(object):
+    def __init__(self):
+        self.executor = None
+        self.max_workers = 1
+        self.max_pending = 2
+        # (future, name, png filename, callback title) for every plot not yet collected
+        self.pending = []
+        # (name, exception) for every plot that could not be saved
+        self.failed = []
+        self.exit_handler_registered = False
+
+
+_asynchronous_saving = _AsynchronousSavingState()
+
+
 def savePlot(name):
     if not os.path.exists('img'):
         os.mkdir('img')
@@ -212,6 +518,8 @@ def savePlot(name):
     if savePlot.disabled:
         return
 
+    import matplotlib.pyplot as plt
+
     name = showAndSave.prefix + name
     name = ''.join(ch for ch in name if ch.isalnum() or ch == '_')
     name = name.lower()
@@ -254,74 +562,31 @@ def savePlot(name):
         except:
             # 3d plots had some issues with the text attribute
             pass
-    # We don't want all the output from tikzplotlib
+    savenamepng = 'img/' + name + '.png'
+    savenametikz = 'img_tikz/' + name + '.xyz'
 
-    with RedirectStdStreamsToNull():
-        if savePlot.saveTikz:
-            try:
-                tikzplotlib.save('img_tikz/' + name + '.xyz',
-                                 figureheight='\\figureheight',
-                                 figurewidth='\\figurewidth',
-                                 show_info=False)
+    callback_title = 'Unknown title'
+    try:
+        callback_title = plt.gcf()._suptitle.get_text()
+    except:
+        pass
 
-                with open('img_tikz/' + name + '.xyz', 'a') as f:
-                    f.write("\n\n")
-                    f.write("%% INCLUDE THE COMMENTS AT THE END WHEN COPYING\n")
-                    f.write("%%%%%%%%%%%%%TITLE%%%%%%%%%%%%%%%%%\n")
-                    for line in title.splitlines():
-                        f.write("%% {}\n".format(line))
-                    f.write("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%\n")
-                    f.write("%% script name: {}".format(get_notebook_name()))
-                    f.write("\n")
-                    f.write("%% ALWAYS INCLUDE THE COMMENTS WHEN COPYING THIS PLOT\n")
-                    f.write("%% DO NOT REMOVE THE COMMENTS BELOW!\n")
-                    for k in gitMetadata.keys():
-                        f.write("%% GIT {} : {}\n".format(k, gitMetadata[k]))
-
-                    f.write("%% working_directory : {}\n".format(os.getcwd()))
-                    f.write("%% hostname : {}\n".format(socket.gethostname()))
-                    f.write("%% generated_on_date : {}\n".format(str(datetime.datetime.now())))
-                    f.write("%% accessed_environment:\n")
-                    for k in get_environment.accessed_environments.keys():
-                        environment_value = get_environment.accessed_environments[k]
-                        environment_value = environment_value.replace("\n", "")
-                        environment_value = environment_value.replace("\r", "")
-                        f.write("%%    {}={}\n".format(k, environment_value))
-                    f.write("%% additional_parameters:\n")
-
-                    for k in get_additional_plot_parameters():
-                        environment_value = get_additional_plot_parameters()[k]
-                        environment_value = environment_value.replace("\n", "")
-                        environment_value = environment_value.replace("\r", "")
-                        f.write("%%    {}={}\n".format(k, environment_value))
-
-                    f.write("%% python_version: \n")
-                    for l in get_python_description().splitlines():
-                        f.write("%%    {}\n".format(l))
-
-                    f.write("%% python modules:\n")
-                    for module in get_loaded_python_modules():
-                        f.write("%%     {name}: {version} ({file})\n".format(**module))
-
-                    f.write("%% stacktrace:\n")
-                    for line in get_stacktrace_str().splitlines():
-                        f.write("%%     {}\n".format(line))
-            except:
-                console_log(
-                    "Failed to save tikz file {}.xyz (probably just a 3d plot, they do not work in tikz)".format(name))
+    if not savePlot.asynchronous:
+        _import_plot_writers(savePlot.saveTikz)
 
-    savenamepng = 'img/' + name + '.png'
-    plt.savefig(savenamepng, bbox_inches='tight')
+    # Everything that depends on the state of this process is collected here, so the
+    # writing can happen in another process (see setAsynchronousSaving)
+    metadata = get_plot_metadata()
+    tikz_comments = get_tikz_comments(title, gitMetadata)
+    _, provenance_json, _ = get_provenance()
 
-    writeMetadata(savenamepng, get_plot_metadata())
+    if savePlot.asynchronous:
+        _submit_plot(fig, name, savenamepng, savenametikz, metadata, tikz_comments, provenance_json, callback_title)
+    else:
+        _write_plot(fig, savenamepng, savenametikz, metadata, tikz_comments, provenance_json, savePlot.saveTikz)
 
-    if savePlot.callback is not None:
-        title = 'Unknown title'
-        try:
-            title = plt.gcf()._suptitle.get_text()
-        except:
-            pass
-        savePlot.callback(savenamepng, name, title)
+        if savePlot.callback is not None:
+            savePlot.callback(savenamepng, name, callback_title)
 
     if not name.endswith("_notitle"):
         old_title = get_current_title()
@@ -335,9 +600,12 @@ def savePlot(name):
 
 savePlot.callback = None
 savePlot.saveTikz = True
+savePlot.asynchronous = False
 
 
 def showAndSave(name):
+    import matplotlib.pyplot as plt
+
     savePlot(name)
     if not showAndSave.silent:
         plt.show()
@@ -358,16 +626,17 @@ def saveData(basefilename, data):
     basefilename = basefilename.lower()
     outname = os.path.join('results', basefilename + ".txt")
 
+    write_provenance('results')
     np.savetxt(outname, data, footer=str(get_plot_metadata()))
 
 
 def legendLeft():
+    import matplotlib.pyplot as plt
+
     ax = plt.gca()
     ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
 
 
-import inspect
-
 
 def console_log_show(x):
     try:
@@ -406,6 +675,8 @@ def console_log(x):
 
 
 def to_percent(y, position):
+    import matplotlib
+
     # see https://stackoverflow.com/questions/31357611/format-y-axis-as-percent
     s = "{:.1f}".format(y * 100)
 
@@ -417,6 +688,8 @@ def to_percent(y, position):
 
 def set_percentage_ticks(ax):
     """ ax is either plt.gca().xaxis or plt.gca().yaxis"""
+    import matplotlib.ticker
+
     ax.set_major_formatter(matplotlib.ticker.FuncFormatter(to_percent))
 
 
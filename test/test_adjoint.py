@@ -0,0 +1,74 @@
+import os
+import sys
+import unittest
+import heat
+import numpy as np
+
+# simulate_heat.py is a script in heat_chain (it imports its neighbours directly)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'heat_chain'))
+import simulate_heat
+
+
+class TestAdjoint(unittest.TestCase):
+    def check_against_simulate_heat(self, settings, places):
+        """
+        The adjoint should give the gradient of the values simulate_heat.py computes (the values the
+        chain trains on), so we check it against finite differences of simulate_heat.simulate
+        """
+        coefficients = np.array([0.1, 0.4, 0.8, 0.25, 0.75])
+        q = 0.75
+        target = np.array([0.2, 0.5, 0.1, -0.3, 0.4])
+
+        def objective(q, coefficients):
+            values = simulate_heat.simulate(np.concatenate([[q], coefficients])[np.newaxis, :], settings, 1)[0]
+            return 0.5 * np.sum((values - target) ** 2)
+
+        values, gradient_q, gradient_coefficients = heat.solve_heat_equation_adjoint(
+            coefficients, settings['dt'], settings['dx'], settings['end_time'], settings['control_points'],
+            lambda u: u - target, q=q, time_integrator=settings['time_integrator'],
+            richardson_levels=settings['richardson_levels'])
+
+        self.assertEqual(coefficients.shape, gradient_coefficients.shape)
+        self.assertTrue(np.allclose(simulate_heat.simulate(np.concatenate([[q], coefficients])[np.newaxis, :],
+                                                           settings, 1)[0], values, rtol=1e-13, atol=1e-15))
+
+        epsilon = 1e-6
+        finite_difference_q = (objective(q + epsilon, coefficients) - objective(q - epsilon, coefficients)) / (
+                2 * epsilon)
+        self.assertAlmostEqual(finite_difference_q, gradient_q, places=places)
+
+        for k in range(coefficients.shape[0]):
+            perturbation = epsilon * np.eye(coefficients.shape[0])[k]
+            finite_difference = (objective(q, coefficients + perturbation) - objective(q, coefficients - perturbation)) / (
+                    2 * epsilon)
+            self.assertAlmostEqual(finite_difference, gradient_coefficients[k], places=places)
+
+    def settings(self, **kwargs):
+        # The same as simulate_heat.load_simulation_settings, with a longer end time so q matters more
+        settings = {'control_points': [0.125, 0.25, 0.5, 0.75, 0.825],
+                    'end_time': 0.05,
+                    'dx': 1.0 / 2048,
+                    'dt': 1.0 / 2048,
+                    'richardson_levels': None,
+                    'time_integrator': 'crank_nicolson',
+                    'dtype': 'float64'}
+        settings.update(kwargs)
+        return settings
+
+    def test_against_finite_differences(self):
+        self.check_against_simulate_heat(self.settings(), places=7)
+
+    def test_time_integrators(self):
+        for time_integrator in heat.TIME_INTEGRATORS:
+            # Not a multiple of dt, so there is a shorter last step
+            self.check_against_simulate_heat(self.settings(time_integrator=time_integrator, end_time=0.0501),
+                                             places=7)
+
+    def test_richardson(self):
+        for levels in [2, 3]:
+            self.check_against_simulate_heat(self.settings(richardson_levels=levels, dx=1.0 / 256, dt=1.0 / 256),
+                                             places=7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+# ensemble_statistics.py is a script in heat_chain (it imports its neighbours directly)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'heat_chain'))
+import ensemble_statistics
+import objective
+
+
+class TestEnsembleStatistics(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.results_directory = os.path.join(self.directory, 'results')
+        os.makedirs(self.results_directory)
+        self.checkpoint_file = os.path.join(self.directory, 'ensemble_statistics.npz')
+        self.objective = objective.Objective()
+
+        np.random.seed(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_result_files(self, first, last):
+        for k in range(first, last):
+            filename = f'min_shapes_per_iteration_optimize_random_{k}_4.txt'
+            np.savetxt(os.path.join(self.results_directory, filename), np.random.rand(3, 6))
+
+    def add_new_members(self, statistics, checkpoint_every, checkpoint_file=None):
+        return ensemble_statistics.add_new_members(statistics, self.objective, [self.results_directory],
+                                                   checkpoint_file or self.checkpoint_file,
+                                                   checkpoint_every=checkpoint_every)
+
+    def assert_same_statistics(self, expected, actual):
+        self.assertEqual(expected.number_of_members, actual.number_of_members)
+        self.assertEqual(expected.member_digests, actual.member_digests)
+        for group_name, group in expected.groups.items():
+            for name, statistics in group.items():
+                for array_name, array in statistics.state().items():
+                    self.assertTrue(np.allclose(array, actual.groups[group_name][name].state()[array_name]),
+                                    f'{group_name}/{name}/{array_name}')
+
+    def test_resume(self):
+        self.write_result_files(0, 5)
+        statistics = ensemble_statistics.EnsembleStatistics()
+        self.assertEqual(5, self.add_new_members(statistics, checkpoint_every=2))
+
+        resumed = ensemble_statistics.EnsembleStatistics.load(self.checkpoint_file)
+        self.assert_same_statistics(statistics, resumed)
+
+        with open(ensemble_statistics.members_log_filename(self.checkpoint_file)) as members_log:
+            self.assertEqual(5, len(members_log.readlines()))
+
+        # Only the new files are added, which gives the same as adding all of them at once
+        self.write_result_files(5, 8)
+        self.assertEqual(3, self.add_new_members(resumed, checkpoint_every=2))
+
+        all_at_once = ensemble_statistics.EnsembleStatistics()
+        self.assertEqual(8, self.add_new_members(all_at_once, checkpoint_every=100,
+                                                 checkpoint_file=os.path.join(self.directory, 'all_at_once.npz')))
+        self.assert_same_statistics(all_at_once, resumed)
+        self.assert_same_statistics(all_at_once, ensemble_statistics.EnsembleStatistics.load(self.checkpoint_file))
+
+    def test_interrupted_after_logging(self):
+        self.write_result_files(0, 3)
+        statistics = ensemble_statistics.EnsembleStatistics()
+        self.add_new_members(statistics, checkpoint_every=10)
+
+        # A run that was interrupted after appending to the log, but before writing the checkpoint
+        with open(ensemble_statistics.members_log_filename(self.checkpoint_file), 'a') as members_log:
+            members_log.write(os.path.join(os.path.abspath(self.results_directory),
+                                           'min_shapes_per_iteration_optimize_random_3_4.txt\n'))
+        self.write_result_files(3, 4)
+
+        resumed = ensemble_statistics.EnsembleStatistics.load(self.checkpoint_file)
+        self.assertEqual(3, resumed.number_of_members)
+        self.assertEqual(1, self.add_new_members(resumed, checkpoint_every=10))
+        self.assertEqual(4, ensemble_statistics.EnsembleStatistics.load(self.checkpoint_file).number_of_members)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,12 @@
 import unittest
 import heat
 import numpy as np
+from heat.solve_heat_equation import implicit_operator, crank_nicolson_operator
 
 
 class TestHeatEquation(unittest.TestCase):
+    method = 'time_stepping'
+
     def test_zero(self):
         initial_data = lambda x: 0
         dt = 1 / 1024.
@@ -11,7 +14,7 @@ class TestHeatEquation(unittest.TestCase):
 
         end_time = 1.25
 
-        solution_to_heat_equation = heat.solve_heat_equation(initial_data, dt, dx, end_time)
+        solution_to_heat_equation = heat.solve_heat_equation(initial_data, dt, dx, end_time, method=self.method)
 
         self.assertEqual(int(1 / dt), solution_to_heat_equation.shape[0])
         self.assertTrue(np.all(solution_to_heat_equation == np.zeros_like(solution_to_heat_equation)))
@@ -28,7 +31,7 @@ class TestHeatEquation(unittest.TestCase):
         for dx in resolutions:
             dt = dx
 
-            solution_to_heat_equation = heat.solve_heat_equation(initial_data, dt, dx, end_time)
+            solution_to_heat_equation = heat.solve_heat_equation(initial_data, dt, dx, end_time, method=self.method)
 
             self.assertEqual(int(1 / dx), solution_to_heat_equation.shape[0])
 
@@ -57,7 +60,7 @@ class TestHeatEquation(unittest.TestCase):
 
             initial_data = heat.InitialDataControlSine(coefficients)
 
-            solution_to_heat_equation = heat.solve_heat_equation(initial_data, dt, dx, end_time)
+            solution_to_heat_equation = heat.solve_heat_equation(initial_data, dt, dx, end_time, method=self.method)
 
             self.assertEqual(int(1 / dx), solution_to_heat_equation.shape[0])
 
@@ -86,7 +89,7 @@ class TestHeatEquation(unittest.TestCase):
         for dx in resolutions:
             dt = dx
 
-            solution_to_heat_equation = heat.solve_heat_equation(initial_data, dt, dx, end_time, q=q)
+            solution_to_heat_equation = heat.solve_heat_equation(initial_data, dt, dx, end_time, q=q, method=self.method)
 
             self.assertEqual(int(1 / dx), solution_to_heat_equation.shape[0])
 
@@ -117,7 +120,7 @@ class TestHeatEquation(unittest.TestCase):
 
             initial_data = heat.InitialDataControlSine(coefficients)
 
-            solution_to_heat_equation = heat.solve_heat_equation(initial_data, dt, dx, end_time, q=q)
+            solution_to_heat_equation = heat.solve_heat_equation(initial_data, dt, dx, end_time, q=q, method=self.method)
 
             self.assertEqual(int(1 / dx), solution_to_heat_equation.shape[0])
 
@@ -133,6 +136,374 @@ class TestHeatEquation(unittest.TestCase):
 
         self.assertGreaterEqual(convergence_rate, 1.9)
 
+    def test_evaluation_points(self):
+        dx = 1 / 256.
+        dt = dx
+        end_time = 0.125
+        x = np.arange(0, 1, dx)
+        initial_data = heat.InitialDataControlSine([0.4, 0.2, 0.7])
+
+        solution = heat.solve_heat_equation(initial_data, dt, dx, end_time, method=self.method)
+
+        indices = [3, 17, 128]
+        self.assertTrue(np.all(solution[indices] == heat.solve_heat_equation(initial_data, dt, dx, end_time,
+                                                                               method=self.method,
+                                                                               evaluation_indices=indices)))
+
+        # not a sine series, so should be interpolated from the grid
+        points = [0.125, 0.3, 0.825]
+        self.assertTrue(np.allclose(np.interp(points, x, solution),
+                                    heat.solve_heat_equation(lambda y: initial_data(y), dt, dx, end_time,
+                                                             method=self.method, evaluation_points=points)))
+
+        # the same for sine series initial data (unless method='sine_series' is asked for)
+        self.assertTrue(np.array_equal(heat.solve_heat_equation(lambda y: initial_data(y), dt, dx, end_time,
+                                                                method=self.method, evaluation_points=points),
+                                       heat.solve_heat_equation(initial_data, dt, dx, end_time,
+                                                                method=self.method, evaluation_points=points)))
+
+    def test_sine_series_method(self):
+        initial_data = heat.InitialDataControlSine([0.4, 0.2, 0.7])
+        points = np.array([0.125, 0.3, 0.825])
+        end_time = 0.125
+        exact_solution = initial_data.exact_solution(points, end_time)
+
+        self.assertTrue(np.array_equal(heat.solve_heat_equation_sine_series(initial_data.coefficients, 1 / 256.,
+                                                                            1 / 256., end_time, points),
+                                       heat.solve_heat_equation(initial_data, 1 / 256., 1 / 256., end_time,
+                                                                method='sine_series', evaluation_points=points)))
+
+        # The sine series puts the boundary values at exactly 0 and 1, and evaluates the modes in the
+        # points, while the grid (numpy.arange(0, 1, dx), boundary values at -dx and 1) is interpolated.
+        # So the two paths differ by far more than the error of the sine series:
+        #
+        #     dx        sine_series   grid
+        #     1/256     5.2e-5        1.6e-3
+        #     1/2048    8.1e-7        2.1e-4
+        for dx, sine_series_tolerance, grid_tolerance in [(1 / 256., 1e-4, 3e-3), (1 / 2048., 2e-6, 5e-4)]:
+            sine_series = heat.solve_heat_equation(initial_data, dx, dx, end_time, method='sine_series',
+                                                   evaluation_points=points)
+            grid = heat.solve_heat_equation(initial_data, dx, dx, end_time, evaluation_points=points)
+
+            sine_series_error = np.max(np.abs(sine_series - exact_solution))
+            grid_error = np.max(np.abs(grid - exact_solution))
+            self.assertLess(sine_series_error, sine_series_tolerance)
+            self.assertLess(grid_error, grid_tolerance)
+            self.assertGreater(grid_error, 30 * sine_series_error)
+
+        with self.assertRaises(Exception):
+            heat.solve_heat_equation(lambda x: initial_data(x), 1 / 256., 1 / 256., end_time, method='sine_series',
+                                     evaluation_points=points)
+        with self.assertRaises(Exception):
+            heat.solve_heat_equation(initial_data, 1 / 256., 1 / 256., end_time, method='sine_series')
+
+    def test_sine_series_convergence(self):
+        resolutions = 2.0 ** np.arange(-5, -12, -1)
+        errors = []
+
+        end_time = 0.25
+        points = np.array([0.125, 0.25, 0.5, 0.75, 0.825])
+        coefficients = [0.4, 0.2, 0.7]
+        q = 1.3
+        initial_data = heat.InitialDataControlSine(coefficients)
+        exact_solution = initial_data.exact_solution(points, end_time, q)
+
+        for dx in resolutions:
+            dt = dx
+
+            solution = heat.solve_heat_equation_sine_series(coefficients, dt, dx, end_time, points, q=q)
+
+            errors.append(np.max(np.abs(solution - exact_solution)))
+
+        convergence_rate = np.polyfit(np.log(resolutions), np.log(errors), 1)[0]
+
+        self.assertGreaterEqual(convergence_rate, 1.9)
+
+    def test_sine_series_batch(self):
+        coefficients = np.random.rand(6, 9)
+        q = np.random.rand(6)
+        points = [0.125, 0.25, 0.5, 0.75, 0.825]
+        dx = 1 / 2048.
+
+        solutions = heat.solve_heat_equation_sine_series(coefficients, dx, dx, 0.001, points, q=q)
+        self.assertEqual((6, 5), solutions.shape)
+
+        for sample in range(6):
+            self.assertTrue(np.allclose(heat.solve_heat_equation_sine_series(coefficients[sample], dx, dx, 0.001,
+                                                                             points, q=q[sample]),
+                                        solutions[sample]))
+
+    def test_batch(self):
+        dx = 1 / 256.
+        dt = dx
+        end_time = 0.1
+        x = np.arange(0, 1, dx)
+
+        coefficients = np.random.rand(7, 4)
+        q = np.random.rand(7)
+
+        initial_states = np.array([heat.InitialDataControlSine(c)(x) for c in coefficients])
+
+        expected = np.array([heat.solve_heat_equation(heat.InitialDataControlSine(c), dt, dx, end_time, q=q_sample)
+                             for c, q_sample in zip(coefficients, q)])
+
+        solutions = heat.solve_heat_equation_batch(initial_states, dt, dx, end_time, q=q)
+        self.assertEqual((7, x.shape[0]), solutions.shape)
+        self.assertTrue(np.allclose(expected, solutions))
+
+        output_indices = [10, 64, 200]
+        solutions_at_points = heat.solve_heat_equation_batch(initial_states, dt, dx, end_time, q=q,
+                                                             output_indices=output_indices)
+        self.assertTrue(np.allclose(expected[:, output_indices], solutions_at_points))
+
+        # a single q shared by all samples
+        solutions_single_q = heat.solve_heat_equation_batch(initial_states, dt, dx, end_time, q=q[0])
+        self.assertTrue(np.allclose(heat.solve_heat_equation(heat.InitialDataControlSine(coefficients[3]),
+                                                             dt, dx, end_time, q=q[0]),
+                                    solutions_single_q[3]))
+
+    def test_operator_cache(self):
+        heat.clear_operator_cache()
+
+        initial_data = heat.InitialDataControlSine([0.4, 0.2, 0.7])
+        dx = 1 / 256.
+        dt = dx
+
+        first_solution = heat.solve_heat_equation(initial_data, dt, dx, 0.125, q=0.5)
+        self.assertEqual(0, heat.operator_cache_info().hits)
+        self.assertEqual(1, heat.operator_cache_info().misses)
+
+        second_solution = heat.solve_heat_equation(initial_data, dt, dx, 0.125, q=0.5)
+        self.assertEqual(1, heat.operator_cache_info().hits)
+        self.assertTrue(np.all(first_solution == second_solution))
+
+        heat.solve_heat_equation(initial_data, dt, dx, 0.125, q=0.6)
+        self.assertEqual(2, heat.operator_cache_info().misses)
+
+        heat.clear_operator_cache()
+        self.assertEqual(0, heat.operator_cache_info().currsize)
+
+    def test_operator_cache_argument_forms(self):
+        heat.clear_operator_cache()
+
+        # Every way the solvers ask for the same operator gives one cache entry
+        first = implicit_operator(255, 0.25)
+        for operator in [implicit_operator(255, 0.25, dtype='float64'),
+                         implicit_operator(np.int64(255), np.float64(0.25), 'dirichlet', np.float64),
+                         crank_nicolson_operator(255, 1.0, 0.5, 'dirichlet')]:
+            self.assertIs(first, operator)
+
+        self.assertEqual(1, heat.operator_cache_info().misses)
+        self.assertEqual(3, heat.operator_cache_info().hits)
+        self.assertEqual(1, heat.operator_cache_info().currsize)
+
+class TestHeatEquationDST(TestHeatEquation):
+    method = 'dst'
+
+    def test_same_as_time_stepping(self):
+        initial_data = heat.InitialDataControlSine([0.1, 0.4, 0.8, 0.25, 0.75, 0.45, 0.9, 0.25, 0.85])
+
+        for dx, end_time, q in [(1 / 256., 0.3, 1.0), (1 / 2048., 0.001, 0.75), (1 / 100., 0.25, 0.2)]:
+            dt = dx
+            time_stepping = heat.solve_heat_equation(initial_data, dt, dx, end_time, q=q, method='time_stepping')
+            dst = heat.solve_heat_equation(initial_data, dt, dx, end_time, q=q, method='dst')
+
+            self.assertTrue(np.allclose(time_stepping, dst, rtol=1e-10, atol=1e-12))
+
+    def test_batch_same_as_time_stepping(self):
+        dx = 1 / 128.
+        dt = dx
+        x = np.arange(0, 1, dx)
+        initial_states = np.array([heat.InitialDataControlSine(c)(x) for c in np.random.rand(5, 6)])
+        q = np.random.rand(5)
+
+        time_stepping = heat.solve_heat_equation_batch(initial_states, dt, dx, 0.2, q=q, method='time_stepping')
+        dst = heat.solve_heat_equation_batch(initial_states, dt, dx, 0.2, q=q, method='dst')
+
+        self.assertTrue(np.allclose(time_stepping, dst, rtol=1e-10, atol=1e-12))
+
+    def test_time_integrators_same_as_time_stepping(self):
+        dx = 1 / 128.
+        # end_time is not a multiple of dt, so there is a shorter last step
+        dt = 1 / 100.
+        end_time = 0.105
+        x = np.arange(0, 1, dx)
+        initial_states = np.array([heat.InitialDataControlSine(c)(x) for c in np.random.rand(5, 6)])
+        q = np.random.rand(5)
+
+        for time_integrator in ['bdf2', 'sdirk']:
+            time_stepping = heat.solve_heat_equation_batch(initial_states, dt, dx, end_time, q=q,
+                                                           method='time_stepping', time_integrator=time_integrator)
+            dst = heat.solve_heat_equation_batch(initial_states, dt, dx, end_time, q=q, method='dst',
+                                                 time_integrator=time_integrator)
+            self.assertTrue(np.allclose(time_stepping, dst, rtol=1e-10, atol=1e-12), time_integrator)
+
+            single_sample = heat.solve_heat_equation(lambda y: initial_states[2], dt, dx, end_time, q=q[2],
+                                                     method='time_stepping', time_integrator=time_integrator)
+            self.assertTrue(np.allclose(single_sample, dst[2], rtol=1e-10, atol=1e-12), time_integrator)
+
+
+class TestAdaptiveTimeStepping(unittest.TestCase):
+    def test_partial_last_step(self):
+        # end_time is not a multiple of dt, so the last step has to be shorter
+        self.assertEqual([(0.1, 2), (0.05, 1)], [(round(step_size, 12), number_of_steps)
+                                                 for step_size, number_of_steps in heat.time_steps(0.1, 0.25)])
+        self.assertEqual([(0.125, 2)], heat.time_steps(0.125, 0.25))
+
+        coefficients = [0.4, 0.2, 0.7]
+        points = np.array([0.125, 0.5, 0.825])
+        dx = 1 / 2048.
+        end_time = 0.001
+
+        solution = heat.solve_heat_equation_sine_series(coefficients, dx, dx, end_time, points, q=1.3)
+        exact_solution = heat.InitialDataControlSine(coefficients).exact_solution(points, end_time, 1.3)
+
+        self.assertTrue(np.allclose(exact_solution, solution, atol=1e-5))
+
+    def test_adaptive(self):
+        initial_data = heat.InitialDataControlSine([0.4, 0.2, 0.7])
+        dx = 1 / 256.
+        end_time = 0.1
+
+        reference_solution = heat.solve_heat_equation(initial_data, dx / 64, dx, end_time, q=0.8)
+
+        errors = []
+        for tolerance in [1e-4, 1e-6, 1e-8]:
+            solution = heat.solve_heat_equation(initial_data, 1 / 64., dx, end_time, q=0.8,
+                                                adaptive=True, tolerance=tolerance)
+            errors.append(np.max(np.abs(solution - reference_solution)))
+
+        self.assertLess(errors[0], 1e-3)
+        self.assertLess(errors[1], errors[0])
+        self.assertLess(errors[2], errors[1])
+
+        with self.assertRaises(Exception):
+            heat.solve_heat_equation(initial_data, 1 / 64., dx, end_time, method='dst', adaptive=True)
+
+
+class TestRichardson(unittest.TestCase):
+    def test_richardson(self):
+        coefficients = np.random.rand(4, 5)
+        q = np.random.rand(4) + 0.5
+        points = np.array([0.125, 0.25, 0.5, 0.75, 0.825])
+        end_time = 0.3
+        exact_solution = np.array([heat.InitialDataControlSine(c).exact_solution(points, end_time, q_sample)
+                                   for c, q_sample in zip(coefficients, q)])
+
+        fine_solution = heat.solve_heat_equation_sine_series(coefficients, 1 / 2048., 1 / 2048., end_time, points, q=q)
+        fine_error = np.max(np.abs(fine_solution - exact_solution))
+
+        for levels in [2, 3]:
+            dx = 1 / 128.
+            # end_time is not a multiple of dx, so the time steps are adjusted
+            values, error_estimate = heat.solve_heat_equation_richardson(coefficients, dx, dx, end_time, points, q=q,
+                                                                         levels=levels)
+            self.assertEqual(exact_solution.shape, values.shape)
+            self.assertEqual(exact_solution.shape, error_estimate.shape)
+
+            error = np.max(np.abs(values - exact_solution))
+            self.assertLess(error, fine_error)
+            self.assertLessEqual(error, np.max(error_estimate))
+
+        values, error_estimate = heat.solve_heat_equation(heat.InitialDataControlSine(coefficients[0]), dx, dx,
+                                                          end_time, q=q[0], method='sine_series',
+                                                          evaluation_points=points, richardson_levels=2)
+        self.assertEqual((5,), values.shape)
+        self.assertTrue(np.allclose(exact_solution[0], values, atol=1e-8))
+
+        with self.assertRaises(Exception):
+            heat.solve_heat_equation(lambda x: np.sin(np.pi * x), dx, dx, end_time, method='sine_series',
+                                     evaluation_points=points, richardson_levels=2)
+        with self.assertRaises(Exception):
+            heat.solve_heat_equation(heat.InitialDataControlSine(coefficients[0]), dx, dx, end_time,
+                                     evaluation_points=points, richardson_levels=2)
+
+
+class TestTimeIntegrators(unittest.TestCase):
+    def test_time_integrator_convergence(self):
+        coefficients = [0.4, 0.2, 0.7, 0.3]
+        points = np.array([0.125, 0.25, 0.5, 0.75, 0.825])
+        end_time = 0.1
+        q = 0.8
+        dx = 1 / 1024.
+
+        # exact in time, so only the (small) spatial error is left
+        reference_solution = heat.solve_heat_equation_sine_series(coefficients, end_time, dx, end_time, points, q=q,
+                                                                  time_integrator='exponential')
+        exact_solution = heat.InitialDataControlSine(coefficients).exact_solution(points, end_time, q)
+        self.assertTrue(np.allclose(exact_solution, reference_solution, atol=1e-6))
+
+        time_step_sizes = end_time / 2.0 ** np.arange(3, 9)
+        for time_integrator in ['crank_nicolson', 'bdf2', 'sdirk']:
+            errors = []
+            for dt in time_step_sizes:
+                solution = heat.solve_heat_equation_sine_series(coefficients, dt, dx, end_time, points, q=q,
+                                                                time_integrator=time_integrator)
+                errors.append(np.max(np.abs(solution - reference_solution)))
+
+            convergence_rate = np.polyfit(np.log(time_step_sizes), np.log(errors), 1)[0]
+            self.assertGreaterEqual(convergence_rate, 1.9, time_integrator)
+
+    def test_time_integrator_stiff_damping(self):
+        # Discontinuous initial data and dt much larger than dx, Crank-Nicolson keeps the high frequencies
+        # (oscillating), while the L-stable integrators damp them
+        initial_data = lambda x: 1.0 * (np.abs(x - 0.5) < 0.25)
+        dx = 1 / 256.
+
+        for method in ['time_stepping', 'dst']:
+            for time_integrator in heat.TIME_INTEGRATORS:
+                solution = heat.solve_heat_equation(initial_data, 0.01, dx, 0.05, method=method,
+                                                    time_integrator=time_integrator)
+                oscillation = np.max(np.abs(np.diff(solution, 2)))
+
+                if time_integrator == 'crank_nicolson':
+                    self.assertGreater(oscillation, 0.5, method)
+                else:
+                    self.assertLess(oscillation, 1e-3, (method, time_integrator))
+
+        with self.assertRaises(Exception):
+            heat.solve_heat_equation(initial_data, 0.01, dx, 0.05, time_integrator='rk4')
+
+
+class TestIterateHeatEquation(unittest.TestCase):
+    def test_iterate(self):
+        initial_data = heat.InitialDataControlSine([0.4, 0.2, 0.7])
+        dx = 1 / 128.
+        dt = 1 / 100.
+        end_time = 0.105
+
+        for time_integrator in heat.TIME_INTEGRATORS:
+            times = []
+            for t, u in heat.iterate_heat_equation(initial_data, dt, dx, end_time, output_every=3,
+                                                   time_integrator=time_integrator):
+                times.append(t)
+
+            self.assertTrue(np.allclose([0.03, 0.06, 0.09, end_time], times))
+            # the last snapshot is the solution at end_time
+            self.assertTrue(np.allclose(heat.solve_heat_equation(initial_data, dt, dx, end_time,
+                                                                 time_integrator=time_integrator),
+                                        u, rtol=1e-12, atol=1e-14), time_integrator)
+
+        output_times = [0, 0.05, 0.1]
+        snapshots = heat.iterate_heat_equation(initial_data, dt, dx, 0.1, output_times=output_times)
+        previous_u = None
+        for expected_time, (t, u) in zip(output_times, snapshots):
+            self.assertEqual(expected_time, t)
+            self.assertFalse(u.flags.writeable)
+            if previous_u is not None:
+                # the same buffer is reused
+                self.assertTrue(np.shares_memory(previous_u, u))
+            previous_u = u
+
+            self.assertTrue(np.allclose(heat.solve_heat_equation(initial_data, dt, dx, t), u,
+                                        rtol=1e-12, atol=1e-14))
+
+        # every time step
+        self.assertEqual(10, len(list(heat.iterate_heat_equation(initial_data, dt, dx, 0.1))))
+
+        with self.assertRaises(Exception):
+            list(heat.iterate_heat_equation(initial_data, dt, dx, 0.1, output_times=[0.2]))
+
 
 if __name__ == '__main__':
     unittest.main()
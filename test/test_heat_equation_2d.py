@@ -0,0 +1,133 @@
+import unittest
+import heat
+import numpy as np
+
+
+class TestHeatEquation2D(unittest.TestCase):
+    def test_zero(self):
+        dx = 1 / 64.
+
+        solution = heat.solve_heat_equation_2d(lambda x, y: 0 * x, dx, dx, 0.25)
+
+        self.assertEqual((64, 64), solution.shape)
+        self.assertTrue(np.all(solution == 0))
+
+    def test_convergence(self):
+        # we do a quick convergence test to make sure it is indeed second order
+        np.random.seed(0)
+        initial_data = heat.InitialDataControlSine2D(np.random.rand(3, 3))
+
+        resolutions = 2.0 ** np.arange(-4, -9, -1)
+        errors = []
+
+        end_time = 0.1
+        q = 0.75
+
+        for dx in resolutions:
+            # a = dx puts the (zero) boundary values at exactly x = 0 and x = 1
+            solution = heat.solve_heat_equation_2d(initial_data, dx, dx, end_time, a=dx, q=q)
+
+            x = np.arange(dx, 1, dx)
+            exact_solution = initial_data.exact_solution(*np.meshgrid(x, x, indexing='ij'), end_time, q)
+
+            errors.append(np.max(np.abs(exact_solution - solution)))
+
+        convergence_rate = np.polyfit(np.log(resolutions), np.log(errors), 1)[0]
+
+        self.assertGreaterEqual(convergence_rate, 1.9)
+
+    def test_product_same_as_1d(self):
+        # Peaceman-Rachford for product initial data is the product of the 1D Crank-Nicolson solutions
+        initial_data_x = heat.InitialDataControlSine([0, 0.5, 0.2])
+        initial_data_y = heat.InitialDataControlSine([0, 0.3, 0, 0.7])
+
+        dt = 1 / 100.
+        dx = 1 / 64.
+        # Not a multiple of dt, so we also get the shorter last step
+        end_time = 0.125
+
+        solution = heat.solve_heat_equation_2d(lambda x, y: initial_data_x(x) * initial_data_y(y), dt, dx, end_time)
+
+        expected = np.outer(heat.solve_heat_equation(initial_data_x, dt, dx, end_time),
+                            heat.solve_heat_equation(initial_data_y, dt, dx, end_time))
+
+        self.assertTrue(np.allclose(expected, solution, rtol=1e-12, atol=1e-14))
+
+    def test_evaluation_points(self):
+        np.random.seed(1)
+        initial_data = heat.InitialDataControlSine2D(np.random.rand(2, 4))
+        dx = 1 / 128.
+        end_time = 0.05
+
+        points = np.random.rand(10, 2)
+        values = heat.solve_heat_equation_2d(initial_data, dx, dx, end_time, evaluation_points=points)
+
+        self.assertEqual((10,), values.shape)
+        self.assertTrue(np.allclose(initial_data.exact_solution(points[:, 0], points[:, 1], end_time), values,
+                                    atol=1e-2))
+
+
+class TestInitialData2D(unittest.TestCase):
+    def test_same_as_sum_of_modes(self):
+        coefficients = np.array([[0.1, 0.4, 0.8], [0.25, 0.75, 0.5]])
+        initial_data = heat.InitialDataControlSine2D(coefficients)
+        x, y = np.meshgrid(np.arange(0, 1, 1 / 64.), np.arange(0, 1, 1 / 32.), indexing='ij')
+        t = 0.01
+        q = 0.75
+
+        expected = sum(coefficients[k, l] * np.sin(k * np.pi * x) * np.sin(l * np.pi * y)
+                       for k in range(2) for l in range(3))
+        expected_exact = sum(coefficients[k, l] * np.exp(-q * np.pi ** 2 * (k ** 2 + l ** 2) * t) *
+                             np.sin(k * np.pi * x) * np.sin(l * np.pi * y)
+                             for k in range(2) for l in range(3))
+
+        self.assertTrue(np.allclose(expected, initial_data(x, y)))
+        self.assertTrue(np.allclose(expected_exact, initial_data.exact_solution(x, y, t, q)))
+
+        # scalars in, scalars out
+        self.assertEqual((), np.shape(initial_data(0.3, 0.6)))
+
+    def test_many_coefficients(self):
+        coefficients = np.random.rand(5, 3, 4)
+        q = np.random.rand(5)
+        x = np.random.rand(7)
+        y = np.random.rand(7)
+        initial_data = heat.InitialDataControlSine2D(coefficients)
+
+        self.assertEqual((5, 7), initial_data(x, y).shape)
+        self.assertEqual((5, 7), initial_data.exact_solution(x, y, 0.1, q).shape)
+
+        for sample in range(5):
+            single = heat.InitialDataControlSine2D(coefficients[sample])
+            self.assertTrue(np.allclose(single(x, y), initial_data(x, y)[sample]))
+            self.assertTrue(np.allclose(single.exact_solution(x, y, 0.1, q[sample]),
+                                        initial_data.exact_solution(x, y, 0.1, q)[sample]))
+
+    def test_grid_same_as_points(self):
+        # On a meshgrid the series is evaluated with the 1D bases, on scattered points in blocks
+        np.random.seed(1)
+        coefficients = np.random.rand(2, 5, 4)
+        initial_data = heat.InitialDataControlSine2D(coefficients)
+
+        x = np.linspace(0, 1, 150)
+        y = np.linspace(0, 1, 130)
+        X, Y = np.meshgrid(x, y, indexing='ij')
+        self.assertGreater(X.size, heat.initial_data.MAX_CACHED_POINTS)
+
+        on_grid = initial_data(X, Y)
+        self.assertEqual((2, 150, 130), on_grid.shape)
+
+        # A permutation is no longer a grid
+        permutation = np.random.permutation(X.size)
+        on_points = initial_data(X.ravel()[permutation], Y.ravel()[permutation])
+        self.assertTrue(np.allclose(on_grid.reshape(2, -1)[:, permutation], on_points))
+
+        # Only the 1D bases of the grid are kept
+        heat.initial_data._cached_sine_basis.cache_clear()
+        initial_data(X, Y)
+        initial_data(X.ravel()[permutation], Y.ravel()[permutation])
+        self.assertEqual(2, heat.initial_data._cached_sine_basis.cache_info().currsize)
+
+
+if __name__ == '__main__':
+    unittest.main()
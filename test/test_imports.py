@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+import unittest
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loaded_modules(statement):
+    """
+    Runs the statement in a fresh interpreter, and returns the names of all the modules it loaded
+    """
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join([REPOSITORY_ROOT, os.path.join(REPOSITORY_ROOT, 'heat_chain'),
+                                                 environment.get('PYTHONPATH', '')])
+
+    output = subprocess.run([sys.executable, '-c', f'{statement}\nimport sys\nprint(" ".join(sys.modules))'],
+                            env=environment, cwd=REPOSITORY_ROOT, capture_output=True, text=True, check=True)
+    return set(output.stdout.split())
+
+
+class TestImports(unittest.TestCase):
+    """
+    The heavy dependencies should only be imported when they are needed, since simulate_heat.py
+    is started on every MPI rank in every iteration
+    """
+
+    def test_heat(self):
+        self.assertNotIn('scipy', loaded_modules('import heat'))
+
+    def test_simulate_heat(self):
+        modules = loaded_modules('import simulate_heat')
+        for heavy_module in ['scipy', 'matplotlib', 'mpi4py']:
+            self.assertNotIn(heavy_module, modules)
+
+    def test_plot_info(self):
+        modules = loaded_modules('import plot_info')
+        for heavy_module in ['matplotlib', 'tikzplotlib', 'PIL', 'IPython', 'git']:
+            self.assertNotIn(heavy_module, modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
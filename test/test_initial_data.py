@@ -0,0 +1,42 @@
+import unittest
+import heat
+import numpy as np
+
+
+class TestInitialData(unittest.TestCase):
+    def test_same_as_sum_of_modes(self):
+        coefficients = [0.1, 0.4, 0.8, 0.25, 0.75]
+        initial_data = heat.InitialDataControlSine(coefficients)
+        x = np.arange(0, 1, 1 / 512.)
+        t = 0.01
+        q = 0.75
+
+        expected = sum(c * np.sin(k * np.pi * x) for k, c in enumerate(coefficients))
+        expected_exact = sum(c * np.exp(-q * (k * np.pi) ** 2 * t) * np.sin(k * np.pi * x)
+                             for k, c in enumerate(coefficients))
+
+        self.assertTrue(np.allclose(expected, initial_data(x)))
+        self.assertTrue(np.allclose(expected_exact, initial_data.exact_solution(x, t, q)))
+
+        # scalars in, scalars out
+        self.assertEqual((), np.shape(initial_data(0.3)))
+        self.assertAlmostEqual(expected_exact[100], initial_data.exact_solution(x[100], t, q))
+
+    def test_many_coefficients(self):
+        coefficients = np.random.rand(5, 9)
+        q = np.random.rand(5)
+        x = np.arange(0, 1, 1 / 256.)
+        initial_data = heat.InitialDataControlSine(coefficients)
+
+        self.assertEqual((5, x.shape[0]), initial_data(x).shape)
+        self.assertEqual((5, x.shape[0]), initial_data.exact_solution(x, 0.1, q).shape)
+
+        for sample in range(5):
+            single = heat.InitialDataControlSine(coefficients[sample])
+            self.assertTrue(np.allclose(single(x), initial_data(x)[sample]))
+            self.assertTrue(np.allclose(single.exact_solution(x, 0.1, q[sample]),
+                                        initial_data.exact_solution(x, 0.1, q)[sample]))
+
+
+if __name__ == '__main__':
+    unittest.main()
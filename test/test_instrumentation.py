@@ -0,0 +1,71 @@
+import unittest
+import heat
+import numpy as np
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_disabled_by_default(self):
+        self.assertIsNone(heat.instrumentation.active_timings())
+
+        with heat.instrument() as timings:
+            self.assertIs(timings, heat.instrumentation.active_timings())
+
+        self.assertIsNone(heat.instrumentation.active_timings())
+
+    def test_nested(self):
+        with heat.instrument() as outer:
+            with heat.instrument() as inner:
+                heat.solve_heat_equation(lambda x: np.sin(np.pi * x), 1 / 64, 1 / 64, 0.25)
+            self.assertIs(outer, heat.instrumentation.active_timings())
+
+        self.assertEqual(16, inner.counts['steps'])
+        self.assertEqual(0, len(outer.counts))
+
+    def test_time_stepping(self):
+        dx = 1 / 64
+        dt = 1 / 128
+        end_time = 0.25
+        heat.clear_operator_cache()
+
+        with heat.instrument() as timings:
+            heat.solve_heat_equation(lambda x: np.sin(np.pi * x), dt, dx, end_time)
+
+        report = timings.as_dict()
+        number_of_steps = int(round(end_time / dt))
+        self.assertEqual(number_of_steps, report['counts']['steps'])
+        self.assertEqual(number_of_steps, report['counts']['linear_solves'])
+
+        for name in ['time_stepping', 'assembly', 'linear_solve', 'rhs']:
+            self.assertIn(name, report['seconds'])
+            self.assertGreaterEqual(report['seconds'][name], 0)
+        self.assertLessEqual(report['seconds']['assembly'] + report['seconds']['linear_solve'],
+                             report['seconds']['time_stepping'])
+
+    def test_sine_series(self):
+        with heat.instrument() as timings:
+            heat.solve_heat_equation_sine_series(np.random.rand(10, 5), 1 / 64, 1 / 64, 0.25,
+                                                 np.array([0.25, 0.5, 0.75]))
+
+        report = timings.as_dict()
+        self.assertEqual(16, report['counts']['steps'])
+        self.assertIn('mode_evolution', report['seconds'])
+        self.assertIn('evaluation', report['seconds'])
+        self.assertNotIn('rhs', report['seconds'])
+
+    def test_merge(self):
+        with heat.instrument() as first:
+            heat.solve_heat_equation(lambda x: np.sin(np.pi * x), 1 / 64, 1 / 64, 0.25)
+        with heat.instrument() as second:
+            heat.solve_heat_equation(lambda x: np.sin(np.pi * x), 1 / 64, 1 / 64, 0.125)
+
+        merged = heat.Timings()
+        merged.merge(first)
+        merged.merge(second.as_dict())
+
+        self.assertEqual(24, merged.counts['steps'])
+        self.assertAlmostEqual(first.seconds['time_stepping'] + second.seconds['time_stepping'],
+                               merged.seconds['time_stepping'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+import tempfile
+import types
+import unittest
+
+try:
+    import matplotlib
+
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+import plot_info
+from plot_info import plot_info as plot_info_module
+
+
+@unittest.skipIf(plt is None, "matplotlib is not installed")
+class TestAsynchronousSaving(unittest.TestCase):
+    def setUp(self):
+        self.original_directory = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+
+        plot_info.showAndSave.silent = True
+        plot_info.setAsynchronousSaving(max_workers=2)
+
+    def tearDown(self):
+        plot_info.setAsynchronousSaving(False)
+        plot_info.savePlot.callback = None
+        os.chdir(self.original_directory)
+        self.directory.cleanup()
+
+    def test_saves_all_plots(self):
+        saved = []
+        plot_info.savePlot.callback = lambda filename, name, title: saved.append(filename)
+
+        for k in range(3):
+            plt.plot([0, 1], [k, 2 * k])
+            plt.title(f"Plot {k}")
+            plot_info.showAndSave(f"plot_{k}")
+
+        plot_info.waitForPlots()
+
+        expected = [f'img/plot_{k}{suffix}.png' for k in range(3) for suffix in ['', '_notitle']]
+        self.assertEqual(sorted(expected), sorted(saved))
+        for filename in expected:
+            self.assertTrue(os.path.exists(filename))
+
+    def test_reports_errors(self):
+        # A file in the way of the output directory
+        open('img', 'w').close()
+
+        plt.plot([0, 1], [0, 1])
+        plot_info.showAndSave("broken")
+
+        with self.assertRaises(Exception):
+            plot_info.waitForPlots()
+
+        # The errors are only reported once
+        plot_info.waitForPlots()
+
+
+@unittest.skipIf(plt is None, "matplotlib is not installed")
+class TestProvenance(unittest.TestCase):
+    def setUp(self):
+        self.original_directory = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+
+        plot_info.showAndSave.silent = True
+
+    def tearDown(self):
+        os.chdir(self.original_directory)
+        self.directory.cleanup()
+
+    def test_cached(self):
+        _, _, sha256 = plot_info_module.get_provenance()
+        snapshot = plot_info_module.get_provenance.snapshot
+
+        self.assertEqual(sha256, plot_info_module.get_provenance()[2])
+        self.assertIs(snapshot, plot_info_module.get_provenance.snapshot)
+
+    def test_new_package(self):
+        _, _, sha256 = plot_info_module.get_provenance()
+
+        sys.modules['fake_package_for_provenance'] = types.ModuleType('fake_package_for_provenance')
+        try:
+            provenance, _, new_sha256 = plot_info_module.get_provenance()
+        finally:
+            del sys.modules['fake_package_for_provenance']
+
+        self.assertNotEqual(sha256, new_sha256)
+        self.assertIn('fake_package_for_provenance', [module['name'] for module in provenance['modules_loaded']])
+
+    def test_sidecar(self):
+        from PIL import Image
+
+        for k in range(2):
+            plt.plot([0, 1], [0, k])
+            plt.title(f"Plot {k}")
+            plot_info.showAndSave(f"plot_{k}")
+
+        sidecars = [filename for filename in os.listdir('img') if filename.startswith('provenance_')]
+        self.assertEqual(1, len(sidecars))
+
+        with Image.open('img/plot_0.png') as image:
+            metadata = image.text
+        self.assertEqual(sidecars[0], metadata['provenance'])
+        self.assertNotIn('modules_loaded', metadata)
+
+        with open(os.path.join('img', sidecars[0])) as f:
+            provenance = json.load(f)
+        self.assertIn('modules_loaded', provenance)
+
+
+if __name__ == '__main__':
+    unittest.main()
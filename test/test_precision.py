@@ -0,0 +1,72 @@
+import unittest
+import heat
+import numpy as np
+
+
+class TestPrecision(unittest.TestCase):
+    """
+    Accuracy of the single precision modes against float64 (relative to the largest value).
+
+    'mixed' only rounds the stored state and the outputs to float32, so the error stays close to the
+    float32 rounding (1e-7), while with 'float32' the round off of every step accumulates (the right hand
+    side of Crank-Nicolson for large dt / dx^2 suffers from cancellation, so time stepping loses a few
+    more digits).
+    """
+
+    def setUp(self):
+        np.random.seed(0)
+        self.dx = 1 / 256.
+        self.end_time = 0.05
+        self.coefficients = np.random.rand(20, 9)
+        self.q = 0.5 + np.random.rand(20)
+        self.initial_states = heat.InitialDataControlSine(self.coefficients)(np.arange(0, 1, self.dx))
+
+    def check(self, solve, float32_tolerance, mixed_tolerance):
+        expected = solve('float64')
+        self.assertEqual(np.float64, expected.dtype)
+
+        for dtype, tolerance in [('float32', float32_tolerance), ('mixed', mixed_tolerance)]:
+            values = solve(dtype)
+            self.assertEqual(np.float32, values.dtype)
+            self.assertEqual(expected.shape, values.shape)
+            self.assertLess(np.max(np.abs(values - expected)) / np.max(np.abs(expected)), tolerance)
+
+    def test_batch(self):
+        for time_integrator in heat.TIME_INTEGRATORS:
+            for method, float32_tolerance in [('time_stepping', 1e-3), ('dst', 1e-5)]:
+                for q in [1.0, self.q]:
+                    self.check(lambda dtype: heat.solve_heat_equation_batch(self.initial_states, self.dx, self.dx,
+                                                                            self.end_time, q=q, method=method,
+                                                                            time_integrator=time_integrator,
+                                                                            dtype=dtype),
+                               float32_tolerance, 1e-6)
+
+    def test_single(self):
+        initial_data = lambda x: np.sin(np.pi * x) + x ** 2
+        for method in ['time_stepping', 'dst']:
+            self.check(lambda dtype: heat.solve_heat_equation(initial_data, self.dx, self.dx, self.end_time,
+                                                              method=method, evaluation_points=[0.25, 0.5],
+                                                              dtype=dtype),
+                       1e-3, 1e-6)
+
+    def test_sine_series(self):
+        control_points = np.array([0.125, 0.25, 0.5, 0.75, 0.825])
+        self.check(lambda dtype: heat.solve_heat_equation_sine_series(self.coefficients, 1 / 2048., 1 / 2048.,
+                                                                      self.end_time, control_points, q=self.q,
+                                                                      dtype=dtype),
+                   1e-5, 1e-6)
+        self.check(lambda dtype: heat.solve_heat_equation_richardson(self.coefficients, self.dx, self.dx,
+                                                                     self.end_time, control_points, q=self.q,
+                                                                     levels=3, dtype=dtype)[0],
+                   1e-5, 1e-6)
+
+    def test_unsupported(self):
+        initial_data = lambda x: np.sin(np.pi * x)
+        with self.assertRaises(Exception):
+            heat.solve_heat_equation(initial_data, self.dx, self.dx, self.end_time, dtype='float16')
+        with self.assertRaises(Exception):
+            heat.solve_heat_equation(initial_data, self.dx, self.dx, self.end_time, adaptive=True, dtype='mixed')
+
+
+if __name__ == '__main__':
+    unittest.main()
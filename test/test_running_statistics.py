@@ -0,0 +1,71 @@
+import unittest
+import numpy as np
+
+from heat_chain.running_statistics import RunningStatistics
+
+
+class TestRunningStatistics(unittest.TestCase):
+    def test_same_as_numpy(self):
+        np.random.seed(0)
+        samples = np.random.rand(50, 8, 3)
+
+        statistics = RunningStatistics()
+        for sample in samples:
+            statistics.update(sample)
+
+        self.assertTrue(np.all(statistics.count == 50))
+        self.assertTrue(np.allclose(np.mean(samples, axis=0), statistics.mean))
+        self.assertTrue(np.allclose(np.var(samples, axis=0, ddof=1), statistics.variance()))
+        self.assertTrue(np.array_equal(np.min(samples, axis=0), statistics.minimum))
+        self.assertTrue(np.array_equal(np.max(samples, axis=0), statistics.maximum))
+
+    def test_different_number_of_iterations(self):
+        statistics = RunningStatistics()
+        statistics.update([1.0, 2.0])
+        statistics.update([3.0, 4.0, 5.0])
+        statistics.update([5.0])
+
+        self.assertEqual([3, 2, 1], statistics.count.tolist())
+        self.assertTrue(np.allclose([3.0, 3.0, 5.0], statistics.mean))
+        self.assertTrue(np.allclose([4.0, 2.0], statistics.variance()[:2]))
+        self.assertTrue(np.isnan(statistics.variance()[2]))
+
+    def test_quantiles(self):
+        np.random.seed(1)
+        samples = np.random.randn(5000, 4)
+
+        statistics = RunningStatistics(quantiles=[0.25, 0.5, 0.9])
+        for sample in samples:
+            statistics.update(sample)
+
+        for quantile in statistics.quantiles:
+            self.assertTrue(np.allclose(np.quantile(samples, quantile.p, axis=0), quantile.value(), atol=0.05))
+
+    def test_few_samples_exact(self):
+        samples = np.array([[4.0, 1.0], [2.0, 7.0], [3.0, 5.0]])
+
+        statistics = RunningStatistics(quantiles=[0.5])
+        for sample in samples:
+            statistics.update(sample)
+
+        self.assertTrue(np.allclose(np.median(samples, axis=0), statistics.quantiles[0].value()))
+
+    def test_resume_from_state(self):
+        np.random.seed(2)
+        samples = np.random.rand(20, 6)
+
+        statistics = RunningStatistics()
+        for sample in samples[:10]:
+            statistics.update(sample)
+
+        resumed = RunningStatistics.from_state(statistics.state())
+        for sample in samples[10:]:
+            statistics.update(sample)
+            resumed.update(sample)
+
+        for name, array in statistics.state().items():
+            self.assertTrue(np.array_equal(array, resumed.state()[name]), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
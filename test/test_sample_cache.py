@@ -0,0 +1,124 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+# sample_cache.py lives next to the scripts in heat_chain
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'heat_chain'))
+import sample_cache
+
+
+class TestSampleCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = {'control_points': [0.125, 0.25, 0.5],
+                         'end_time': 0.05,
+                         'dx': 1.0 / 256,
+                         'dt': 1.0 / 256,
+                         'richardson_levels': None,
+                         'time_integrator': 'crank_nicolson',
+                         'dtype': 'float64'}
+
+        np.random.seed(0)
+        self.parameters = np.random.rand(20, 4)
+        self.values = np.random.rand(20, 3)
+
+        # Every test starts as a new process would
+        sample_cache._loaded_entries.clear()
+
+    def tearDown(self):
+        sample_cache._loaded_entries.clear()
+        shutil.rmtree(self.directory)
+
+    def number_of_samples_on_disk(self):
+        sample_cache._loaded_entries.clear()
+        _, found = sample_cache.SampleCache(self.directory).lookup(self.parameters, self.settings, 3)
+        return np.sum(found)
+
+    def test_store_and_lookup(self):
+        cache = sample_cache.SampleCache(self.directory)
+        values, found = cache.lookup(self.parameters, self.settings, 3)
+        self.assertFalse(np.any(found))
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(20, cache.misses)
+
+        cache.store(self.parameters[:10], self.values[:10], self.settings)
+
+        values, found = cache.lookup(self.parameters, self.settings, 3)
+        self.assertEqual([True] * 10 + [False] * 10, found.tolist())
+        self.assertTrue(np.array_equal(self.values[:10], values[:10]))
+        self.assertTrue(np.all(values[10:] == 0))
+        self.assertEqual(10, cache.hits)
+
+        # Read from disk again
+        sample_cache._loaded_entries.clear()
+        values, found = sample_cache.SampleCache(self.directory).lookup(self.parameters[:10], self.settings, 3)
+        self.assertTrue(np.all(found))
+        self.assertTrue(np.array_equal(self.values[:10], values))
+
+    def test_other_settings(self):
+        cache = sample_cache.SampleCache(self.directory)
+        cache.store(self.parameters, self.values, self.settings)
+
+        _, found = cache.lookup(self.parameters, dict(self.settings, dx=1.0 / 512), 3)
+        self.assertFalse(np.any(found))
+
+    def test_hash_collision_is_a_miss(self):
+        row_hashes = sample_cache._row_hashes
+        try:
+            sample_cache._row_hashes = lambda parameters: np.zeros(parameters.shape[0], dtype=np.uint64)
+
+            cache = sample_cache.SampleCache(self.directory)
+            cache.store(self.parameters[:1], self.values[:1], self.settings)
+
+            values, found = cache.lookup(self.parameters[:2], self.settings, 3)
+            self.assertEqual([True, False], found.tolist())
+            self.assertTrue(np.array_equal(self.values[0], values[0]))
+        finally:
+            sample_cache._row_hashes = row_hashes
+
+    def test_changes_by_other_processes_are_seen(self):
+        cache = sample_cache.SampleCache(self.directory)
+        cache.store(self.parameters[:10], self.values[:10], self.settings)
+        cache.lookup(self.parameters, self.settings, 3)
+
+        # A shard written by another process (which does not update _loaded_entries here)
+        settings_directory = cache._settings_directory(self.settings, 4)
+        sample_cache._write_shard(settings_directory, 'samples', parameters=self.parameters[10:],
+                                  values=self.values[10:], last_used=np.zeros(10))
+        _, found = cache.lookup(self.parameters, self.settings, 3)
+        self.assertTrue(np.all(found))
+
+        # The cache was removed
+        shutil.rmtree(settings_directory)
+        _, found = sample_cache.SampleCache(self.directory).lookup(self.parameters, self.settings, 3)
+        self.assertFalse(np.any(found))
+
+    def test_evict_least_recently_used(self):
+        cache = sample_cache.SampleCache(self.directory, max_entries=15)
+        cache.store(self.parameters[:10], self.values[:10], self.settings)
+        cache.store(self.parameters[10:], self.values[10:], self.settings)
+
+        # Half of the oldest samples were used most recently, the other half are evicted
+        sample_cache._loaded_entries.clear()
+        cache.lookup(self.parameters[:5], self.settings, 3)
+
+        self.assertEqual(5, cache.evict())
+
+        sample_cache._loaded_entries.clear()
+        values, found = sample_cache.SampleCache(self.directory).lookup(self.parameters, self.settings, 3)
+        self.assertEqual([True] * 5 + [False] * 5 + [True] * 10, found.tolist())
+        self.assertTrue(np.array_equal(self.values[found], values[found]))
+
+        # The hits of the lookup above are merged into the one shard
+        settings_directory = cache._settings_directory(self.settings, 4)
+        self.assertEqual(2, len(os.listdir(settings_directory)))
+        self.assertEqual(0, cache.evict())
+        self.assertEqual(1, len(os.listdir(settings_directory)))
+        self.assertEqual(15, self.number_of_samples_on_disk())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import numpy as np
+import numpy.lib.format
+
+# sample_store.py lives next to the scripts in heat_chain
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'heat_chain'))
+import sample_store
+
+
+class TestSampleStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        np.random.seed(0)
+        self.rows = np.random.rand(10, 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def filename(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_binary_append(self):
+        filename = self.filename('values.npy')
+        sample_store.append_rows(filename, self.rows[:4])
+        sample_store.append_rows(filename, self.rows[4:9])
+        sample_store.append_rows(filename, self.rows[9:])
+
+        self.assertEqual(10, sample_store.count_rows(filename))
+        self.assertTrue(np.array_equal(self.rows, np.load(filename)))
+
+        # Only the header and the rows, the header is rewritten in place
+        self.assertEqual(128 + self.rows.nbytes, os.path.getsize(filename))
+
+    def test_binary_append_one_dimensional(self):
+        # simulate_heat.py writes one file per control point
+        filename = self.filename('values_0.npy')
+        sample_store.write_rows(filename, self.rows[:5, 0])
+        sample_store.append_rows(filename, self.rows[5:, 0].astype(np.float32))
+
+        values = np.load(filename)
+        self.assertEqual(np.float64, values.dtype)
+        self.assertTrue(np.allclose(self.rows[:, 0], values))
+        self.assertEqual((10, 1), sample_store.load_rows(filename).shape)
+
+    def test_append_to_file_from_np_save(self):
+        filename = self.filename('values.npy')
+        np.save(filename, self.rows[:6])
+
+        sample_store.append_rows(filename, self.rows[6:])
+
+        self.assertTrue(np.array_equal(self.rows, np.load(filename)))
+        self.assertEqual(128 + self.rows.nbytes, os.path.getsize(filename))
+
+    def test_append_to_file_with_other_header_size(self):
+        filename = self.filename('values.npy')
+
+        # A valid version 1.0 header that is longer than ours
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': (6, 3), }"
+        header_length = 256 - 10
+        with open(filename, 'wb') as f:
+            f.write(numpy.lib.format.magic(1, 0) + struct.pack('<H', header_length) + header.encode('latin1') +
+                    b' ' * (header_length - len(header) - 1) + b'\n')
+            f.write(self.rows[:6].tobytes())
+        self.assertTrue(np.array_equal(self.rows[:6], np.load(filename)))
+
+        sample_store.append_rows(filename, self.rows[6:])
+
+        self.assertTrue(np.array_equal(self.rows, np.load(filename)))
+        self.assertEqual(128 + self.rows.nbytes, os.path.getsize(filename))
+
+    def test_append_wrong_shape(self):
+        filename = self.filename('values.npy')
+        sample_store.write_rows(filename, self.rows)
+
+        with self.assertRaises(Exception):
+            sample_store.append_rows(filename, np.zeros((2, 4)))
+
+    def test_load_rows(self):
+        binary_filename = self.filename('parameters.npy')
+        text_filename = self.filename('parameters.txt')
+        sample_store.write_rows(binary_filename, self.rows)
+
+        # Comments and empty lines are not rows
+        with open(text_filename, 'w') as f:
+            f.write('# parameters\n\n')
+        sample_store.append_rows(text_filename, self.rows[:5])
+        with open(text_filename, 'a') as f:
+            f.write('\n')
+        sample_store.append_rows(text_filename, self.rows[5:])
+
+        for filename in [binary_filename, text_filename]:
+            self.assertEqual(10, sample_store.count_rows(filename))
+            self.assertTrue(np.array_equal(self.rows, sample_store.load_rows(filename)))
+            self.assertTrue(np.array_equal(self.rows[2:7], sample_store.load_rows(filename, 2, 7)))
+            self.assertTrue(np.array_equal(self.rows[8:], sample_store.load_rows(filename, 8)))
+            self.assertTrue(np.array_equal(self.rows[4:5], sample_store.load_rows(filename, 4, 5)))
+
+    def test_text_append_only_writes_new_rows(self):
+        filename = self.filename('values.txt')
+        sample_store.write_rows(filename, self.rows[:5])
+        size = os.path.getsize(filename)
+
+        sample_store.append_rows(filename, self.rows[5:])
+
+        self.assertEqual(2 * size, os.path.getsize(filename))
+        self.assertTrue(np.array_equal(self.rows, np.loadtxt(filename)))
+
+    def test_convert_text_to_binary(self):
+        text_filename = self.filename('parameters.txt')
+        binary_filename = self.filename('parameters.npy')
+        np.savetxt(text_filename, self.rows)
+
+        sample_store.convert_text_to_binary(text_filename, binary_filename)
+
+        self.assertTrue(np.array_equal(self.rows, np.load(binary_filename)))
+
+        # The converted file can be appended to
+        sample_store.append_rows(binary_filename, self.rows)
+        self.assertEqual(20, sample_store.count_rows(binary_filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import heat
+import numpy as np
+
+HEAT_CHAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'heat_chain')
+
+# simulate_heat.py is a script in heat_chain (it imports its neighbours directly)
+sys.path.insert(0, HEAT_CHAIN)
+import simulate_heat
+import sample_store
+
+try:
+    import mpi4py
+except ImportError:
+    mpi4py = None
+
+
+class TestSamplesForRank(unittest.TestCase):
+    def check_partition(self, number_of_samples, number_of_processes):
+        blocks = [simulate_heat.samples_for_rank(number_of_samples, number_of_processes, rank)
+                  for rank in range(number_of_processes)]
+
+        # Contiguous blocks, in order, covering every sample once
+        self.assertEqual(0, blocks[0][0])
+        self.assertEqual(number_of_samples, blocks[-1][1])
+        for (_, end), (next_start, _) in zip(blocks[:-1], blocks[1:]):
+            self.assertEqual(end, next_start)
+        for start, end in blocks:
+            self.assertLessEqual(start, end)
+
+        return blocks
+
+    def test_even(self):
+        self.assertEqual([(0, 3), (3, 6), (6, 9)], self.check_partition(9, 3))
+
+    def test_uneven(self):
+        self.assertEqual([(0, 4), (4, 8), (8, 10)], self.check_partition(10, 3))
+        for number_of_samples in range(20):
+            for number_of_processes in range(1, 8):
+                self.check_partition(number_of_samples, number_of_processes)
+
+    def test_more_ranks_than_samples(self):
+        self.assertEqual([(0, 1), (1, 2), (2, 2), (2, 2)], self.check_partition(2, 4))
+
+    def test_no_samples(self):
+        self.assertEqual([(0, 0), (0, 0), (0, 0)], self.check_partition(0, 3))
+
+    def test_gather_counts_and_displacements(self):
+        counts, displacements = simulate_heat.gather_counts_and_displacements(10, 3, 5)
+        self.assertEqual([20, 20, 10], counts)
+        self.assertEqual([0, 20, 40], displacements)
+
+        counts, displacements = simulate_heat.gather_counts_and_displacements(2, 4, 5)
+        self.assertEqual([5, 5, 0, 0], counts)
+        self.assertEqual([0, 5, 10, 10], displacements)
+
+        counts, displacements = simulate_heat.gather_counts_and_displacements(0, 2, 5)
+        self.assertEqual([0, 0], counts)
+        self.assertEqual([0, 0], displacements)
+
+
+class TestBackends(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = {'control_points': [0.125, 0.25, 0.5, 0.75, 0.825],
+                         'end_time': 0.01,
+                         'dimension': 6,
+                         'dx': 1.0 / 256,
+                         'dt': 1.0 / 256,
+                         'richardson_levels': None,
+                         'time_integrator': 'crank_nicolson',
+                         'dtype': 'float64'}
+
+        np.random.seed(0)
+        self.parameters = np.random.rand(37, 6)
+        self.parameters_file = os.path.join(self.directory, 'parameters.npy')
+        sample_store.write_rows(self.parameters_file, self.parameters)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def serial(self, selected_rows):
+        return simulate_heat.simulate(self.parameters[selected_rows], self.settings, 8)
+
+    def test_process_pool_same_as_serial(self):
+        for selected_rows in [slice(0, None), slice(2, 30), slice(5, 6)]:
+            values, reports = simulate_heat.run_process_pool(self.parameters_file, selected_rows, self.settings, 8,
+                                                             2, 4)
+
+            self.assertTrue(np.array_equal(self.serial(selected_rows), values))
+
+            report = simulate_heat.make_report(reports, 1.0, 'process_pool', self.settings)
+            self.assertEqual(values.shape[0], report['number_of_samples'])
+
+    def test_process_pool_empty_slice(self):
+        values, reports = simulate_heat.run_process_pool(self.parameters_file, slice(10, 10), self.settings, 8, 2, 4)
+
+        self.assertEqual((0, 5), values.shape)
+        self.assertEqual(0, simulate_heat.make_report(reports, 0.0, 'process_pool', self.settings)['number_of_samples'])
+
+    def test_merge_chunk_reports(self):
+        timings = heat.Timings().as_dict()
+        chunk_reports = [{'pid': 11, 'number_of_samples': 4, 'seconds': 1.0, 'timings': timings, 'cache_hits': 1,
+                          'cache_misses': 3},
+                         {'pid': 7, 'number_of_samples': 2, 'seconds': 0.5, 'timings': timings, 'cache_hits': 0,
+                          'cache_misses': 2},
+                         {'pid': 11, 'number_of_samples': 4, 'seconds': 1.0, 'timings': timings, 'cache_hits': 2,
+                          'cache_misses': 2}]
+
+        reports = simulate_heat._merge_chunk_reports(chunk_reports)
+
+        self.assertEqual([7, 11], [report['pid'] for report in reports])
+        self.assertEqual([0, 1], [report['rank'] for report in reports])
+        self.assertEqual([1, 2], [report['number_of_chunks'] for report in reports])
+        self.assertEqual([2, 8], [report['number_of_samples'] for report in reports])
+        self.assertEqual([0, 3], [report['cache_hits'] for report in reports])
+        self.assertEqual([2, 5], [report['cache_misses'] for report in reports])
+        self.assertEqual([4.0, 4.0], [report['samples_per_second'] for report in reports])
+
+    @unittest.skipIf(mpi4py is None, "mpi4py is not installed")
+    def test_mpi_single_rank_same_as_serial(self):
+        from mpi4py import MPI
+
+        for selected_rows in [slice(0, None), slice(2, 30), slice(10, 10)]:
+            values, reports = simulate_heat.run_mpi(self.parameters_file, selected_rows, self.settings, 8,
+                                                    comm=MPI.COMM_SELF)
+
+            self.assertTrue(np.array_equal(self.serial(selected_rows), values))
+            self.assertEqual(1, len(reports))
+
+    @unittest.skipIf(mpi4py is None or shutil.which('mpirun') is None, "needs mpi4py and mpirun")
+    def test_mpi_ranks_same_as_process_pool(self):
+        # 28 samples on three ranks, so the last rank gets fewer samples
+        shutil.copy(os.path.join(HEAT_CHAIN, 'objective_parameters.json'), self.directory)
+
+        environment = dict(os.environ)
+        environment['PYTHONPATH'] = os.pathsep.join([os.path.dirname(HEAT_CHAIN),
+                                                     environment.get('PYTHONPATH', '')])
+
+        outputs = {}
+        for backend, command in [('mpi', ['mpirun', '-np', '3', sys.executable]),
+                                 ('process_pool', [sys.executable])]:
+            output_files = [f'{backend}_{k}.npy' for k in range(5)]
+            command = command + [os.path.join(HEAT_CHAIN, 'simulate_heat.py'), '--backend', backend,
+                                 '--input_parameters_file', 'parameters.npy', '--output_values_files'] + \
+                output_files + ['--starting_sample', '0', '--iteration_number', '0', '--start', '2', '--end', '30']
+            if backend == 'process_pool':
+                command += ['--number_of_processes', '2', '--chunk_size', '5']
+
+            subprocess.run(command, cwd=self.directory, env=environment, check=True, stdout=subprocess.DEVNULL)
+            outputs[backend] = np.stack([np.load(os.path.join(self.directory, filename))
+                                         for filename in output_files], axis=1)
+
+        self.assertEqual((28, 5), outputs['mpi'].shape)
+        self.assertTrue(np.array_equal(outputs['process_pool'], outputs['mpi']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import numpy as np
+import heat.tridiagonal
+from heat.tridiagonal import SymmetricTridiagonalSolver, BatchedSymmetricTridiagonalSolver
+
+
+class TestTridiagonal(unittest.TestCase):
+    def check_against_dense(self, diagonal, off_diagonal, rhs):
+        matrix = np.diag(diagonal) + np.diag(off_diagonal, -1) + np.diag(off_diagonal, 1)
+
+        solver = SymmetricTridiagonalSolver(diagonal, off_diagonal)
+
+        solution = solver.solve(rhs)
+
+        self.assertEqual(rhs.shape, solution.shape)
+        self.assertTrue(np.allclose(np.linalg.solve(matrix, rhs), solution))
+
+    def test_positive_definite(self):
+        for n in [1, 2, 3, 17, 256]:
+            diagonal = 2.5 * np.ones(n)
+            off_diagonal = -np.ones(n - 1)
+            self.check_against_dense(diagonal, off_diagonal, np.random.rand(n))
+
+    def test_multiple_right_hand_sides(self):
+        n = 64
+        diagonal = 1 + np.random.rand(n)
+        off_diagonal = -0.5 * np.random.rand(n - 1)
+        self.check_against_dense(diagonal, off_diagonal, np.random.rand(n, 5))
+
+    def test_indefinite(self):
+        # should fall back to the general LU factorization
+        n = 32
+        diagonal = -0.5 * np.ones(n)
+        off_diagonal = 0.75 * np.ones(n - 1)
+        self.check_against_dense(diagonal, off_diagonal, np.random.rand(n))
+
+    def test_single_precision(self):
+        for n in [1, 64]:
+            diagonal = 2.5 * np.ones(n)
+            off_diagonal = -np.ones(n - 1)
+            rhs = np.random.rand(n, 3)
+            matrix = np.diag(diagonal) + np.diag(off_diagonal, -1) + np.diag(off_diagonal, 1)
+
+            solution = SymmetricTridiagonalSolver(diagonal, off_diagonal, dtype=np.float32).solve(rhs)
+
+            self.assertEqual(np.float32, solution.dtype)
+            self.assertTrue(np.allclose(np.linalg.solve(matrix, rhs), solution, rtol=1e-5, atol=1e-6))
+
+
+
+class TestBatchedTridiagonal(unittest.TestCase):
+    def check_against_single(self, n, m, dtype=np.float64):
+        np.random.seed(n + m)
+        diagonal = 2 + np.random.rand(n, m)
+        off_diagonal = -np.random.rand(n - 1, m)
+        rhs = np.random.rand(n, m)
+
+        solution = BatchedSymmetricTridiagonalSolver(diagonal, off_diagonal, dtype=dtype).solve(rhs)
+
+        self.assertEqual((n, m), solution.shape)
+        self.assertEqual(dtype, solution.dtype)
+        for column in range(m):
+            expected = SymmetricTridiagonalSolver(diagonal[:, column], off_diagonal[:, column]).solve(rhs[:, column])
+            self.assertTrue(np.allclose(expected, solution[:, column], rtol=1e-5 if dtype == np.float32 else 1e-12))
+
+    def test_block_diagonal_and_sweep(self):
+        minimum_systems = heat.tridiagonal.BATCHED_SWEEP_MINIMUM_SYSTEMS
+        try:
+            for sweep_minimum_systems in [minimum_systems, 1]:
+                heat.tridiagonal.BATCHED_SWEEP_MINIMUM_SYSTEMS = sweep_minimum_systems
+                for n, m in [(1, 1), (1, 3), (2, 1), (17, 5), (64, 32)]:
+                    self.check_against_single(n, m)
+                self.check_against_single(64, 8, np.float32)
+        finally:
+            heat.tridiagonal.BATCHED_SWEEP_MINIMUM_SYSTEMS = minimum_systems
+
+    def test_shared_factorization(self):
+        diagonal = 2.5 * np.ones((32, 1))
+        off_diagonal = -np.ones((31, 1))
+        rhs = np.random.rand(32, 4)
+
+        solution = BatchedSymmetricTridiagonalSolver(diagonal, off_diagonal).solve(rhs)
+
+        self.assertTrue(np.allclose(SymmetricTridiagonalSolver(diagonal[:, 0], off_diagonal[:, 0]).solve(rhs),
+                                    solution))
+
+    def test_not_positive_definite(self):
+        with self.assertRaises(Exception):
+            BatchedSymmetricTridiagonalSolver(-np.ones((8, 3)), np.zeros((7, 3)))
+
+
+if __name__ == '__main__':
+    unittest.main()